@@ -0,0 +1,295 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+# ============================================================================
+# StamFree Backend - Admission Control
+# ============================================================================
+# Under a burst every upload used to be accepted and everyone slowed down;
+# the app's upload timeout then fired and its retries made it worse. Two
+# layers keep latency bounded for the requests we do take:
+#   - Endpoint gates: each upload endpoint has a concurrency limit and a
+#     bounded wait queue. A full queue (or a wait past ADMISSION_MAX_WAIT_S)
+#     fails fast with 429 + Retry-After instead of queueing unboundedly.
+#   - Work gates: "cpu" (WavLM forward, pitch tracking) and "stt" (recognizer
+#     calls) admit waiters by endpoint priority, so a cheap /analyze/balloon
+#     is not stuck behind a long /analyze_audio.
+# Waits are recorded as metrics stages (admission_wait, cpu_wait, stt_wait),
+# so they show in Server-Timing and /metrics. Limits are per process.
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_WAIT_S = float(os.environ.get("ADMISSION_MAX_WAIT_S", "5"))  # Clients give up at 10-15 s
+RETRY_AFTER_MAX_S = 30
+CPU_SLOTS = int(os.environ.get("CPU_SLOTS", str(os.cpu_count() or 2)))
+STT_SLOTS = int(os.environ.get("STT_SLOTS", "16"))
+
+# Lower runs first; endpoints not listed get DEFAULT_PRIORITY
+ENDPOINT_PRIORITY = {
+    "analyze_balloon": 0,  # WavLM + breath only
+    "analyze_snake": 1,
+    "analyze_tapping": 1,
+    "analyze_turtle": 1,
+    "analyze_audio": 2,  # Sliding windows over up to 30 s
+    "analyze_batch": 3,  # Offline sync, can wait
+}
+DEFAULT_PRIORITY = 1
+
+# endpoint -> (concurrent requests, queued requests); override with e.g. ADMISSION_ANALYZE_AUDIO=2,4
+ENDPOINT_LIMITS = {
+    "analyze_balloon": (8, 16),
+    "analyze_snake": (4, 8),
+    "analyze_tapping": (4, 8),
+    "analyze_turtle": (16, 32),  # Mostly waiting on STT
+    "analyze_audio": (2, 4),
+    "analyze_batch": (1, 2),
+}
+
+
+def _limits(endpoint, default):
+    value = os.environ.get(f"ADMISSION_{endpoint.upper()}")
+    if not value:
+        return default
+    limit, _, queue = value.partition(",")
+    return int(limit), int(queue or default[1])
+
+
+class Overloaded(Exception):
+    """A gate's wait queue is full (or the wait ran out); the request should be retried later."""
+
+    def __init__(self, gate, reason, retry_after):
+        super().__init__(f"{gate} is overloaded ({reason})")
+        self.gate = gate
+        self.reason = reason  # "queue_full" | "wait_timeout"
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A queued acquire; woken by release() once it has been handed a slot."""
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.cancelled = False
+        self._loop = loop
+        self._event = None if loop else threading.Event()
+        self._future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(lambda: self._future.done() or self._future.set_result(None))
+        else:
+            self._event.set()
+
+
+class Gate:
+    """
+    `slots` concurrent holders; waiters are served by (priority, arrival).
+    With max_queue / max_wait set, acquire() raises Overloaded instead of
+    waiting behind a full queue or for longer than max_wait seconds.
+    """
+
+    def __init__(self, name, slots, max_queue=None, max_wait=None):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = []  # heap of (priority, seq, waiter)
+        self._queued = 0
+        self._seq = itertools.count()
+
+        # Stats
+        self._admitted = 0
+        self._rejected = 0
+        self._wait_s_total = 0.0
+        self._hold_s = 1.0  # Moving average of how long a slot is held (Retry-After estimate)
+
+    def _enter(self, priority, loop=None):
+        """Take a free slot, or queue a waiter (None when the slot was taken)."""
+        with self._lock:
+            if self._in_use < self.slots and not self._queued:
+                self._in_use += 1
+                self._admitted += 1
+                return None
+            if self.max_queue is not None and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise Overloaded(self.name, "queue_full", self._retry_after())
+            waiter = _Waiter(loop)
+            heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+            self._queued += 1
+            return waiter
+
+    def _give_up(self, waiter, rejected=True):
+        """A waiter timed out or was cancelled: True if it got a slot anyway, else it leaves the queue."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self._queued -= 1
+            if rejected:
+                self._rejected += 1
+            return False
+
+    def _retry_after(self):
+        # Time for everyone queued (plus this request) to get through the slots
+        return max(1, min(RETRY_AFTER_MAX_S, math.ceil(self._hold_s * (self._queued + 1) / self.slots)))
+
+    def acquire(self, priority=DEFAULT_PRIORITY):
+        """Block for a slot; returns the seconds waited."""
+        t0 = time.perf_counter()
+        waiter = self._enter(priority)
+        if waiter is not None and not waiter._event.wait(self.max_wait):
+            if not self._give_up(waiter):
+                raise Overloaded(self.name, "wait_timeout", self._retry_after())
+        return self._waited(t0)
+
+    async def acquire_async(self, priority=DEFAULT_PRIORITY):
+        """acquire() for the event loop."""
+        t0 = time.perf_counter()
+        waiter = self._enter(priority, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter._future), self.max_wait)
+            except asyncio.TimeoutError:
+                if not self._give_up(waiter):
+                    raise Overloaded(self.name, "wait_timeout", self._retry_after())
+            except asyncio.CancelledError:
+                # Client went away (or shutdown) while queued: a slot handed over meanwhile goes back
+                if self._give_up(waiter, rejected=False):
+                    self.release()
+                raise
+        return self._waited(t0)
+
+    def _waited(self, t0):
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self._wait_s_total += waited
+        return waited
+
+    def release(self, held_s=None):
+        """Free a slot, handing it straight to the best waiter."""
+        with self._lock:
+            if held_s is not None:
+                self._hold_s = 0.8 * self._hold_s + 0.2 * held_s
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self._queued -= 1
+                self._admitted += 1
+                waiter.wake()
+                return
+            self._in_use -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "inUse": self._in_use,
+                "queued": self._queued,
+                "maxQueue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "avgWaitMs": round(self._wait_s_total / self._admitted * 1000.0, 1) if self._admitted else 0.0,
+                "avgHoldMs": round(self._hold_s * 1000.0, 1),
+            }
+
+
+# --- GATES ---
+cpu = Gate("cpu", CPU_SLOTS)
+stt = Gate("stt", STT_SLOTS)
+endpoint_gates = {
+    endpoint: Gate(endpoint, *_limits(endpoint, default), max_wait=ADMISSION_MAX_WAIT_S)
+    for endpoint, default in ENDPOINT_LIMITS.items()
+}
+
+_priority = contextvars.ContextVar("stamfree_priority", default=DEFAULT_PRIORITY)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def priority(value):
+    """Run a block at a priority (the WavLM scheduler serving a batch)."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _admission_gate(endpoint):
+    return endpoint_gates.get(endpoint) if ADMISSION_ENABLED else None
+
+
+@contextmanager
+def admitted(endpoint):
+    """Hold one of the endpoint's request slots (raises Overloaded); sets the request's priority."""
+    gate = _admission_gate(endpoint)
+    with priority(ENDPOINT_PRIORITY.get(endpoint, DEFAULT_PRIORITY)):
+        if gate is None:
+            yield
+            return
+        metrics.observe("admission_wait", gate.acquire(current_priority()))
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            gate.release(time.perf_counter() - t0)
+
+
+@asynccontextmanager
+async def admitted_async(endpoint):
+    """admitted() for the event loop."""
+    gate = _admission_gate(endpoint)
+    with priority(ENDPOINT_PRIORITY.get(endpoint, DEFAULT_PRIORITY)):
+        if gate is None:
+            yield
+            return
+        metrics.observe("admission_wait", await gate.acquire_async(current_priority()))
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            gate.release(time.perf_counter() - t0)
+
+
+@contextmanager
+def using(gate):
+    """Hold a work gate slot at the current request's priority."""
+    metrics.observe(f"{gate.name}_wait", gate.acquire(current_priority()))
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        gate.release(time.perf_counter() - t0)
+
+
+@asynccontextmanager
+async def using_async(gate):
+    metrics.observe(f"{gate.name}_wait", await gate.acquire_async(current_priority()))
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        gate.release(time.perf_counter() - t0)
+
+
+def stats():
+    return {
+        "enabled": ADMISSION_ENABLED,
+        "maxWaitS": ADMISSION_MAX_WAIT_S,
+        "work": {gate.name: gate.stats() for gate in (cpu, stt)},
+        "endpoints": {name: gate.stats() for name, gate in endpoint_gates.items()},
+    }
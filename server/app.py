@@ -1,34 +1,55 @@
-import os
+import asyncio
 import io
+import json
+import os
 import time
+_IMPORT_T0 = time.perf_counter()
 import random
+import tempfile
+import threading
 import numpy as np
-import librosa
-import torch
-from flask import Flask, request, jsonify
+import soundfile as sf
+from flask import Flask, Request, Response, g, request, jsonify, send_file
 from flask_cors import CORS
+from werkzeug.datastructures import ImmutableMultiDict
 from werkzeug.utils import secure_filename
-from google.cloud import speech
-from pydub import AudioSegment
-from g2p_en import G2p
-import nltk
-from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
-import soundfile as sf
+from audio_clip import AudioClip, as_clip, load_clip
+from audio_decoders import CLIP_MAX_SECONDS, ClipTooLongError, decoder_status
+from model_loader import INFERENCE_BACKEND, MODEL_QUANTIZE, MODEL_SHARE, load_onnx_classifier, load_wavlm, model_fingerprint
+from inference_scheduler import InferenceScheduler, equal_length_batches
+from stage_runner import Stage, drive_jobs, failed_error, run_job, submit as submit_background
+from clip_features import find_runs
+from stt_client import STT_LANGUAGE, STT_TRANSPORT, get_transport
+from voicing import VOICING_BACKEND
+from result_cache import ResultCache, cached_by_audio
+import admission
+import latency_budget
+import metrics
+import phonemes
+import profiling
+from streaming import SessionRegistry, StreamingSession
+from startup import StartupTracker
+from process_memory import process_memory
 
 # ============================================================================
 # StamFree Backend - WavLM Speech Analysis Server
 # ============================================================================
 
-# --- NLTK SETUP ---
-try:
-    nltk.data.find('taggers/averaged_perceptron_tagger_eng')
-except LookupError:
-    nltk.download('averaged_perceptron_tagger_eng')
-    nltk.download('cmudict')
+# --- STARTUP ---
+# Heavy imports (transformers, librosa, g2p_en, Google client) happen on first
+# use; G2P, WavLM and warmup run in run_startup(). NLTK data is never downloaded
+# here (see fetch_nltk_data.py).
+startup = StartupTracker()
+startup.record("imports", (time.perf_counter() - _IMPORT_T0) * 1000.0)
 
 # --- TORCH THREADING (reduce CPU context switching on small instances) ---
-torch.set_num_threads(1)
-torch.set_num_interop_threads(1)
+# torch (and early_exit, which needs it) is only imported for the torch backend:
+# an ONNX worker never loads it (ONNX Runtime threads: ORT_INTRA_OP_THREADS)
+if INFERENCE_BACKEND != "onnx":
+    import torch
+
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(1)
  
 # --- CONFIGURATION ---
 PORT = int(os.environ.get('PORT', 5000))
@@ -58,133 +79,254 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_PATH
 SAMPLE_RATE = 16000
 MAX_AUDIO_BYTES = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {'wav', 'm4a', 'mp3', 'webm'}
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(4 * 1024 * 1024)))  # Larger uploads spill to a temp file
+# Resampler quality per endpoint ("fast" / "balanced" / "high"); override with e.g. RESAMPLE_QUALITY_BALLOON=high
+RESAMPLE_QUALITY = {
+    endpoint: os.environ.get(f"RESAMPLE_QUALITY_{endpoint.upper()}", default)
+    for endpoint, default in {
+        "analyze_audio": "high",
+        "snake": "balanced",
+        "turtle": "balanced",
+        "tapping": "balanced",
+        "balloon": "fast",  # Breath onset + WavLM only
+    }.items()
+}
 SPEECH_PROB_MIN = float(os.environ.get("SPEECH_PROB_MIN", "0.35"))
 PITCHED_RATIO_MIN = float(os.environ.get("PITCHED_RATIO_MIN", "0.15"))
 PROGRESSION_CONFIDENCE = 0.75
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", "8"))
+# Off by default: measure with benchmark.py on the target machine first (docs/ARCHITECTURE.md 10.5)
+MICROBATCH_ENABLED = os.environ.get("MICROBATCH_ENABLED", "0") == "1"
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", "5"))
+MICROBATCH_WORKERS = int(os.environ.get("MICROBATCH_WORKERS", str(admission.CPU_SLOTS)))  # Batches run in parallel
+
+# --- PER-STAGE DEADLINES (seconds) ---
+STT_TIMEOUT_S = float(os.environ.get("STT_TIMEOUT_S", "8"))
+WAVLM_TIMEOUT_S = float(os.environ.get("WAVLM_TIMEOUT_S", "10"))
+DSP_TIMEOUT_S = float(os.environ.get("DSP_TIMEOUT_S", "6"))
+
+# --- STARTUP MODE ---
+# "blocking" loads everything before the app object is served;
+# "background" answers /health/live at once and loads on a thread
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "blocking").strip().lower()
+STARTUP_WAIT_S = float(os.environ.get("STARTUP_WAIT_S", "30"))  # Requests wait this long for readiness, then 503
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1") == "1"
+# Off when this process forks workers after startup (gunicorn preload, rescore.py):
+# gRPC channels must be opened after the fork, so each worker warms its own pool
+STT_WARMUP = os.environ.get("STT_WARMUP", "1") == "1"
+
+# Values used when a stage misses its deadline (same shapes as the helpers' error paths)
+STT_FALLBACK = ("", [])
+WAVLM_FALLBACK = ("Unknown", 0.0)
+AMPLITUDE_FALLBACK = {"duration_sec": 0, "amplitude_sustained": False}
+VOICING_FALLBACK = {"pitched_ratio": 0.0, "voiced_detected": False, "noise_suspected": True}
 
 # --- FLASK SETUP ---
-app = Flask(__name__)
-CORS(app)
-g2p = G2p()
-
-# --- KID FRIENDLY PHONEMES ---
-PHONEME_MAP = {
-    "AA": "a",
-    "AE": "a",
-    "AH": "u",
-    "AO": "aw",
-    "AW": "ow",
-    "AY": "i",
-    "B": "b",
-    "CH": "ch",
-    "D": "d",
-    "DH": "th",
-    "EH": "e",
-    "ER": "er",
-    "EY": "a",
-    "F": "f",
-    "G": "g",
-    "HH": "h",
-    "IH": "i",
-    "IY": "ee",
-    "JH": "j",
-    "K": "k",
-    "L": "l",
-    "M": "m",
-    "N": "n",
-    "NG": "ng",
-    "OW": "o",
-    "OY": "oy",
-    "P": "p",
-    "R": "r",
-    "S": "s",
-    "SH": "sh",
-    "T": "t",
-    "TH": "th",
-    "UH": "u",
-    "UW": "oo",
-    "V": "v",
-    "W": "w",
-    "Y": "y",
-    "Z": "z",
-    "ZH": "zh",
-}
+class UploadRequest(Request):
+    """Keeps uploads in memory up to UPLOAD_SPOOL_BYTES, then spills to an anonymous temp file."""
 
-# --- LOAD CUSTOM WAVLM MODEL ---
-print("📥 Loading Custom WavLM Model...")
-try:
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    
-    # Load the extractor and model from your local folder
-    feature_extractor = AutoFeatureExtractor.from_pretrained(MODEL_PATH)
-    model = AutoModelForAudioClassification.from_pretrained(MODEL_PATH)
-    model.to(device)
-    model.eval()  # Set to inference mode
-    
-    # Get Label Mappings from the trained model config
-    id2label = model.config.id2label
-    print(f"✅ WavLM Model Loaded on {device}!")
-    print(f"   Labels: {id2label}")
-except Exception as e:
-    print(f"❌ Error Loading Model: {e}")
-    print("   -> Ensure 'config.json' and 'pytorch_model.bin' are in the 'wavlm_model' folder.")
-    raise e
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="w+b")
 
-# --- HELPER FUNCTIONS ---
 
-def predict_file(audio_input, return_all_scores=False):
-    """
-    Manual prediction using WavLM.
-    Accepts a filepath (str) OR a pre-loaded numpy array.
-    Returns: (label_string, confidence_float) or (label_string, confidence_float, all_scores_dict)
-    """
-    # 1. Load Audio if input is a path
-    if isinstance(audio_input, str):
-        try:
-            # FAST PATH: Try soundfile first (for WAV)
-            audio, sr = sf.read(audio_input)
-            if sr != 16000:
-                # Resample if not 16k
-                audio = librosa.resample(y=audio, orig_sr=sr, target_sr=16000)
-            # Ensure mono
-            if len(audio.shape) > 1:
-                audio = np.mean(audio, axis=1)
-        except Exception as sf_error:
-            # FALLBACK: Librosa (handles mp3/m4a/resampling)
-            print(f"ℹ️ Soundfile read failed (expected for non-WAV), falling back to librosa: {sf_error}")
-            audio, sr = librosa.load(audio_input, sr=16000)
-    else:
-        audio = audio_input  # Assume already at 16kHz
-
-    # 2. Process Audio (Normalize & Extract Features)
-    inputs = feature_extractor(
-        audio,
-        sampling_rate=16000,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-        max_length=16000 * 3,  # Max 3 seconds context
-    )
+app = Flask(__name__)
+app.request_class = UploadRequest
+CORS(app)
 
-    # 3. Move to Device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
 
-    # 4. Model Inference
-    with torch.no_grad():
-        logits = model(**inputs).logits
+# --- REQUEST METRICS ---
+# Every request gets a stage timer (see metrics.py): its stages become the
+# Server-Timing header and its latency lands in the /metrics histograms.
+@app.before_request
+def start_request_timer():
+    # asgi.py starts the timer itself before Flask sees a job request
+    if metrics.current() is None:
+        g.metrics_token = metrics.start_request(request.endpoint or "unmatched")[1]
+
+
+@app.after_request
+def add_server_timing(response):
+    timer = metrics.current()
+    if timer is not None:
+        metrics.observe_request(timer, response.status_code)
+        response.headers["Server-Timing"] = timer.server_timing()
+        response.headers.setdefault("Timing-Allow-Origin", "*")  # Let the web build read it cross-origin
+    return response
+
+
+@app.teardown_request
+def finish_request_timer(error=None):
+    token = g.pop("metrics_token", None)
+    if token is not None:
+        metrics.finish_request(token)
+
+
+# --- ON-DEMAND PROFILING ---
+# X-Profile: <PROFILE_SECRET> or PROFILE_SAMPLE_RATE profiles a request with
+# cProfile (see profiling.py); X-Profile-Id names the saved profile.
+@app.before_request
+def start_profiling():
+    # asgi.py decides before Flask sees a job request; its steps are profiled on the CPU pool
+    if profiling.decided() or request.endpoint is None or request.endpoint in HEALTH_ENDPOINTS:
+        return
+    profile, g.profile_token = profiling.start_request(request.headers, request.endpoint or "unmatched")
+    if profile is not None:
+        profile.enable_thread()
+
+
+@app.after_request
+def save_profile(response):
+    profile = profiling.active()
+    if profile is not None:
+        profile.save(response.status_code)
+        response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+@app.teardown_request
+def finish_profiling(error=None):
+    token = g.pop("profile_token", None)
+    if token is not None:
+        profiling.finish_request(token)
+
+
+# --- LATENCY BUDGET ---
+# X-Latency-Budget-Ms (or the endpoint default) bounds a job's stages; stages
+# answered by a cheaper signal are listed in X-Degraded-Stages (see latency_budget.py).
+@app.before_request
+def start_latency_budget():
+    # asgi.py sets the budget before Flask sees a job request
+    if latency_budget.decided() or request.endpoint not in JOB_ROUTES:
+        return
+    _, g.budget_token = latency_budget.start_request(request.headers, request.endpoint)
+
+
+@app.after_request
+def add_degraded_stages(response):
+    budget = latency_budget.current()
+    if budget is not None and budget.degraded:
+        response.headers[latency_budget.DEGRADED_HEADER] = ",".join(sorted(budget.degraded))
+    return response
+
+
+@app.teardown_request
+def finish_latency_budget(error=None):
+    token = g.pop("budget_token", None)
+    if token is not None:
+        latency_budget.finish_request(token)
+
+
+# Upload endpoints are jobs (see stage_runner.py): they take the form and
+# files, yield their analyzer stages, and return what a Flask view would.
+# Flask drives them on the request thread; asgi.py drives the same job on
+# an event loop with CPU work on a bounded pool. Each job first takes one of
+# its endpoint's admission slots (see admission.py); when the endpoint's
+# queue is full the upload is refused with 429 before it is parsed.
+JOB_ROUTES = {}  # endpoint name -> job function
+
+
+def overloaded(error):
+    """429 for a request refused by admission control."""
+    print(f"🚦 Refused {error.gate}: {error.reason}, retry in {error.retry_after}s")
+    body = {"error": "Server busy, please retry", "code": "OVERLOADED", "retryAfter": error.retry_after}
+    return body, 429, {"Retry-After": str(error.retry_after)}
+
+
+def job_route(rule, **options):
+    def decorator(job):
+        def view():
+            try:
+                with admission.admitted(job.__name__):
+                    with metrics.timed("upload"):
+                        form, files = request.form, request.files
+                    return run_job(job(form, files))
+            except admission.Overloaded as e:
+                return overloaded(e)
+
+        app.add_url_rule(rule, job.__name__, view, **options)
+        JOB_ROUTES[job.__name__] = job
+        return job
+    return decorator
+
+# --- LOAD CUSTOM WAVLM MODEL ---
+# Set by load_model() during startup
+device = None
+feature_extractor = None
+model = None
+early_exit = None
+id2label = {}
+MODEL_VERSION = None
+
+
+def load_model():
+    """Load WavLM (or its ONNX export) and the early-exit heads into the module globals."""
+    global device, feature_extractor, model, early_exit, id2label, MODEL_VERSION
+    print("📥 Loading Custom WavLM Model...")
+    try:
+        if INFERENCE_BACKEND == "onnx":
+            # Exported graph on ONNX Runtime (CPU); see export_onnx.py
+            device = "cpu"
+            feature_extractor, model = load_onnx_classifier(MODEL_PATH)
+            early_exit = None
+            exit_version = ["off", "-"]
+            if os.environ.get("EARLY_EXIT_MODE", "off").strip().lower() != "off":
+                print("⚠️ EARLY_EXIT_MODE is ignored with the ONNX backend")
+        else:
+            from early_exit import EARLY_EXIT_LAYERS, EARLY_EXIT_MODE, EARLY_EXIT_THRESHOLD, load_early_exit
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            # Load the extractor and model from your local folder (MODEL_QUANTIZE=int8 for dynamic int8)
+            feature_extractor, model = load_wavlm(MODEL_PATH, device=device)
+
+            # Intermediate-layer exit heads (EARLY_EXIT_MODE=confidence|static, torch only)
+            early_exit = load_early_exit(model, MODEL_PATH, device=device)
+            if early_exit is not None:
+                print(f"⚡ Early exit: {EARLY_EXIT_MODE} (heads at layers {sorted(early_exit.heads)})")
+            exit_version = [
+                EARLY_EXIT_MODE if early_exit is not None else "off",
+                str(EARLY_EXIT_THRESHOLD if EARLY_EXIT_MODE == "confidence" else EARLY_EXIT_LAYERS),
+            ]
+
+        # Get Label Mappings from the trained model config
+        id2label = model.config.id2label
+        print(f"✅ WavLM Model Loaded on {device}! (backend: {INFERENCE_BACKEND}, quantize: {MODEL_QUANTIZE or 'fp32'}, share: {MODEL_SHARE or 'per-process'})")
+        print(f"   Labels: {id2label}")
+    except Exception as e:
+        print(f"❌ Error Loading Model: {e}")
+        print("   -> Ensure 'config.json' and 'pytorch_model.bin' are in the 'wavlm_model' folder.")
+        raise e
+
+    # Result cache keys include everything that changes a prediction
+    MODEL_VERSION = ":".join([
+        model_fingerprint(MODEL_PATH),
+        INFERENCE_BACKEND,
+        MODEL_QUANTIZE or "fp32",
+        *exit_version,
+    ])
+
+
+# --- RESULT CACHE ---
+# Retried uploads of the same recording reuse WavLM / STT / DSP results (see result_cache.py).
+# Keys include everything that changes a result: model files and inference mode (MODEL_VERSION), STT settings.
+# A WavLM result must depend on the clip alone: predict_batch never pads a clip next to longer
+# batch-mates, so a prediction from a shared (micro-)batch is cached under the clip's digest like a single one.
+STT_VERSION = f"{STT_TRANSPORT}:{STT_LANGUAGE}"
+DSP_VERSION = f"{VOICING_BACKEND}:{PITCHED_RATIO_MIN}"
+result_cache = ResultCache()
 
-    # 5. Softmax for Probabilities
-    probs = torch.nn.functional.softmax(logits, dim=-1)
+# --- HELPER FUNCTIONS ---
 
-    # 6. Get Winner
-    score, id = torch.max(probs, dim=-1)
-    label = model.config.id2label[id.item()]
+def _scores_from_probs(probs_row, return_all_scores=False):
+    """Turn one row of class probabilities (numpy) into predict_file's return tuple."""
+    # Get Winner
+    id = int(np.argmax(probs_row))
+    score = float(probs_row[id])
+    label = model.config.id2label[id]
 
     if return_all_scores:
         # Build dict of all class probabilities
         all_scores = {}
-        probs_list = probs[0].tolist()
-        for idx, prob in enumerate(probs_list):
+        for idx, prob in enumerate(probs_row.tolist()):
             class_label = model.config.id2label[idx]
             # Normalize label: "nonstutter_prolongation" -> "prolongation"
             if "_" in class_label:
@@ -192,66 +334,215 @@ def predict_file(audio_input, return_all_scores=False):
             else:
                 clean_label = class_label.lower()
             all_scores[clean_label] = round(prob, 4)
-        return label, score.item(), all_scores
+        return label, score, all_scores
+
+    return label, score
+
+
+# WavLM sees at most 3 s of a segment (longer ones are truncated)
+WAVLM_MAX_SAMPLES = 16000 * 3
+
+
+def wavlm_length(segment):
+    """Samples of a segment WavLM actually scores."""
+    return min(len(segment), WAVLM_MAX_SAMPLES)
 
-    return label, score.item()
 
+def _batch_probs(batch):
+    """Class probabilities (numpy, batch x labels) for a list of equal-length 16 kHz segments."""
+    onnx = INFERENCE_BACKEND == "onnx"
 
-def convert_audio_to_wav_buffer(file_path):
-    """Convert any audio format to WAV BytesIO buffer for Google STT.
-    Uses librosa as primary loader to handle .m4a, .mp3, etc. robustly.
+    # 1. Process Audio (Normalize, Pad & Extract Features)
+    with metrics.timed("wavlm_features"):
+        inputs = feature_extractor(
+            batch,
+            sampling_rate=16000,
+            return_tensors="np" if onnx else "pt",
+            padding=True,
+            truncation=True,
+            max_length=WAVLM_MAX_SAMPLES,  # Max 3 seconds context
+            return_attention_mask=True,
+        )
+
+    # 2. Model Inference
+    if onnx:
+        with metrics.timed("wavlm_forward"):
+            logits = model.logits(inputs["input_values"], inputs["attention_mask"])
+        # 3. Softmax for Probabilities
+        exp = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+        return exp / np.sum(exp, axis=-1, keepdims=True)
+
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    if early_exit is not None:
+        with metrics.timed("wavlm_forward"):
+            probs, _ = early_exit(inputs["input_values"], inputs.get("attention_mask"))
+        return probs.cpu().numpy()
+
+    with torch.no_grad(), metrics.timed("wavlm_forward"):
+        logits = model(**inputs).logits
+
+    # 3. Softmax for Probabilities
+    return torch.nn.functional.softmax(logits, dim=-1).cpu().numpy()
+
+
+def predict_batch(segments, return_all_scores=False, batch_size=None):
+    """
+    Batched WavLM prediction for many 16 kHz numpy segments.
+    Only segments of the same (truncated) length share a forward pass: the
+    checkpoint's conv encoder uses group norm over time, so zero padding would
+    change a clip's scores depending on its batch-mates. A segment therefore
+    scores the same batched or alone (up to float rounding).
+    Returns one predict_file-style tuple per segment, in input order.
+    """
+    batch_size = batch_size or INFERENCE_BATCH_SIZE
+    results = [None] * len(segments)
+
+    for batch_idx in equal_length_batches(segments, batch_size, wavlm_length):
+        with admission.using(admission.cpu):
+            probs = _batch_probs([segments[i] for i in batch_idx])
+        for row, i in zip(probs, batch_idx):
+            results[i] = _scores_from_probs(row, return_all_scores)
+
+    return results
+
+
+def predict_file(audio_input, return_all_scores=False):
+    """
+    Manual prediction using WavLM.
+    Accepts an AudioClip, a filepath (str) OR a pre-loaded numpy array.
+    Returns: (label_string, confidence_float) or (label_string, confidence_float, all_scores_dict)
+    """
+    # Decode Audio if needed (no-op for an AudioClip)
+    clip = as_clip(audio_input)
+
+    # Identical audio (client retries) reuses the first result
+    label, score, all_scores = result_cache.get_or_compute(
+        ("wavlm", MODEL_VERSION, clip.digest), lambda: _predict_samples(clip.samples)
+    )
+    return (label, score, all_scores) if return_all_scores else (label, score)
+
+
+def _predict_samples(audio):
+    """(label, score, all_scores) for one segment."""
+    # Share a forward pass with concurrent requests when micro-batching is on
+    # (a profiled request runs its own, so the forward pass shows in its profile)
+    if inference_scheduler is not None and profiling.active() is None:
+        return inference_scheduler.predict(audio)
+    return predict_batch([audio], return_all_scores=True)[0]
+
+
+def predict_segments(segments):
+    """All-scores predictions for many segments (e.g. sliding windows), in order."""
+    if inference_scheduler is not None and profiling.active() is None:
+        return inference_scheduler.predict_many(segments)
+    return predict_batch(segments, return_all_scores=True)
+
+
+# --- MICRO-BATCHING SCHEDULER ---
+# Collects clips from concurrent requests into one batched forward pass
+inference_scheduler = None
+if MICROBATCH_ENABLED:
+    inference_scheduler = InferenceScheduler(
+        lambda segments: predict_batch(segments, return_all_scores=True, batch_size=len(segments)),
+        max_batch_size=INFERENCE_BATCH_SIZE,
+        max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+        batch_key=wavlm_length,
+        workers=MICROBATCH_WORKERS,
+    )
+
+
+def convert_audio_to_wav_buffer(audio_input):
+    """Convert any audio input to WAV bytes for Google STT.
+    Reuses the clip's decoded samples; filepaths are decoded once via load_clip.
     """
     try:
-        audio, sr = librosa.load(file_path, sr=16000, mono=True)
-        wav_buffer = io.BytesIO()
-        sf.write(wav_buffer, audio, sr, format='WAV')
-        wav_buffer.seek(0)
-        return wav_buffer.getvalue()
-        
+        return as_clip(audio_input).wav_bytes
+
     except Exception as e:
         print(f"❌ Audio conversion failed: {e}")
         return None
 
 
-def get_google_transcript(file_path):
+def get_google_transcript(audio_input):
     """Returns transcript and word-level timestamps."""
     try:
-        # Convert audio to WAV buffer
-        wav_content = convert_audio_to_wav_buffer(file_path)
-        if not wav_content:
-            print(f"❌ Failed to convert audio file")
-            return "", []
-
-        client = speech.SpeechClient()
-        audio_file = speech.RecognitionAudio(content=wav_content)
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=16000,
-            language_code="en-US",
-            enable_word_time_offsets=True,
-            enable_word_confidence=True,
-        )
-        response = client.recognize(config=config, audio=audio_file)
-
-        words = []
-        full_text = ""
-        for result in response.results:
-            full_text += result.alternatives[0].transcript + " "
-            for w in result.alternatives[0].words:
-                words.append(
-                    {
-                        "word": w.word,
-                        "start": w.start_time.total_seconds(),
-                        "end": w.end_time.total_seconds(),
-                        "confidence": w.confidence,
-                    }
-                )
-        return full_text.strip(), words
+        clip = as_clip(audio_input)
+
+        def recognize():
+            # Convert audio to WAV buffer
+            wav_content = convert_audio_to_wav_buffer(clip)
+            if not wav_content:
+                raise ValueError("Failed to convert audio file")
+
+            # Pooled, per-process client (or the local fake when STT_TRANSPORT=fake)
+            with admission.using(admission.stt), metrics.timed("stt"):
+                return get_transport().recognize(wav_content, sample_rate=16000)
+
+        # Only successful recognitions are cached; a failed call is retried next time
+        return result_cache.get_or_compute(("stt", STT_VERSION, clip.digest), recognize)
+    except Exception as e:
+        print(f"❌ STT Error: {e}")
+        return "", []
+
+
+async def get_google_transcript_async(audio_input):
+    """get_google_transcript() for the event loop (asgi.py): awaits the RPC instead of blocking a thread."""
+    try:
+        clip = as_clip(audio_input)
+
+        async def recognize():
+            wav_content = convert_audio_to_wav_buffer(clip)
+            if not wav_content:
+                raise ValueError("Failed to convert audio file")
+
+            transport = get_transport()
+            async with admission.using_async(admission.stt):
+                with metrics.timed("stt"):
+                    if hasattr(transport, "recognize_async"):
+                        return await transport.recognize_async(wav_content, sample_rate=16000)
+                    return await asyncio.to_thread(transport.recognize, wav_content, 16000)
+
+        return await result_cache.get_or_compute_async(("stt", STT_VERSION, clip.digest), recognize)
     except Exception as e:
         print(f"❌ STT Error: {e}")
         return "", []
 
 
+def decode_upload(file, endpoint):
+    """Decode an uploaded clip with the endpoint's resampler quality and the CLIP_MAX_SECONDS limit."""
+    if isinstance(file, DecodedUpload):
+        return file.result()
+    return load_clip(file.stream, filename=file.filename, quality=RESAMPLE_QUALITY[endpoint], max_seconds=CLIP_MAX_SECONDS)
+
+
+class DecodedUpload:
+    """An upload decoded ahead of its job (batch endpoint); stands in for the FileStorage."""
+
+    def __init__(self, file, endpoint):
+        self.filename = file.filename
+        self.clip, self.error = None, None
+        try:
+            self.clip = decode_upload(file, endpoint)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.clip
+
+    def close(self):
+        pass
+
+
+def stt_stage(clip, timeout=STT_TIMEOUT_S):
+    """Google STT as a stage: a blocking call under Flask, awaited under asgi.py."""
+    return Stage(
+        lambda: get_google_transcript(clip), timeout, STT_FALLBACK,
+        async_fn=lambda: get_google_transcript_async(clip),
+    )
+
+
 def calculate_wpm(words_data):
     """Calculate words per minute."""
     if not words_data or len(words_data) < 2:
@@ -266,12 +557,45 @@ def calculate_wpm(words_data):
     return round((len(words_data) / duration) * 60, 1)
 
 
-def analyze_voicing_noise(filepath):
+SYLLABLES_PER_WORD = 1.4  # Children's reading texts
+SYLLABLE_MIN_GAP_S = 0.15
+SYLLABLE_PEAK_RATIO = 1.25  # ~2 dB above the surrounding dip
+
+
+def estimate_wpm_acoustic(audio_input):
+    """
+    Rough WPM without a transcript (Turtle when STT misses its budget):
+    syllable nuclei are RMS peaks in voiced frames at least 0.15 s apart,
+    counted over the first-to-last voiced frame span. A steady hum has none.
+    """
+    try:
+        features = as_clip(audio_input).features
+        voiced = features.energy_voiced_mask
+        voiced_frames = np.flatnonzero(voiced)
+        if len(voiced_frames) < 2:
+            return 0
+
+        # A nucleus is the loudest frame within +-SYLLABLE_MIN_GAP_S and stands out from the dips around it
+        half = max(1, int(SYLLABLE_MIN_GAP_S / features.frame_duration))
+        windows = np.lib.stride_tricks.sliding_window_view(np.pad(features.rms, half, mode="edge"), 2 * half + 1)
+        peak = (features.rms >= windows.max(axis=1)) & (features.rms > SYLLABLE_PEAK_RATIO * windows.min(axis=1))
+        nuclei = int(np.count_nonzero(voiced & peak))
+
+        duration = float(voiced_frames[-1] - voiced_frames[0] + 1) * features.frame_duration
+        return round(nuclei / SYLLABLES_PER_WORD / duration * 60, 1)
+    except Exception as e:
+        print(f"⚠️ Acoustic WPM estimate failed: {e}")
+        return 0
+
+
+@cached_by_audio(result_cache, "voicing", DSP_VERSION)
+def analyze_voicing_noise(audio_input):
     """
     Return heuristics for anti-blow validation.
     """
     try:
-        y, sr = librosa.load(filepath, sr=SAMPLE_RATE)
+        clip = as_clip(audio_input)
+        y, sr = clip.samples, clip.sample_rate
         if len(y) < int(0.3 * sr):
             return {
                 "pitched_ratio": 0.0,
@@ -279,18 +603,13 @@ def analyze_voicing_noise(filepath):
                 "noise_suspected": True,
             }
 
-        # Zero-crossing rate
-        zcr = librosa.feature.zero_crossing_rate(y=y)[0]
-        zcr_mean = float(np.mean(zcr))
+        # Zero-crossing rate (shared frame features)
+        features = clip.features
+        zcr_mean = float(np.mean(features.zcr))
 
-        # Pitch detection (pyin)
+        # Pitch detection (VOICING_BACKEND: fast YIN or reference pyin)
         try:
-            f0, _, _ = librosa.pyin(y, fmin=80, fmax=400, sr=sr)
-            voiced_frames = np.sum(~np.isnan(f0))
-            total_frames = len(f0)
-            pitched_ratio = (
-                float(voiced_frames) / float(total_frames) if total_frames > 0 else 0.0
-            )
+            pitched_ratio = features.voicing(fmin=80, fmax=400).pitched_ratio
         except Exception as pitch_error:
             print(f"⚠️ Pitch detection failed: {pitch_error}")
             pitched_ratio = 0.0
@@ -309,63 +628,73 @@ def analyze_voicing_noise(filepath):
         return {"voiced_detected": False, "noise_suspected": True}
 
 
-def analyze_amplitude(filepath, threshold=0.02, min_duration=1.5):
-    """Analyze sustained amplitude for Snake exercise."""
+def analyze_voicing_energy(audio_input):
+    """analyze_voicing_noise() from RMS/ZCR alone: the fallback when pitch tracking misses its budget."""
     try:
-        audio, sr = librosa.load(filepath, sr=SAMPLE_RATE)
-        audio, _ = librosa.effects.trim(audio, top_db=30)
+        features = as_clip(audio_input).features
+        pitched_ratio = features.energy_voiced_ratio
+        zcr_mean = float(np.mean(features.zcr)) if features.zcr.size else 0.0
+        return {
+            "pitched_ratio": pitched_ratio,
+            "zcr_mean": zcr_mean,
+            "voiced_detected": pitched_ratio >= PITCHED_RATIO_MIN,
+            "noise_suspected": pitched_ratio < (PITCHED_RATIO_MIN * 0.67) and zcr_mean > 0.2,
+        }
+    except Exception as e:
+        print(f"⚠️ Energy voicing failed: {e}")
+        return VOICING_FALLBACK
 
-        rms = librosa.feature.rms(y=audio)[0]
-        frame_duration = len(audio) / sr / len(rms)
 
-        above_threshold = rms > threshold
-        sustained_frames = 0
-        max_sustained = 0
+@cached_by_audio(result_cache, "amplitude", DSP_VERSION)
+def analyze_amplitude(audio_input, threshold=0.02, min_duration=1.5):
+    """Analyze sustained amplitude for Snake exercise."""
+    try:
+        features = as_clip(audio_input).features
 
-        for val in above_threshold:
-            if val:
-                sustained_frames += 1
-                max_sustained = max(max_sustained, sustained_frames)
-            else:
-                sustained_frames = 0
+        # RMS inside the trimmed (non-silent) region
+        start, end = features.trimmed_bounds
+        above_threshold = features.rms[start:end] > threshold
 
-        sustained_duration = max_sustained * frame_duration
+        # Every sustained run, longest one decides continuity
+        run_starts, run_ends = find_runs(above_threshold)
+        max_sustained = int(np.max(run_ends - run_starts)) if len(run_starts) else 0
+
+        sustained_duration = max_sustained * features.frame_duration
         amplitude_sustained = sustained_duration >= min_duration
 
         return {
             "duration_sec": round(sustained_duration, 2),
             "amplitude_sustained": amplitude_sustained,
+            "sustained_segments": features.segments(above_threshold, offset=start),
         }
     except Exception as amp_error:
         print(f"⚠️ Amplitude analysis failed: {amp_error}")
         return {"duration_sec": 0, "amplitude_sustained": False}
 
 
-def detect_breath(filepath, silence_threshold=0.01, min_silence=0.3):
+@cached_by_audio(result_cache, "breath", DSP_VERSION)
+def detect_breath(audio_input, silence_threshold=0.01, min_silence=0.3):
     """Detect breath pattern for Balloon exercise."""
     try:
-        audio, sr = librosa.load(filepath, sr=SAMPLE_RATE)
-        rms = librosa.feature.rms(y=audio, frame_length=2048, hop_length=512)[0]
-        frame_duration = len(audio) / sr / len(rms)
-
+        features = as_clip(audio_input).features
+        rms = features.rms
         silence_frames = rms < silence_threshold
-        has_silence = False
-        silence_count = 0
-
-        for i, is_silent in enumerate(silence_frames):
-            if is_silent:
-                silence_count += 1
-            elif silence_count > 0:
-                silence_duration = silence_count * frame_duration
-                if silence_duration >= min_silence:
-                    has_silence = True
-                    if i < len(rms):
-                        return {
-                            "breath_detected": True,
-                            "amplitude_onset": round(float(rms[i]), 3),
-                        }
-                silence_count = 0
-        return {"breath_detected": has_silence, "amplitude_onset": 0.0}
+
+        # A breath is a long-enough silence followed by sound
+        run_starts, run_ends = find_runs(silence_frames)
+        long_enough = (run_ends - run_starts) * features.frame_duration >= min_silence
+        followed_by_sound = run_ends < len(rms)
+        breaths = np.flatnonzero(long_enough & followed_by_sound)
+
+        result = {
+            "breath_detected": False,
+            "amplitude_onset": 0.0,
+            "silent_segments": features.segments(silence_frames),
+        }
+        if len(breaths):
+            result["breath_detected"] = True
+            result["amplitude_onset"] = round(float(rms[run_ends[breaths[0]]]), 3)
+        return result
     except Exception as breath_error:
         print(f"⚠️ Breath detection failed: {breath_error}")
         return {"breath_detected": False, "amplitude_onset": 0.0}
@@ -395,18 +724,19 @@ def get_feedback(exercise_type, is_hit, stutter_type=None):
 
 
 # --- MAIN ENDPOINT: GENERAL ANALYSIS ---
-@app.route("/analyze_audio", methods=["POST"])
-def analyze_audio():
-    if "file" not in request.files:
-        return jsonify({"error": "No file"}), 400
-    file = request.files["file"]
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(os.getcwd(), filename)
-    file.save(filepath)
+@job_route("/analyze_audio", methods=["POST"])
+def analyze_audio(form, files):
+    if "file" not in files:
+        return {"error": "No file"}, 400
+    file = files["file"]
 
     try:
-        # Load audio once for multiple analysis windows
-        y, sr = librosa.load(filepath, sr=16000)
+        # Decode audio once (from the upload stream) for windows and STT
+        try:
+            clip = decode_upload(file, "analyze_audio")
+        except ClipTooLongError as e:
+            return {"error": str(e)}, 413
+        y, sr = clip.samples, clip.sample_rate
         total_duration = len(y) / sr
         
         window_size = 3.0  # seconds
@@ -421,7 +751,8 @@ def analyze_audio():
             # hop_size based sliding windows
             start_times = np.arange(0, max(0.1, total_duration - window_size + 0.1), hop_size)
             
-        # Process each window
+        # Collect windows
+        segments = []
         for start in start_times:
             start_sample = int(start * sr)
             end_sample = min(len(y), int((start + window_size) * sr))
@@ -430,8 +761,10 @@ def analyze_audio():
             # Skip very short segments
             if len(segment) < 16000 * 0.5:
                 continue
-                
-            _, _, scores = predict_file(segment, return_all_scores=True)
+            segments.append(segment)
+
+        # Score all windows in batched forward passes
+        for _, _, scores in predict_segments(segments):
             for label, score in scores.items():
                 if label not in aggregated_scores:
                     aggregated_scores[label] = 0.0
@@ -439,7 +772,7 @@ def analyze_audio():
                 aggregated_scores[label] = max(aggregated_scores[label], score)
         
         if not aggregated_scores:
-             return jsonify({"error": "Audio too short or silent"}), 400
+             return {"error": "Audio too short or silent"}, 400
 
         # Determine primary result
         fluent_score = aggregated_scores.get("fluent", 0.0)
@@ -470,8 +803,12 @@ def analyze_audio():
         else:
             detected_types_list = ["Fluent"]
 
-        # 2. GET TRANSCRIPT (for phonemes)
-        full_text, words = get_google_transcript(filepath)
+        # 2. GET TRANSCRIPT (for phonemes; bounded only when the client sent a budget)
+        stages = yield {"stt": stt_stage(clip, timeout=latency_budget.timeout_for("stt"))}
+        full_text, words = stages["stt"]
+        degraded = {}
+        if "stt" in stages.timed_out:
+            latency_budget.degrade(degraded, "stt", "no_transcript")
         final_phoneme = None
         culprit_word = None
 
@@ -480,11 +817,7 @@ def analyze_audio():
             culprit = min(words, key=lambda w: w["confidence"])
             culprit_word = culprit["word"]
 
-            phonemes = g2p(culprit["word"])
-            clean = [p for p in phonemes if p not in [" ", "'"]]
-            if clean:
-                raw = "".join([i for i in clean[0] if not i.isdigit()])
-                final_phoneme = PHONEME_MAP.get(raw, raw.lower())
+            final_phoneme = phonemes.first_sound(culprit["word"])
 
         response = {
             "is_stutter": is_stutter,
@@ -495,42 +828,39 @@ def analyze_audio():
             "problem_phoneme": final_phoneme,
             "problem_word": culprit_word,
             "transcript": full_text,
+            "degraded_stages": degraded,
         }
-        return jsonify(response)
+        return response
 
 
     finally:
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except:
-                pass
+        # Release the upload buffer (or its spooled temp file)
+        file.close()
 
 
 # --- EXERCISE ENDPOINTS ---
 
 
-def detect_nasal_phoneme_acoustic(filepath):
+@cached_by_audio(result_cache, "nasal", DSP_VERSION)
+def detect_nasal_phoneme_acoustic(audio_input):
     """
     Simple check: if user is humming a voiced sound (for nasal targets).
     We don't try to distinguish M vs N vs NG - just accept any nasal hum.
     Good enough for speech therapy practice!
     """
     try:
-        # Load audio
-        y, sr = librosa.load(filepath, sr=16000)
+        # Decoded once per request; voicing comes from the shared frame features
+        features = as_clip(audio_input).features
         
         # Check if sound is voiced (nasals are always voiced)
         # Simple method: check if there's pitch
-        f0, voiced_flag, _ = librosa.pyin(
-            y, 
+        import librosa
+        voiced_ratio = features.voicing(
             fmin=librosa.note_to_hz('C2'),  # ~65 Hz
-            fmax=librosa.note_to_hz('C7')   # ~2093 Hz
-        )
+            fmax=librosa.note_to_hz('C7'),  # ~2093 Hz
+        ).pitched_ratio
         
         # If more than 50% of audio is voiced, accept it as nasal
-        voiced_ratio = np.sum(voiced_flag) / len(voiced_flag) if len(voiced_flag) > 0 else 0
-        
         if voiced_ratio > 0.5:
             return True  # Good enough - they're humming!
         else:
@@ -541,234 +871,412 @@ def detect_nasal_phoneme_acoustic(filepath):
         return None
 
 
+def detect_nasal_energy(audio_input):
+    """detect_nasal_phoneme_acoustic() from the RMS/ZCR voicing ratio: no pitch tracking."""
+    try:
+        return as_clip(audio_input).features.energy_voiced_ratio > 0.5
+    except Exception as e:
+        print(f"⚠️ Energy nasal check failed: {e}")
+        return None
+
+
+NASAL_TARGETS = {'m', 'n', 'ng'}
+
+
+def score_snake(clip, target_phoneme, tier, wavlm_result, amp_data, voicing, transcript,
+                nasal_check=detect_nasal_phoneme_acoustic):
+    """
+    Apply the Snake game rules to finished analyzer outputs.
+    Shared by /snake/analyze and the streaming endpoint.
+    nasal_check(clip) stands in for the transcript on nasal targets when STT gave nothing.
+    Returns the response "data" dict (timings are added by the caller).
+    """
+    label, score = wavlm_result
+    repetition_detected = "repetition" in label.lower()
+    full_text, words = transcript
+
+    # Initialize Score - Tier-based XP
+    stars = 3
+    if tier == 1:
+        xp = 10
+        penalty_per_error = 3
+    elif tier == 2:
+        xp = 20
+        penalty_per_error = 5
+    else:  # tier 3+
+        xp = 30
+        penalty_per_error = 7
+    
+    feedback_msgs = []
+    
+    # Target in the same kid-friendly symbols as the transcript words ("E" -> "ee")
+    target = phonemes.target_sound(target_phoneme) if target_phoneme else None
+
+    # Check if transcript matches target
+    phoneme_match = None
+    if target and words:
+        found = False
+        for w in words:
+            try:
+                # Memoized per word (see phonemes.py)
+                if target in phonemes.word_sounds(w["word"]):
+                    found = True
+                    break
+            except Exception as phoneme_error:
+                print(f"⚠️ Phoneme mapping failed for '{w.get('word', '?')}': {phoneme_error}")
+                continue
+        phoneme_match = found
+    
+    # Simple fallback: If STT fails and target is nasal, just check if they're humming
+    if phoneme_match is None and target:
+        if target in NASAL_TARGETS:
+            # Don't try to distinguish M vs N vs NG - just check if voiced
+            is_humming = nasal_check(clip)
+            if is_humming:
+                phoneme_match = True  # Good enough!
+
+    # 3. APPLY DEDUCTION LOGIC
+    # RULE 1: CONTINUITY
+    if not amp_data["amplitude_sustained"]:
+        stars -= 1
+        xp -= penalty_per_error
+        feedback_msgs.append("Keep the sound smooth without stopping!")
+
+    # RULE 2: ANTI-BLOW / VOICING
+    blow_detected = False
+    if target:
+        voiced_targets = {'a','e','i','o','u','oo','ee','er','m','n','l','r','w','y','ng','v','z','j'}
+        
+        if target in voiced_targets:
+            speech_likely = voicing['voiced_detected'] or (phoneme_match is True)
+            
+            if not speech_likely:
+                blow_detected = True
+                stars -= 1
+                xp -= penalty_per_error
+                feedback_msgs.append("Don't just blow air! Use your voice.")
+
+    # RULE 3: CONTENT
+    if phoneme_match is False:
+        stars -= 2
+        xp -= penalty_per_error * 2
+        feedback_msgs.append(f"I didn't hear the '{target_phoneme}' sound.")
+    elif phoneme_match is None:
+        if stars == 3:
+            stars = 2
+            xp -= penalty_per_error // 2
+            # Make feedback more helpful - show extended sound pattern
+            sound_pattern = target_phoneme * 5 if len(target_phoneme) == 1 else target_phoneme
+            feedback_msgs.append(f"Try to say '{sound_pattern}' more clearly!")
+
+    # RULE 4: REPETITION
+    if repetition_detected:
+        if amp_data["amplitude_sustained"]:
+            stars -= 1
+            xp -= penalty_per_error
+            feedback_msgs.append("Try not to repeat the sound.")
+
+    # 4. FINALIZE SCORES
+    stars = max(1, stars)
+    xp = max(1, xp)
+    is_pass = stars >= 2
+    clinical_pass = not blow_detected and not repetition_detected
+    final_feedback = " ".join(feedback_msgs) if feedback_msgs else "Perfect smooth speech! 🌟"
+
+    # Determine Stutter Type
+    stutter_type = "Fluent"
+    if blow_detected:
+        stutter_type = "Noise"
+    elif repetition_detected:
+        stutter_type = "Repetition"
+    elif not amp_data["amplitude_sustained"]:
+        stutter_type = "Block"
+    elif phoneme_match is False:
+        stutter_type = "Mismatch"
+
+    # Calculate composite confidence
+    composite_confidence = float(score)
+    if phoneme_match is True:
+        composite_confidence = min(0.95, composite_confidence + 0.05)
+    elif phoneme_match is False:
+        composite_confidence = min(0.65, composite_confidence * 0.65)
+    elif phoneme_match is None:
+        composite_confidence = min(0.80, composite_confidence * 0.85)
+    if blow_detected:
+        composite_confidence *= 0.7
+    if not amp_data["amplitude_sustained"]:
+        composite_confidence *= 0.8
+
+    return {
+        "gamePass": is_pass,
+        "clinicalPass": clinical_pass,
+        "stars": stars,
+        "xp": xp,
+        "feedback": final_feedback,
+        "metrics": {
+            "duration": amp_data["duration_sec"],
+            "continuity": amp_data["amplitude_sustained"],
+            "phonemeMatch": phoneme_match,
+            "repetition": repetition_detected,
+            "noiseDetected": blow_detected,
+            "voicedRatio": voicing["pitched_ratio"],
+        },
+        "debug": {
+            "stutterType": stutter_type,
+            "confidence": round(composite_confidence, 2),
+            "wavlmLabel": label,
+            "sttTranscript": full_text,
+        }
+    }
+
+
 # ---------------------------------------------------------
 # SNAKE GAME ENDPOINT
 # ---------------------------------------------------------
-@app.route("/snake/analyze", methods=["POST"])
-def analyze_snake():
+@job_route("/snake/analyze", methods=["POST"])
+def analyze_snake(form, files):
     # 1. SETUP & VALIDATION
-    file = request.files.get("file") or request.files.get("audioFile")
+    file = files.get("file") or files.get("audioFile")
     if not file:
-        return jsonify({"success": False, "error": "Missing audio", "code": "MISSING_FIELD"}), 400
+        return {"success": False, "error": "Missing audio", "code": "MISSING_FIELD"}, 400
 
     filename = secure_filename(file.filename)
     if not any(filename.lower().endswith(ext) for ext in [f".{e}" for e in ALLOWED_EXTENSIONS]):
-        return jsonify({"success": False, "error": "Invalid format", "code": "INVALID_FORMAT"}), 400
+        return {"success": False, "error": "Invalid format", "code": "INVALID_FORMAT"}, 400
 
-    # Save original file
-    upload_filepath = os.path.join(os.getcwd(), filename)
-    file.save(upload_filepath)
-    
-    # Convert to WAV for consistent processing
-    filepath = os.path.join(os.getcwd(), "snake_session.wav")
+    # Decode once, straight from the upload stream; every analyzer below shares this clip
     try:
-        print(f"🔄 Converting audio to WAV: {upload_filepath} -> {filepath}")
-        audio, sr = librosa.load(upload_filepath, sr=16000, mono=True)
-        sf.write(filepath, audio, sr, format='WAV')
-        print(f"✅ Audio converted to WAV successfully")
+        print(f"🔄 Decoding audio: {filename}")
+        clip = decode_upload(file, "snake")
+        print(f"✅ Audio decoded ({clip.duration:.2f}s)")
+    except ClipTooLongError as e:
+        file.close()
+        return {"success": False, "error": str(e), "code": "CLIP_TOO_LONG"}, 413
     except Exception as conv_error:
+        file.close()
         print(f"❌ Audio conversion failed: {conv_error}")
-        return jsonify({"success": False, "error": "Failed to convert audio", "code": "CONVERSION_FAILED"}), 400
+        return {"success": False, "error": "Failed to convert audio", "code": "CONVERSION_FAILED"}, 400
     
     # Retrieve Game Data
-    target_phoneme = request.form.get("targetPhoneme") or request.form.get("prompt_phoneme")
-    tier = int(request.form.get("tier", 1))
+    target_phoneme = form.get("targetPhoneme") or form.get("prompt_phoneme")
+    tier = int(form.get("tier", 1))
 
     try:
         t0 = time.time()
         
-        # Initialize Score - Tier-based XP
-        stars = 3
-        if tier == 1:
-            xp = 10
-            penalty_per_error = 3
-        elif tier == 2:
-            xp = 20
-            penalty_per_error = 5
-        else:  # tier 3+
-            xp = 30
-            penalty_per_error = 7
-        
-        feedback_msgs = []
-        
-        # 2. RUN ANALYZERS
-        # A. AI Check (WavLM) for Repetitions
-        label, score = predict_file(filepath)
-        repetition_detected = "repetition" in label.lower()
+        # 2. RUN ANALYZERS (concurrently; each gets its share of the latency budget)
+        stages = yield {
+            # A. AI Check (WavLM) for Repetitions
+            "wavlm": Stage(
+                lambda: predict_file(clip), latency_budget.timeout_for("wavlm", WAVLM_TIMEOUT_S), WAVLM_FALLBACK
+            ),
+            # B. Amplitude Check
+            "amplitude": Stage(
+                lambda: analyze_amplitude(clip), latency_budget.timeout_for("amplitude", DSP_TIMEOUT_S), AMPLITUDE_FALLBACK
+            ),
+            # C. Voicing Check
+            "voicing": Stage(
+                lambda: analyze_voicing_noise(clip), latency_budget.timeout_for("voicing", DSP_TIMEOUT_S), VOICING_FALLBACK
+            ),
+            # D. Phoneme Validation (network-bound)
+            "stt": stt_stage(clip, timeout=latency_budget.timeout_for("stt", STT_TIMEOUT_S)),
+        }
+        timed_out = list(stages.timed_out)
+
+        # Late stages fall back to cheaper local signals
+        degraded = {}
+        voicing = stages["voicing"]
+        if "voicing" in timed_out:
+            voicing = analyze_voicing_energy(clip)
+            latency_budget.degrade(degraded, "voicing", "rms_zcr")
+        for name in ("wavlm", "amplitude"):
+            if name in timed_out:
+                latency_budget.degrade(degraded, name, "default")
+
+        # Nasal targets without a transcript: pitch-track for a hum if the budget allows
+        nasal_check = detect_nasal_phoneme_acoustic
+        _, words = stages["stt"]
+        if target_phoneme and phonemes.target_sound(target_phoneme) in NASAL_TARGETS and not words:
+            if "stt" in timed_out:
+                nasal_check = detect_nasal_energy
+                latency_budget.degrade(degraded, "stt", "voicing_ratio")
+            else:
+                nasal_stages = yield {
+                    "nasal": Stage(
+                        lambda: detect_nasal_phoneme_acoustic(clip), latency_budget.timeout_for("nasal", DSP_TIMEOUT_S), None
+                    ),
+                }
+                timed_out += nasal_stages.timed_out
+                if "nasal" in nasal_stages.timed_out:
+                    nasal_check = detect_nasal_energy
+                    latency_budget.degrade(degraded, "nasal", "voicing_ratio")
+                else:
+                    humming = nasal_stages["nasal"]
+                    nasal_check = lambda _clip: humming
+        elif "stt" in timed_out:
+            latency_budget.degrade(degraded, "stt", "no_transcript")
+
+        # 3. APPLY GAME RULES
+        data = score_snake(
+            clip, target_phoneme, tier,
+            stages["wavlm"], stages["amplitude"], voicing, stages["stt"],
+            nasal_check=nasal_check,
+        )
 
-        # B. Amplitude Check
-        amp_data = analyze_amplitude(filepath)
-        
-        # C. Voicing Check
-        voicing = analyze_voicing_noise(filepath)
+        # 4. STANDARDIZED RESPONSE
+        data["debug"]["inferenceTimeMs"] = int((time.time() - t0) * 1000)
+        data["debug"]["stageTimingsMs"] = stages.timings_ms
+        data["debug"]["timedOutStages"] = timed_out
+        data["debug"]["degradedStages"] = degraded
+        return {"success": True, "data": data}
 
-        # D. Phoneme Validation
-        full_text, words = get_google_transcript(filepath)
-        
-        # Check if transcript matches target
-        phoneme_match = None
-        if target_phoneme and words:
-            target = target_phoneme.strip().lower()
-            found = False
-            for w in words:
-                try:
-                    phonemes = g2p(w["word"])
-                    clean = [p for p in phonemes if p not in [" ", "'"]]
-                    for p in clean:
-                        raw = "".join([i for i in p if not i.isdigit()])
-                        mapped = PHONEME_MAP.get(raw, raw.lower())
-                        if mapped.lower() == target:
-                            found = True
-                            break
-                    if found:
-                        break
-                except Exception as phoneme_error:
-                    print(f"⚠️ Phoneme mapping failed for '{w.get('word', '?')}': {phoneme_error}")
-                    continue
-            phoneme_match = found
-        
-        # Simple fallback: If STT fails and target is nasal, just check if they're humming
-        if phoneme_match is None and target_phoneme:
-            target_lower = target_phoneme.strip().lower()
-            if target_lower in {'m', 'n', 'ng'}:
-                # Don't try to distinguish M vs N vs NG - just check if voiced
-                is_humming = detect_nasal_phoneme_acoustic(filepath)
-                if is_humming:
-                    phoneme_match = True  # Good enough!
-
-        # 3. APPLY DEDUCTION LOGIC
-        # RULE 1: CONTINUITY
-        if not amp_data["amplitude_sustained"]:
-            stars -= 1
-            xp -= penalty_per_error
-            feedback_msgs.append("Keep the sound smooth without stopping!")
+    except Exception as e:
+        print(f"Snake Analysis Error: {e}")
+        return {"success": False, "error": str(e), "code": "INTERNAL_ERROR"}, 500
 
-        # RULE 2: ANTI-BLOW / VOICING
-        blow_detected = False
-        if target_phoneme:
-            voiced_targets = {'a','e','i','o','u','oo','ee','er','m','n','l','r','w','y','ng','v','z','j'}
-            target_clean = target_phoneme.strip().lower()
-            
-            if target_clean in voiced_targets:
-                speech_likely = voicing['voiced_detected'] or (phoneme_match is True)
-                
-                if not speech_likely:
-                    blow_detected = True
-                    stars -= 1
-                    xp -= penalty_per_error
-                    feedback_msgs.append("Don't just blow air! Use your voice.")
-
-        # RULE 3: CONTENT
-        if phoneme_match is False:
-            stars -= 2
-            xp -= penalty_per_error * 2
-            feedback_msgs.append(f"I didn't hear the '{target_phoneme}' sound.")
-        elif phoneme_match is None:
-            if stars == 3:
-                stars = 2
-                xp -= penalty_per_error // 2
-                # Make feedback more helpful - show extended sound pattern
-                sound_pattern = target_phoneme * 5 if len(target_phoneme) == 1 else target_phoneme
-                feedback_msgs.append(f"Try to say '{sound_pattern}' more clearly!")
-
-        # RULE 4: REPETITION
-        if repetition_detected:
-            if amp_data["amplitude_sustained"]:
-                stars -= 1
-                xp -= penalty_per_error
-                feedback_msgs.append("Try not to repeat the sound.")
-
-        # 4. FINALIZE SCORES
-        stars = max(1, stars)
-        xp = max(1, xp)
-        is_pass = stars >= 2
-        clinical_pass = not blow_detected and not repetition_detected
-        final_feedback = " ".join(feedback_msgs) if feedback_msgs else "Perfect smooth speech! 🌟"
-
-        # Determine Stutter Type
-        stutter_type = "Fluent"
-        if blow_detected:
-            stutter_type = "Noise"
-        elif repetition_detected:
-            stutter_type = "Repetition"
-        elif not amp_data["amplitude_sustained"]:
-            stutter_type = "Block"
-        elif phoneme_match is False:
-            stutter_type = "Mismatch"
-
-        # Calculate composite confidence
-        composite_confidence = float(score)
-        if phoneme_match is True:
-            composite_confidence = min(0.95, composite_confidence + 0.05)
-        elif phoneme_match is False:
-            composite_confidence = min(0.65, composite_confidence * 0.65)
-        elif phoneme_match is None:
-            composite_confidence = min(0.80, composite_confidence * 0.85)
-        if blow_detected:
-            composite_confidence *= 0.7
-        if not amp_data["amplitude_sustained"]:
-            composite_confidence *= 0.8
-
-        # 5. STANDARDIZED RESPONSE
-        elapsed_ms = int((time.time() - t0) * 1000)
-        return jsonify({
-            "success": True,
-            "data": {
-                "gamePass": is_pass,
-                "clinicalPass": clinical_pass,
-                "stars": stars,
-                "xp": xp,
-                "feedback": final_feedback,
-                "metrics": {
-                    "duration": amp_data["duration_sec"],
-                    "continuity": amp_data["amplitude_sustained"],
-                    "phonemeMatch": phoneme_match,
-                    "repetition": repetition_detected,
-                    "noiseDetected": blow_detected,
-                    "voicedRatio": voicing["pitched_ratio"],
-                },
-                "debug": {
-                    "stutterType": stutter_type,
-                    "confidence": round(composite_confidence, 2),
-                    "wavlmLabel": label,
-                    "sttTranscript": full_text,
-                    "inferenceTimeMs": elapsed_ms
-                }
-            }
-        })
+    finally:
+        # Release the upload buffer (or its spooled temp file)
+        file.close()
+
+
+# ---------------------------------------------------------
+# SNAKE STREAMING ENDPOINTS
+# ---------------------------------------------------------
+# start -> chunk* -> finish. Chunks are raw 16 kHz mono PCM16 (little-endian).
+# STT, WavLM and the continuity state advance while the child is speaking, so
+# "finish" returns the same payload as /snake/analyze almost immediately.
+# Sessions live in-process: multi-instance deployments need session affinity.
+# start and finish take one of /snake/analyze's admission slots (429 when it is
+# full); chunks of an open session are never refused. Streams have no latency
+# budget: the work runs while the child speaks, and finish keeps the fixed
+# STT / WavLM deadlines (misses are listed in debug.timedOutStages).
+stream_sessions = SessionRegistry()
+
+
+def snake_admitted(view):
+    """Run a streaming view in an analyze_snake admission slot."""
+    def admitted_view(*args, **kwargs):
+        try:
+            with admission.admitted("analyze_snake"):
+                return view(*args, **kwargs)
+        except admission.Overloaded as e:
+            return overloaded(e)
+
+    admitted_view.__name__ = view.__name__
+    return admitted_view
+
+
+@app.route("/snake/stream", methods=["POST"])
+@snake_admitted
+def start_snake_stream():
+    target_phoneme = request.values.get("targetPhoneme") or request.values.get("prompt_phoneme")
+    tier = int(request.values.get("tier", 1))
 
+    try:
+        stt_stream = get_transport().stream(SAMPLE_RATE)
     except Exception as e:
-        print(f"Snake Analysis Error: {e}")
+        print(f"⚠️ Streaming STT unavailable, continuing without it: {e}")
+        stt_stream = None
+
+    session = StreamingSession(
+        {"targetPhoneme": target_phoneme, "tier": tier},
+        stt_stream,
+        lambda samples: submit_background(predict_file, samples),
+    )
+    if not stream_sessions.add(session):
+        session.close()
+        return jsonify({"success": False, "error": "Too many open streams", "code": "TOO_MANY_STREAMS"}), 503
+
+    return jsonify({
+        "success": True,
+        "sessionId": session.id,
+        "sampleRate": SAMPLE_RATE,
+        "format": "pcm_s16le",
+    })
+
+
+@app.route("/snake/stream/<session_id>/chunk", methods=["POST"])
+def snake_stream_chunk(session_id):
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({"success": False, "error": "Unknown or expired session", "code": "SESSION_NOT_FOUND"}), 404
+
+    try:
+        state = session.feed(request.get_data(cache=False))
+    except ValueError as e:
+        stream_sessions.discard(session_id)
+        return jsonify({"success": False, "error": str(e), "code": "STREAM_TOO_LONG"}), 413
+
+    return jsonify({"success": True, "state": state})
+
+
+@app.route("/snake/stream/<session_id>/finish", methods=["POST"])
+@snake_admitted
+def finish_snake_stream(session_id):
+    session = stream_sessions.pop(session_id)
+    if session is None:
+        return jsonify({"success": False, "error": "Unknown or expired session", "code": "SESSION_NOT_FOUND"}), 404
+
+    try:
+        t0 = time.time()
+
+        # Optional last chunk in the finish request
+        final_chunk = request.get_data(cache=False)
+        if final_chunk:
+            try:
+                session.feed(final_chunk)
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e), "code": "STREAM_TOO_LONG"}), 413
+
+        clip, wavlm_result, transcript = session.finish(
+            stt_timeout=STT_TIMEOUT_S, wavlm_timeout=WAVLM_TIMEOUT_S
+        )
+        if len(clip.samples) == 0:
+            return jsonify({"success": False, "error": "No audio received", "code": "MISSING_FIELD"}), 400
+
+        timed_out = []
+        if wavlm_result is None:
+            wavlm_result = WAVLM_FALLBACK
+            timed_out.append("wavlm")
+        if transcript is None:
+            transcript = STT_FALLBACK
+            timed_out.append("stt")
+
+        # Cheap DSP on the full clip keeps the verdict identical to /snake/analyze
+        data = score_snake(
+            clip, session.params["targetPhoneme"], session.params["tier"],
+            wavlm_result, analyze_amplitude(clip), analyze_voicing_noise(clip), transcript,
+        )
+        data["debug"]["inferenceTimeMs"] = int((time.time() - t0) * 1000)
+        data["debug"]["streamed"] = True
+        data["debug"]["streamDurationSec"] = round(clip.duration, 2)
+        data["debug"]["timedOutStages"] = timed_out
+        return jsonify({"success": True, "data": data})
+
+    except Exception as e:
+        print(f"Snake Stream Error: {e}")
         return jsonify({"success": False, "error": str(e), "code": "INTERNAL_ERROR"}), 500
 
     finally:
-        # Clean up both original and converted files
-        if os.path.exists(upload_filepath):
-            try:
-                os.remove(upload_filepath)
-            except:
-                pass
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except:
-                pass
+        # Popped from the registry: nothing else will abort a late STT stream
+        session.close()
 
 
-@app.route("/analyze/balloon", methods=["POST"])
-def analyze_balloon():
-    if "file" not in request.files:
-        return jsonify({"error": "No file"}), 400
-    file = request.files["file"]
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(os.getcwd(), filename)
-    file.save(filepath)
+@job_route("/analyze/balloon", methods=["POST"])
+def analyze_balloon(form, files):
+    if "file" not in files:
+        return {"error": "No file"}, 400
+    file = files["file"]
 
     try:
         t0 = time.time()
+        try:
+            clip = decode_upload(file, "balloon")
+        except ClipTooLongError as e:
+            return {"error": str(e)}, 413
 
         # 1. AI Check (WavLM)
-        label, score = predict_file(filepath)
+        label, score = predict_file(clip)
 
         # Hard attack often sounds like a block
         hard_attack = "block" in label.lower() or (
@@ -776,46 +1284,41 @@ def analyze_balloon():
         )
 
         # 2. Breath Check
-        breath_data = detect_breath(filepath)
+        breath_data = detect_breath(clip)
         game_pass = breath_data["breath_detected"]
 
         clinical_pass = not hard_attack
         is_hit = game_pass and clinical_pass
 
-        return jsonify(
-            {
-                "breath_detected": breath_data["breath_detected"],
-                "amplitude_onset": breath_data["amplitude_onset"],
-                "game_pass": game_pass,
-                "hard_attack_detected": hard_attack,
-                "clinical_pass": clinical_pass,
-                "confidence": score,
-                "feedback": get_feedback(
-                    "balloon", is_hit, "Block" if hard_attack else None
-                ),
-                "elapsed_ms": int((time.time() - t0) * 1000),
-            }
-        )
+        return {
+            "breath_detected": breath_data["breath_detected"],
+            "amplitude_onset": breath_data["amplitude_onset"],
+            "game_pass": game_pass,
+            "hard_attack_detected": hard_attack,
+            "clinical_pass": clinical_pass,
+            "confidence": score,
+            "feedback": get_feedback(
+                "balloon", is_hit, "Block" if hard_attack else None
+            ),
+            "elapsed_ms": int((time.time() - t0) * 1000),
+        }
     finally:
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except:
-                pass
+        # Release the upload buffer (or its spooled temp file)
+        file.close()
 
 
-@app.route("/analyze/tapping", methods=["POST"])
-def analyze_tapping():
+@job_route("/analyze/tapping", methods=["POST"])
+def analyze_tapping(form, files):
     """
     Syllable Tapping Analysis (Rhythm & Content Verification)
     """
-    if "audio" not in request.files:
-        return jsonify({"error": "No audio file"}), 400
+    if "audio" not in files:
+        return {"error": "No audio file"}, 400
 
-    file = request.files["audio"]
-    target_word = request.form.get("targetWord", "").strip().lower()
-    syllables_json = request.form.get("syllables", "[]")
-    taps_json = request.form.get("taps", "[]")
+    file = files["audio"]
+    target_word = form.get("targetWord", "").strip().lower()
+    syllables_json = form.get("syllables", "[]")
+    taps_json = form.get("taps", "[]")
     
     import json
     try:
@@ -825,17 +1328,15 @@ def analyze_tapping():
         syllables = []
         taps = []
 
-    filename = secure_filename(file.filename)
-    upload_filepath = os.path.join(os.getcwd(), filename)
-    file.save(upload_filepath)
-
-    wav_filepath = os.path.join(os.getcwd(), "tapping_session.wav")
     try:
-        audio, sr = librosa.load(upload_filepath, sr=16000, mono=True)
-        sf.write(wav_filepath, audio, sr, format='WAV')
+        clip = decode_upload(file, "tapping")
+    except ClipTooLongError as e:
+        file.close()
+        return {"error": str(e)}, 413
     except Exception as conv_error:
         print(f"❌ Audio conversion failed: {conv_error}")
-        return jsonify({"error": "Failed to convert audio"}), 400
+        file.close()
+        return {"error": "Failed to convert audio"}, 400
 
     try:
         t0 = time.time()
@@ -845,17 +1346,24 @@ def analyze_tapping():
         stt_confidence = 0.0
         syllable_matches = [False] * len(syllables)
         
+        # STT (network) and WavLM (CPU) are independent - run them together
+        stages = yield {
+            "stt": stt_stage(clip, timeout=latency_budget.timeout_for("stt", STT_TIMEOUT_S)),
+            "wavlm": Stage(
+                lambda: predict_file(clip), latency_budget.timeout_for("wavlm", WAVLM_TIMEOUT_S), WAVLM_FALLBACK
+            ),
+        }
+        degraded = {}
+        if "stt" in stages.timed_out:
+            latency_budget.degrade(degraded, "stt", "wavlm_only")
+        if "wavlm" in stages.timed_out:
+            latency_budget.degrade(degraded, "wavlm", "default")
+
         try:
-            transcript, words_data = get_google_transcript(wav_filepath)
+            transcript, words_data = stages["stt"]
             
-            # --- PHONEME MATCHING LOGIC ---
-            # 1. Convert Transcript to Phonemes (clean numbers/stress)
-            # Remove stress digits (0,1,2)
-            trans_phonemes_raw = g2p(transcript)
-            trans_phonemes = [p for p in trans_phonemes_raw if p not in [" ", "'"]]
-            trans_phonemes = ["".join([c for c in p if not c.isdigit()]) for p in trans_phonemes]
-            
-            # 2. Sequential Sub-sequence Search
+            # --- SYLLABLE MATCHING LOGIC ---
+            # Sequential search of each syllable in the transcript text
             current_idx = 0
             for i, syl in enumerate(syllables):
                 try:
@@ -880,12 +1388,16 @@ def analyze_tapping():
         except Exception as e:
             print(f"STT Error: {e}")
 
-        # 2. WaveLM (Fluency Verification) - Use converted WAV file
-        label, wavlm_score = predict_file(wav_filepath)
+        # 2. WaveLM (Fluency Verification) - Use the decoded clip
+        label, wavlm_score = stages["wavlm"]
         is_fluent = "fluent" in label.lower()
         
         # 3. Rhythm/Tap Analysis
         tap_count_match = len(taps) == len(syllables)
+
+        # No transcript in time: WavLM-only verdict, fluency and tap count decide every part
+        if "stt" in degraded:
+            syllable_matches = [is_fluent and tap_count_match] * len(syllables)
         
         # 4. Feedback Generation
         feedback = ""
@@ -901,72 +1413,81 @@ def analyze_tapping():
                 feedback = "Perfect! You said every part clearly!"
             else:
                 feedback = "Great job getting the words right, but try to be smoother."
+        elif "stt" in degraded:
+            feedback = "Try to say it smoothly, one part for each tap."
         elif correct_syllables_count > 0:
             feedback = f"You got {correct_syllables_count} out of {len(syllables)} parts. Keep trying!"
         else:
             feedback = "I didn't hear the parts clearly. Try saying them louder."
             
-        return jsonify({
+        return {
             "accuracy": accuracy,
             "transcript": transcript,
             "feedback": feedback,
             "is_sync": tap_count_match,
             "fluent": is_fluent,
-            "syllable_matches": syllable_matches
-        })
+            "syllable_matches": syllable_matches,
+            "stage_timings_ms": stages.timings_ms,
+            "timed_out_stages": stages.timed_out,
+            "degraded_stages": degraded,
+        }
 
     except Exception as e:
         print(f"Tapping Analysis Error: {e}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
         
     finally:
-        # Clean up both original and converted files
-        for path in [upload_filepath, wav_filepath]:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except:
-                    pass
+        # Release the upload buffer (or its spooled temp file)
+        file.close()
 
 
 # ---------------------------------------------------------
 # TURTLE GAME ENDPOINT (with transcript matching)
 # ---------------------------------------------------------
-@app.route("/analyze/turtle", methods=["POST"])
-def analyze_turtle():
+@job_route("/analyze/turtle", methods=["POST"])
+def analyze_turtle(form, files):
     """Analyze Turtle Game audio for WPM and transcript matching."""
-    file = request.files.get("file") or request.files.get("audioFile")
+    file = files.get("file") or files.get("audioFile")
     if not file:
-        return jsonify({"success": False, "error": "Missing audio"}), 400
+        return {"success": False, "error": "Missing audio"}, 400
 
-    filename = secure_filename(file.filename)
-    upload_filepath = os.path.join(os.getcwd(), filename)
-    file.save(upload_filepath)
-    
-    # Convert to WAV for consistent processing
-    filepath = os.path.join(os.getcwd(), "turtle_session.wav")
+    # Decode once (from the upload stream) for consistent processing
     try:
-        print(f"🔄 Converting audio to WAV: {upload_filepath} -> {filepath}")
-        audio, sr = librosa.load(upload_filepath, sr=16000, mono=True)
-        sf.write(filepath, audio, sr, format='WAV')
-        print(f"✅ Audio converted to WAV successfully")
+        print(f"🔄 Decoding audio: {file.filename}")
+        clip = decode_upload(file, "turtle")
+        print(f"✅ Audio decoded ({clip.duration:.2f}s)")
+    except ClipTooLongError as e:
+        file.close()
+        return {"success": False, "error": str(e)}, 413
     except Exception as conv_error:
+        file.close()
         print(f"❌ Audio conversion failed: {conv_error}")
-        return jsonify({"success": False, "error": "Failed to convert audio"}), 400
+        return {"success": False, "error": "Failed to convert audio"}, 400
     
     # Get params
-    target_text = request.form.get("targetText", "")
-    tier = int(request.form.get("tier", 1))
+    target_text = form.get("targetText", "")
+    tier = int(form.get("tier", 1))
     
     try:
         t0 = time.time()
         
-        # 1. Get Google STT transcript
-        full_text, words = get_google_transcript(filepath)
+        # 1. Get Google STT transcript (turtle only has a budget when the client sends one)
+        stages = yield {"stt": stt_stage(clip, timeout=latency_budget.timeout_for("stt", STT_TIMEOUT_S))}
+        full_text, words = stages["stt"]
+
+        # No transcript in time: speech rate from the audio, the words can't be checked (and don't pass)
+        degraded = {}
+        content_checked = "stt" not in stages.timed_out
+        if not content_checked:
+            latency_budget.degrade(degraded, "stt", "acoustic_rate")
+            if target_text:
+                latency_budget.degrade(degraded, "content", "not_checked")
         
         # 2. Calculate WPM
         wpm = 0
-        if words and len(words) >= 2:
+        if not content_checked:
+            wpm = estimate_wpm_acoustic(clip)
+        elif words and len(words) >= 2:
             first_start = words[0]['start']
             last_end = words[-1]['end']
             duration = last_end - first_start
@@ -1020,6 +1541,8 @@ def analyze_turtle():
                 feedback = "Great job being slow! Try to speak a tiny bit faster."
             else:
                 feedback = "Slow down! Remember, the turtle likes to go slow."
+        elif not transcript_match and target_text and not content_checked:
+            feedback = "Good speed! I couldn't check the words this time, try again."
         elif not transcript_match and target_text:
             feedback = "Good speed! But try to say the exact words."
         else:
@@ -1035,7 +1558,7 @@ def analyze_turtle():
         
         elapsed = int((time.time() - t0) * 1000)
         
-        return jsonify({
+        return {
             "success": True,
             "game_pass": game_pass,
             "clinical_pass": clinical_pass,
@@ -1044,39 +1567,289 @@ def analyze_turtle():
             "xp": xp,
             "transcript": full_text,
             "transcript_match": transcript_match,
-            "elapsed_ms": elapsed
-        })
+            "elapsed_ms": elapsed,
+            "degraded_stages": degraded,
+        }
         
     except Exception as e:
         print(f"Turtle analysis error: {e}")
-        return jsonify({
+        return {
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500
     finally:
-        # Clean up both original and converted files
-        if os.path.exists(upload_filepath):
-            try:
-                os.remove(upload_filepath)
-            except:
-                pass
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except:
-                pass
+        # Release the upload buffer (or its spooled temp file)
+        file.close()
+
+
+# ---------------------------------------------------------
+# BATCH ENDPOINT (many clips in one request)
+# ---------------------------------------------------------
+# game -> (job, upload field the single-clip endpoint expects)
+BATCH_GAMES = {
+    "snake": (analyze_snake, "file"),
+    "turtle": (analyze_turtle, "file"),
+    "tapping": (analyze_tapping, "audio"),
+    "balloon": (analyze_balloon, "file"),
+    "analyze_audio": (analyze_audio, "file"),
+}
+BATCH_WAVLM_GAMES = {"snake", "tapping", "balloon"}  # Games that score the whole clip with predict_file
+BATCH_MAX_CLIPS = int(os.environ.get("BATCH_MAX_CLIPS", "32"))
+
+
+def _batch_form(item):
+    """An item's parameters as the form fields of its single-clip endpoint."""
+    fields = {}
+    for key, value in item.items():
+        if key in ("game", "file", "id") or value is None:
+            continue
+        fields[key] = json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+    return ImmutableMultiDict(fields)
+
+
+def _split_view_result(rv):
+    """(body, status) from a job's return value (dict or (dict, status[, headers]))."""
+    if isinstance(rv, tuple):
+        return rv[0], rv[1]
+    return rv, 200
+
+
+@job_route("/analyze/batch", methods=["POST"])
+def analyze_batch(form, files):
+    """
+    Many clips in one multipart request (e.g. an offline session sync).
+    `items` is a JSON list of {"game", "file" (upload field name), "id"?,
+    ...the game's form fields such as targetPhoneme / targetText / tier}.
+    Clips are decoded in parallel and scored in one batched WavLM pass; STT
+    and the other stages of every clip run as one fan-out. Each result has
+    the body and status the single-clip endpoint would have returned.
+    """
+    try:
+        t0 = time.time()
+        try:
+            items = json.loads(form.get("items", ""))
+        except json.JSONDecodeError:
+            items = None
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            return {"success": False, "error": "items must be a non-empty JSON list of objects", "code": "INVALID_ITEMS"}, 400
+        if len(items) > BATCH_MAX_CLIPS:
+            return {"success": False, "error": f"At most {BATCH_MAX_CLIPS} clips per batch", "code": "TOO_MANY_CLIPS"}, 413
+
+        # 1. DECODE every upload in parallel (once per game sharing it: one reader per stream)
+        games_by_field = {}
+        for item in items:
+            field = item.get("file") or ""
+            if item.get("game") in BATCH_GAMES and field in files:
+                games_by_field.setdefault(field, set()).add(item["game"])
+        decode_stages = {
+            field: Stage(lambda upload=files[field], games=games: {game: DecodedUpload(upload, game) for game in games})
+            for field, games in games_by_field.items()
+        }
+        by_field = (yield decode_stages).values if decode_stages else {}
+        decoded = {
+            i: by_field[item["file"]][item["game"]]
+            for i, item in enumerate(items)
+            if item.get("file") in by_field and item.get("game") in by_field[item["file"]]
+        }
+
+        # 2. BATCHED WAVLM PASSES (equal lengths only, so each score is the single-clip one);
+        #    the jobs' predict_file calls then hit the result cache
+        wavlm_clips = {}
+        for i, upload in decoded.items():
+            if items[i]["game"] in BATCH_WAVLM_GAMES and upload.clip is not None and len(upload.clip.samples):
+                wavlm_clips[upload.clip.digest] = upload.clip
+        if wavlm_clips:
+            predictions = predict_segments([clip.samples for clip in wavlm_clips.values()])
+            for digest, prediction in zip(wavlm_clips, predictions):
+                result_cache.get_or_compute(("wavlm", MODEL_VERSION, digest), lambda prediction=prediction: prediction)
+
+        # 3. RUN each clip's own endpoint job, all stages together
+        factories = []
+        for i, item in enumerate(items):
+            game = item.get("game")
+            if game not in BATCH_GAMES:
+                factories.append(lambda game=game: ({"error": f"Unknown game '{game}'", "code": "INVALID_GAME"}, 400))
+                continue
+            job, field = BATCH_GAMES[game]
+            item_files = {field: decoded[i]} if i in decoded else {}
+            factories.append(lambda job=job, item_form=_batch_form(item), item_files=item_files: job(item_form, item_files))
+        outcomes = yield from drive_jobs(factories)
+
+        results = []
+        for i, (item, outcome) in enumerate(zip(items, outcomes)):
+            error = failed_error(outcome)
+            if error is not None:
+                print(f"Batch item {i} error: {error}")
+                body, status = {"error": str(error)}, 500
+            else:
+                body, status = _split_view_result(outcome)
+            results.append({"id": item.get("id", i), "game": item.get("game"), "status": status, "body": body})
+
+        return {
+            "success": True,
+            "count": len(results),
+            "results": results,
+            "elapsed_ms": int((time.time() - t0) * 1000),
+        }
+
+    except Exception as e:
+        print(f"Batch Analysis Error: {e}")
+        return {"success": False, "error": str(e), "code": "INTERNAL_ERROR"}, 500
+
+    finally:
+        # Release the upload buffers (or their spooled temp files)
+        for _, upload in files.items(multi=True):
+            upload.close()
+
+
+# --- STARTUP & WARMUP ---
+
+def warmup():
+    """
+    Exercise every first-call path on synthetic audio so real requests don't pay
+    for it: librosa/numba JIT, FFT plans, resampling, and a batched forward pass.
+    """
+    sr = SAMPLE_RATE
+    t = np.arange(int(1.5 * sr)) / sr
+    tone = (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    tone[: sr // 4] = 0.0  # Leading silence for trim / breath paths
+
+    with startup.phase("warmup_dsp"):
+        import librosa
+
+        features = AudioClip(tone).features
+        _ = (features.rms, features.zcr, features.trimmed_bounds, features.stft_magnitude)
+        features.voicing(fmin=80, fmax=400)
+        features.voicing(fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'))
+        # Container sniffing, header probe and resampling at every quality
+        tone_22k = io.BytesIO()
+        sf.write(tone_22k, tone[:sr // 2], 22050, format='WAV', subtype='PCM_16')
+        for quality in set(RESAMPLE_QUALITY.values()):
+            load_clip(tone_22k, quality=quality)
+        AudioClip(tone).wav_bytes
+
+    with startup.phase("warmup_inference"):
+        # Uncached, unscheduled: warm the extractor and model for 1 and 2 clip batches
+        predict_batch([tone], return_all_scores=True)
+        predict_batch([tone, tone[: sr]], return_all_scores=True)
+
+
+def warm_stt_client():
+    try:
+        get_transport().warm()
+    except Exception as e:
+        # STT failures are handled per request; don't block readiness on them
+        print(f"⚠️ STT client warmup failed: {e}")
+
+
+def run_startup(raise_errors=True):
+    """G2P, model load, warmup and STT client pool, timed per phase."""
+    try:
+        with startup.phase("phonemes"):
+            # Also checks the NLTK data is installed (nothing is downloaded here)
+            phonemes.get_g2p()
+            print(f"🔤 Precomputed phonemes for {phonemes.precompute_game_content()} game content words")
+
+        with startup.phase("model"):
+            load_model()
+
+        if WARMUP_ENABLED:
+            warmup()
+
+        if STT_WARMUP:
+            with startup.phase("stt_client"):
+                warm_stt_client()
+
+        startup.mark_ready()
+    except Exception as e:
+        startup.fail(e)
+        if raise_errors:
+            raise
+
+
+HEALTH_ENDPOINTS = {"health", "health_live", "health_ready", "export_metrics", "list_profiles", "download_profile"}
+
+
+@app.before_request
+def wait_until_ready():
+    """Hold analysis requests until startup has finished (STARTUP_MODE=background)."""
+    if startup.ready or request.endpoint in HEALTH_ENDPOINTS:
+        return None
+    if not startup.wait(STARTUP_WAIT_S):
+        return jsonify({"error": "Model not ready", "startup": startup.status()}), 503, {"Retry-After": "5"}
+    return None
 
 
 # --- HEALTH CHECK ---
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    """Liveness: the process answers; fails only when startup crashed."""
+    status = startup.status()
+    if startup.failed:
+        return jsonify({"status": "failed", **status}), 500
+    return jsonify({"status": "ok", **status}), 200
+
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    """Readiness: model loaded and warmed up."""
+    status = startup.status()
+    return jsonify({"status": "ready" if startup.ready else "starting", **status}), 200 if startup.ready else 503
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({
         "status": "ok", 
         "model": "WavLM", 
-        "device": device
+        "ready": startup.ready,
+        "startup": startup.status(),
+        "device": device,
+        "backend": INFERENCE_BACKEND,
+        "quantize": MODEL_QUANTIZE or "fp32",
+        "share": MODEL_SHARE or "per-process",
+        "memory": process_memory(),
+        "inference": inference_scheduler.stats() if inference_scheduler else None,
+        "earlyExit": early_exit.stats() if early_exit else None,
+        "modelVersion": MODEL_VERSION,
+        "resultCache": result_cache.stats(),
+        "decoders": decoder_status(),
+        "admission": admission.stats(),
     }), 200
 
 
+@app.route("/metrics", methods=["GET"])
+def export_metrics():
+    """Per-stage and per-request latency histograms (Prometheus text format)."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    """Recent request profiles (needs X-Profile: <PROFILE_SECRET>, or localhost when unset)."""
+    if not profiling.authorized(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify({"dir": profiling.PROFILE_DIR, "profiles": profiling.recent_profiles(limit)}), 200
+
+
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def download_profile(profile_id):
+    """One saved profile as a pstats file."""
+    if not profiling.authorized(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        return jsonify({"error": "Unknown profile"}), 404
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=f"{profile_id}.prof")
+
+
+if STARTUP_MODE == "background":
+    threading.Thread(target=run_startup, kwargs={"raise_errors": False}, name="startup", daemon=True).start()
+else:
+    run_startup()
+
+
 if __name__ == "__main__":
     # Debug=False prevents reloading large models twice
     app.run(host="0.0.0.0", port=PORT, debug=False)
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+ASGI entry point: the endpoints of app.py served from an event loop.
+
+Usage (from the server folder):
+    uvicorn asgi:application --port 5000
+    SERVE_MODE=async gunicorn -c gunicorn.conf.py asgi:application
+
+Upload endpoints (JOB_ROUTES) are driven with run_job_async: form parsing,
+decoding, WavLM and DSP run on the bounded CPU pool (ASYNC_CPU_WORKERS),
+while Google STT is awaited on the asyncio gRPC client, so a request waiting
+on STT holds no thread. Flask still parses the request and builds the
+response (before/after-request hooks, CORS, JSON), so the contracts are the
+same as under gunicorn's sync workers. Other routes (health, streaming
+sessions) run the Flask app unchanged on the CPU pool.
+"""
+import sys
+import tempfile
+
+from werkzeug.datastructures import EnvironHeaders
+from werkzeug.exceptions import HTTPException
+
+import admission
+import latency_budget
+import metrics
+import profiling
+from app import JOB_ROUTES, UPLOAD_SPOOL_BYTES, app, overloaded
+from stage_runner import run_cpu, run_job_async
+
+
+async def _read_body(receive):
+    """Request body, spooled like Flask uploads (memory first, then an anonymous temp file)."""
+    body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="w+b")
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.write(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    body.seek(0)
+    return body
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        key = raw_name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = f"HTTP_{key}"
+        value = raw_value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _match_job(environ):
+    """The job for this request, or None to let Flask handle it (other routes, 404/405, CORS preflight)."""
+    if environ["REQUEST_METHOD"] == "OPTIONS":
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return JOB_ROUTES.get(endpoint)
+
+
+def _collect(wsgi_app, environ):
+    """Run a WSGI callable (the Flask app or a Response) to (status, headers, body)."""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return started[0], started[1], body
+
+
+def _before_request(environ):
+    """Flask's before_request hooks (readiness wait); a response short-circuits the job."""
+    with app.request_context(environ):
+        rv = app.preprocess_request()
+        return None if rv is None else app.finalize_request(rv)
+
+
+def _finish(environ, rv):
+    """Turn a job's return value (or exception) into a response, as Flask's dispatch would."""
+    with app.request_context(environ):
+        try:
+            if isinstance(rv, Exception):
+                raise rv
+            return app.finalize_request(rv)
+        except Exception as e:
+            try:
+                return app.finalize_request(app.handle_user_exception(e))
+            except Exception as unhandled:
+                return app.handle_exception(unhandled)
+
+
+def _start_job(job, request):
+    with metrics.timed("upload"):
+        form, files = request.form, request.files
+    return job(form, files)
+
+
+async def _run_job(job, environ):
+    # Started here so every step on the CPU pool inherits the timer, profile and latency budget
+    _, token = metrics.start_request(job.__name__)
+    _, profile_token = profiling.start_request(EnvironHeaders(environ), job.__name__)
+    _, budget_token = latency_budget.start_request(EnvironHeaders(environ), job.__name__)
+    try:
+        response = await run_cpu(_before_request, environ)
+        if response is None:
+            request = app.request_class(environ)
+            try:
+                async with admission.admitted_async(job.__name__):
+                    rv = await run_job_async(_start_job, job, request)
+            except admission.Overloaded as e:
+                rv = overloaded(e)
+            except Exception as e:
+                rv = e
+            finally:
+                request.close()
+            response = await run_cpu(_finish, environ, rv)
+        return _collect(response, environ)
+    finally:
+        latency_budget.finish_request(budget_token)
+        profiling.finish_request(profile_token)
+        metrics.finish_request(token)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        # app.py loads and warms the model on import (see STARTUP_MODE)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    body = await _read_body(receive)
+    try:
+        environ = _environ(scope, body)
+        job = _match_job(environ)
+        if job is None:
+            status, headers, content = await run_cpu(_collect, app, environ)
+        else:
+            status, headers, content = await _run_job(job, environ)
+    finally:
+        body.close()
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": content})
@@ -0,0 +1,99 @@
+import hashlib
+import io
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import soundfile as sf
+
+import metrics
+from audio_decoders import SAMPLE_RATE, ClipTooLongError, decode, probe
+from clip_features import ClipFeatures
+
+# ============================================================================
+# StamFree Backend - Decoded Audio Clip
+# ============================================================================
+# Every analyzer works on 16 kHz mono float32 audio. A request decodes the
+# upload exactly once into an AudioClip and hands that same object to WavLM,
+# the DSP heuristics and Google STT.
+
+
+@dataclass(eq=False)
+class AudioClip:
+    """A decoded 16 kHz mono float32 clip shared by every analyzer in a request."""
+
+    samples: np.ndarray
+    sample_rate: int = SAMPLE_RATE
+
+    @property
+    def duration(self):
+        """Clip length in seconds."""
+        return len(self.samples) / float(self.sample_rate)
+
+    @cached_property
+    def features(self):
+        """Frame-level features (RMS, ZCR, voicing, trim bounds), computed lazily once per clip."""
+        return ClipFeatures(self.samples, self.sample_rate)
+
+    @cached_property
+    def digest(self):
+        """Content hash of the decoded samples (result cache key)."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(self.sample_rate).encode())
+        h.update(np.ascontiguousarray(self.samples).tobytes())
+        return h.hexdigest()
+
+    @cached_property
+    def wav_bytes(self):
+        """LINEAR16 WAV encoding of the clip (for Google STT)."""
+        wav_buffer = io.BytesIO()
+        sf.write(wav_buffer, self.samples, self.sample_rate, format='WAV', subtype='PCM_16')
+        return wav_buffer.getvalue()
+
+
+def _is_stt_ready_wav(info):
+    """True if the upload is already the LINEAR16 16 kHz mono WAV that STT expects."""
+    return info.container == "wav" and info.subtype == "PCM_16" and info.channels == 1 and info.sample_rate == SAMPLE_RATE
+
+
+def load_clip(source, filename=None, quality="high", max_seconds=None):
+    """
+    Decode an audio file into an AudioClip.
+    `source` is a path or a binary file-like object (e.g. an upload stream);
+    `filename` gives the extension when the container can't be sniffed.
+    `quality` picks the resampler ("fast" / "balanced" / "high"); clips longer
+    than `max_seconds` raise ClipTooLongError, from the header when it has a duration.
+    """
+    if not hasattr(source, "read"):
+        with open(source, "rb") as stream:
+            return load_clip(stream, filename or source, quality, max_seconds)
+
+    with metrics.timed("decode"):
+        info = probe(source, filename)
+        if max_seconds and info.duration is not None and info.duration > max_seconds:
+            raise ClipTooLongError(info.duration, max_seconds)
+
+        wav_bytes = None
+        if _is_stt_ready_wav(info):
+            # Hand the upload's own bytes to STT instead of re-encoding
+            wav_bytes = source.read()
+            source = io.BytesIO(wav_bytes)
+
+        clip = AudioClip(decode(source, info, quality))
+    if max_seconds and clip.duration > max_seconds:
+        raise ClipTooLongError(clip.duration, max_seconds)
+    if wav_bytes is not None:
+        clip.__dict__["wav_bytes"] = wav_bytes  # Pre-fill the cached_property
+    return clip
+
+
+def as_clip(audio_input):
+    """
+    Normalize analyzer input to an AudioClip.
+    Accepts an AudioClip, a filepath (str) or a 16 kHz numpy array.
+    """
+    if isinstance(audio_input, AudioClip):
+        return audio_input
+    if isinstance(audio_input, str):
+        return load_clip(audio_input)
+    return AudioClip(np.asarray(audio_input, dtype=np.float32))
@@ -0,0 +1,381 @@
+import contextlib
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile as sf
+
+import metrics
+
+# ============================================================================
+# StamFree Backend - Audio Decoder Registry
+# ============================================================================
+# Most uploads are AAC/M4A from phones (WebM/Opus from the web build). The
+# container is sniffed from the first bytes and the duration read from its
+# header, so over-long clips are rejected before anything is decoded. Each
+# container maps to an ordered list of decoder backends; the first one that
+# is installed and succeeds returns 16 kHz mono float32:
+#   - sndfile: libsndfile (WAV/FLAC/OGG/MP3), then resample
+#   - pyav:    FFmpeg in-process via PyAV, reading the upload stream directly
+#   - ffmpeg:  ffmpeg CLI, upload piped to stdin, raw f32le 16 kHz mono back
+#   - librosa: audioread through a file path (slowest, last resort)
+# ffmpeg (moov-at-end MP4) and librosa need a seekable file rather than a
+# stream: the upload goes into an in-memory memfd where Linux provides one,
+# else a temp file, and each copy is counted in stamfree_decode_spool_total.
+# Resampler quality is picked per call: "fast" / "balanced" / "high".
+
+SAMPLE_RATE = 16000
+AUDIO_DECODERS = [d.strip() for d in os.environ.get("AUDIO_DECODERS", "pyav,ffmpeg").split(",") if d.strip()]
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+FFMPEG_TIMEOUT_S = float(os.environ.get("FFMPEG_TIMEOUT_S", "10"))
+CLIP_MAX_SECONDS = float(os.environ.get("CLIP_MAX_SECONDS", "30"))
+
+RESAMPLE_QUALITIES = ("fast", "balanced", "high")
+SOXR_RES_TYPES = {"fast": "soxr_lq", "balanced": "soxr_mq", "high": "soxr_hq"}
+FFMPEG_RESAMPLERS = {
+    "fast": f"aresample={SAMPLE_RATE}:filter_size=8",
+    "balanced": f"aresample={SAMPLE_RATE}",
+    "high": f"aresample={SAMPLE_RATE}:filter_size=64:phase_shift=12:cutoff=0.97",
+}
+
+EXTENSION_CONTAINERS = {
+    ".wav": "wav", ".flac": "flac", ".ogg": "ogg", ".opus": "ogg", ".mp3": "mp3",
+    ".m4a": "mp4", ".mp4": "mp4", ".aac": "aac", ".webm": "webm",
+}
+
+
+class ClipTooLongError(ValueError):
+    """The clip is longer than the endpoint accepts."""
+
+    def __init__(self, duration, max_seconds):
+        super().__init__(f"Clip is {duration:.1f}s; the limit is {max_seconds:g}s")
+        self.duration = duration
+        self.max_seconds = max_seconds
+
+
+@dataclass
+class ClipInfo:
+    """What the header says, read without decoding any audio."""
+
+    container: str = None
+    duration: float = None  # None when the header doesn't carry it (e.g. MediaRecorder WebM)
+    sample_rate: int = None
+    channels: int = None
+    subtype: str = None
+    streamable: bool = True  # False for MP4 with the moov atom after the audio
+
+
+# --- CONTAINER SNIFFING ---
+def sniff_container(head):
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0:
+        return "aac"  # ADTS
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+# --- HEADER DURATION ---
+def _mp4_boxes(stream, start, end):
+    """(type, payload_start, box_end) for the boxes in [start, end)."""
+    pos = start
+    while end is None or pos + 8 <= end:
+        stream.seek(pos)
+        header = stream.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        payload = pos + 8
+        if size == 1:
+            size = struct.unpack(">Q", stream.read(8))[0]
+            payload += 8
+        elif size == 0:
+            stream.seek(0, os.SEEK_END)
+            size = stream.tell() - pos
+        if size < payload - pos:
+            return
+        yield box_type, payload, pos + size
+        pos += size
+
+
+def _mp4_info(stream, info):
+    """Duration from moov/mvhd; moov before mdat means ffmpeg can read it from a pipe."""
+    seen_mdat = False
+    for box_type, payload, box_end in _mp4_boxes(stream, 0, None):
+        if box_type == b"mdat":
+            seen_mdat = True
+        elif box_type == b"moov":
+            info.streamable = not seen_mdat
+            for child, child_payload, _ in _mp4_boxes(stream, payload, box_end):
+                if child == b"mvhd":
+                    stream.seek(child_payload)
+                    version = stream.read(4)[0]
+                    if version == 1:
+                        timescale, duration = struct.unpack(">IQ", stream.read(28)[16:])
+                    else:
+                        timescale, duration = struct.unpack(">II", stream.read(16)[8:])
+                    if timescale:
+                        info.duration = duration / float(timescale)
+                    return
+
+
+def _ebml_vint(stream, keep_marker):
+    first = stream.read(1)
+    if not first:
+        return None, 0
+    length = 1
+    while length <= 8 and not first[0] & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        return None, 0
+    value = first[0] if keep_marker else first[0] & (0xFF >> length)
+    for b in stream.read(length - 1):
+        value = (value << 8) | b
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return (None if unknown else value), length
+
+
+def _ebml_elements(stream, start, end):
+    """(id, payload_start, size) for EBML elements in [start, end); size None = unknown."""
+    pos = start
+    while end is None or pos < end:
+        stream.seek(pos)
+        element_id, id_len = _ebml_vint(stream, keep_marker=True)
+        size, size_len = _ebml_vint(stream, keep_marker=False)
+        if element_id is None or not size_len:
+            return
+        payload = pos + id_len + size_len
+        yield element_id, payload, size
+        if size is None:
+            return
+        pos = payload + size
+
+
+WEBM_SEGMENT, WEBM_INFO, WEBM_CLUSTER = 0x18538067, 0x1549A966, 0x1F43B675
+WEBM_TIMECODE_SCALE, WEBM_DURATION = 0x2AD7B1, 0x4489
+
+
+def _webm_info(stream, info):
+    """Duration from Segment/Info; stops at the first Cluster so no audio is read."""
+    for element_id, payload, size in _ebml_elements(stream, 0, None):
+        if element_id != WEBM_SEGMENT:
+            continue
+        for child_id, child_payload, child_size in _ebml_elements(stream, payload, None if size is None else payload + size):
+            if child_id == WEBM_CLUSTER:
+                return
+            if child_id != WEBM_INFO or child_size is None:
+                continue
+            timecode_scale, duration = 1000000, None
+            for field_id, field_payload, field_size in _ebml_elements(stream, child_payload, child_payload + child_size):
+                stream.seek(field_payload)
+                if field_id == WEBM_TIMECODE_SCALE:
+                    timecode_scale = int.from_bytes(stream.read(field_size), "big")
+                elif field_id == WEBM_DURATION and field_size in (4, 8):
+                    duration = struct.unpack(">f" if field_size == 4 else ">d", stream.read(field_size))[0]
+            if duration is not None:
+                info.duration = duration * timecode_scale / 1e9
+            return
+        return
+
+
+def probe(stream, filename=None):
+    """ClipInfo for an upload stream (container, header duration); the stream is left at 0."""
+    stream.seek(0)
+    container = sniff_container(stream.read(16))
+    if container is None:
+        container = EXTENSION_CONTAINERS.get(os.path.splitext(filename or "")[1].lower())
+    info = ClipInfo(container)
+
+    try:
+        if container == "mp4":
+            _mp4_info(stream, info)
+        elif container == "webm":
+            _webm_info(stream, info)
+        elif container != "aac":
+            stream.seek(0)
+            sf_info = sf.info(stream)
+            info.duration = sf_info.duration
+            info.sample_rate, info.channels, info.subtype = sf_info.samplerate, sf_info.channels, sf_info.subtype
+    except Exception as e:
+        # Not fatal: the decoded length is checked too
+        print(f"ℹ️ Could not read {container or 'audio'} header: {e}")
+    stream.seek(0)
+    return info
+
+
+# --- RESAMPLING ---
+def resample(audio, orig_sr, quality="high"):
+    if orig_sr == SAMPLE_RATE:
+        return audio
+    import librosa
+
+    with metrics.timed("resample"):
+        return librosa.resample(y=audio, orig_sr=orig_sr, target_sr=SAMPLE_RATE, res_type=SOXR_RES_TYPES[quality])
+
+
+# --- DECODERS ---
+SPOOL_METRIC = "stamfree_decode_spool_total"
+
+
+@contextlib.contextmanager
+def _seekable_copy(stream, decoder, suffix):
+    """
+    The upload as a seekable file path. An anonymous memfd keeps it off the
+    disk; its /proc/<pid>/fd path also opens from child processes (ffmpeg, and
+    the one audioread starts). Other platforms get a temp file.
+    """
+    if hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd"):
+        fd = os.memfd_create("stamfree-upload", os.MFD_CLOEXEC)
+        try:
+            with open(fd, "wb", closefd=False) as f:
+                shutil.copyfileobj(stream, f)
+            metrics.count(SPOOL_METRIC, decoder, "memfd")
+            yield f"/proc/{os.getpid()}/fd/{fd}"
+        finally:
+            os.close(fd)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        shutil.copyfileobj(stream, tmp)
+        tmp.flush()
+        metrics.count(SPOOL_METRIC, decoder, "tempfile")
+        yield tmp.name
+
+
+def _decode_sndfile(stream, info, quality):
+    audio, sr = sf.read(stream, dtype="float32")
+    if audio.ndim > 1:
+        audio = np.mean(audio, axis=1)
+    return resample(audio, sr, quality)
+
+
+def _decode_pyav(stream, info, quality):
+    import av
+
+    chunks = []
+    with av.open(stream, mode="r") as media:
+        audio_stream = media.streams.audio[0]
+        sr = audio_stream.codec_context.sample_rate
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=sr)  # Rate conversion is left to soxr
+        for frame in media.decode(audio_stream):
+            chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(frame))
+        chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(None))
+    audio = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+    return resample(audio, sr, quality)
+
+
+def _decode_ffmpeg(stream, info, quality):
+    base = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error"]
+    command_tail = ["-vn", "-ac", "1", "-af", FFMPEG_RESAMPLERS[quality], "-f", "f32le", "pipe:1"]
+
+    if info.streamable:
+        result = subprocess.run(base + ["-i", "pipe:0"] + command_tail, input=stream.read(),
+                                capture_output=True, timeout=FFMPEG_TIMEOUT_S)
+    else:
+        # moov after mdat: ffmpeg has to seek, which a pipe can't do
+        with _seekable_copy(stream, "ffmpeg", ".m4a") as path:
+            result = subprocess.run(base + ["-i", path] + command_tail, capture_output=True, timeout=FFMPEG_TIMEOUT_S)
+
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()[-300:]}")
+    return np.frombuffer(result.stdout, dtype="<f4").copy()
+
+
+def _decode_librosa(stream, info, quality):
+    """audioread needs a real path: copy the stream to a seekable file."""
+    import librosa
+
+    with _seekable_copy(stream, "librosa", f".{info.container or 'audio'}") as path:
+        audio, sr = librosa.load(path, sr=None, mono=True)
+    return resample(audio, sr, quality)
+
+
+def _pyav_available():
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _ffmpeg_available():
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+# name -> (decode(stream, info, quality), available())
+DECODERS = {
+    "sndfile": (_decode_sndfile, lambda: True),
+    "pyav": (_decode_pyav, _pyav_available),
+    "ffmpeg": (_decode_ffmpeg, _ffmpeg_available),
+    "librosa": (_decode_librosa, lambda: True),
+}
+
+# container -> decoder names, tried in order
+CONTAINER_DECODERS = {
+    "wav": ["sndfile", "librosa"],
+    "flac": ["sndfile", "librosa"],
+    "ogg": ["sndfile", *AUDIO_DECODERS, "librosa"],  # Opus-in-Ogg needs a recent libsndfile
+    "mp3": ["sndfile", *AUDIO_DECODERS, "librosa"],
+    "mp4": [*AUDIO_DECODERS, "librosa"],
+    "aac": [*AUDIO_DECODERS, "librosa"],
+    "webm": [*AUDIO_DECODERS, "librosa"],
+    None: ["sndfile", *AUDIO_DECODERS, "librosa"],
+}
+
+_available = {}
+
+
+def register_decoder(name, decode, available=lambda: True, containers=()):
+    """Add a decoder backend and put it first for the given containers."""
+    DECODERS[name] = (decode, available)
+    _available.pop(name, None)
+    for container in containers:
+        CONTAINER_DECODERS[container] = [name] + [d for d in CONTAINER_DECODERS.get(container, []) if d != name]
+
+
+def decoders_for(container):
+    """Installed decoder names for a container, in preference order."""
+    names = []
+    for name in CONTAINER_DECODERS.get(container, CONTAINER_DECODERS[None]):
+        if name not in DECODERS:
+            continue
+        if name not in _available:
+            _available[name] = bool(DECODERS[name][1]())
+        if _available[name]:
+            names.append(name)
+    return names
+
+
+def decode(stream, info, quality="high"):
+    """16 kHz mono float32 samples, from the first decoder that succeeds."""
+    if quality not in RESAMPLE_QUALITIES:
+        raise ValueError(f"Unknown resample quality {quality!r} (expected one of {RESAMPLE_QUALITIES})")
+
+    errors = []
+    for name in decoders_for(info.container):
+        stream.seek(0)
+        try:
+            audio = DECODERS[name][0](stream, info, quality)
+            return np.ascontiguousarray(audio, dtype=np.float32)
+        except Exception as e:
+            print(f"ℹ️ {name} could not decode {info.container or 'audio'}, trying next decoder: {e}")
+            errors.append(f"{name}: {str(e) or type(e).__name__}")
+    raise RuntimeError(f"No decoder could read the audio ({'; '.join(errors) or 'none installed'})")
+
+
+def decoder_status():
+    """Installed decoders per container (for /health)."""
+    return {container or "unknown": decoders_for(container) for container in CONTAINER_DECODERS}
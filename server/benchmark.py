@@ -0,0 +1,356 @@
+"""
+Server benchmark suite on synthetic audio with stubbed STT.
+
+Generates clips (sustained hums, breathy noise, repeated syllables, silence)
+at several lengths and codecs, then times each analyzer helper on its own
+and each endpoint end to end through the Flask test client, with Google STT
+replaced by the local fake transport. Reports p50/p95/p99 latency and peak
+traced memory per case as JSON, so runs can be compared across commits.
+
+Usage (from the server folder):
+    python benchmark.py --output bench.json
+    python benchmark.py --only endpoints --codecs wav,m4a --iterations 20
+    python benchmark.py --output new.json --compare bench.json --max-regression 15
+    python benchmark.py --stt-latency-ms 800      # simulate a slow Google round trip
+
+m4a / webm clips need PyAV or an ffmpeg binary to encode; codecs that cannot
+be encoded here are skipped with a warning. The result cache is disabled
+(repeat iterations would otherwise be cache hits) unless --cache is passed.
+Progress goes to stderr, so without --output stdout is only the JSON report.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 16000
+UPLOAD_SAMPLE_RATE = 44100  # Phones record at 44.1/48 kHz, so endpoint runs include the resample
+DEFAULT_LENGTHS = (1.5, 3.0, 7.0)
+DEFAULT_KINDS = ("hum", "breathy", "syllables", "silence")
+DEFAULT_CODECS = ("wav", "m4a", "webm")
+PERCENTILES = (50, 95, 99)
+
+# Endpoint cases: (route, upload field, form fields, fake STT transcript)
+ENDPOINTS = {
+    "snake": ("/snake/analyze", "file", {"targetPhoneme": "m", "tier": "2"}, "mmm"),
+    "balloon": ("/analyze/balloon", "file", {}, ""),
+    "tapping": ("/analyze/tapping", "audio", {"targetWord": "apple", "syllables": '["ap", "ple"]', "taps": "[1, 2]"},
+                "apple"),
+    "turtle": ("/analyze/turtle", "file", {"targetText": "i like cats", "tier": "1"}, "i like cats"),
+    "analyze_audio": ("/analyze_audio", "file", {}, "i like cats"),
+}
+
+
+# --- SYNTHETIC CLIPS ---
+def _harmonics(f0, t, vibrato=0.0):
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + vibrato * np.sin(2 * np.pi * 5 * t))) / SAMPLE_RATE
+    y = sum((0.5 / k) * np.sin(k * phase) for k in range(1, 6))
+    return y / np.max(np.abs(y))
+
+
+def synthesize(kind, seconds, seed=0):
+    """One 16 kHz synthetic clip: hum, breathy, syllables or silence."""
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    if kind == "hum":
+        # Sustained hum with vibrato and a soft attack/release
+        envelope = np.minimum(1.0, np.minimum(t, t[-1] - t) / 0.1)
+        y = 0.3 * envelope * _harmonics(180.0, t, vibrato=0.02)
+    elif kind == "breathy":
+        # Low-passed noise, like blowing into the mic
+        noise = rng.randn(len(t))
+        y = 0.08 * np.convolve(noise, np.ones(8) / 8, mode="same")
+    elif kind == "syllables":
+        # 200 ms voiced bursts separated by 150 ms gaps ("ba-ba-ba")
+        period, burst = 0.35, 0.2
+        position = np.mod(t, period)
+        envelope = np.where(position < burst, np.sin(np.pi * position / burst), 0.0)
+        y = 0.3 * envelope * _harmonics(220.0, t, vibrato=0.05)
+    elif kind == "silence":
+        y = np.zeros_like(t)
+    else:
+        raise ValueError(f"Unknown clip kind: {kind}")
+    return (y + 0.001 * rng.randn(len(t))).astype(np.float32)
+
+
+def _encode_pyav(samples, sample_rate, codec):
+    import av
+
+    container_format, codec_name = {"m4a": ("mp4", "aac"), "webm": ("webm", "libopus")}[codec]
+    rate = 48000 if codec == "webm" else sample_rate  # Opus only takes 48 kHz-family rates
+    if rate != sample_rate:
+        import librosa
+
+        samples = librosa.resample(samples, orig_sr=sample_rate, target_sr=rate)
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format=container_format) as container:
+        stream = container.add_stream(codec_name, rate=rate)
+        stream.layout = "mono"
+        frame = av.AudioFrame.from_ndarray(samples.astype(np.float32)[np.newaxis, :], format="flt", layout="mono")
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def _encode_ffmpeg(samples, sample_rate, codec):
+    from audio_decoders import FFMPEG_BIN, FFMPEG_TIMEOUT_S
+
+    codec_args = {"m4a": ["-c:a", "aac", "-movflags", "+faststart"], "webm": ["-c:a", "libopus"]}[codec]
+    wav = io.BytesIO()
+    sf.write(wav, samples, sample_rate, format="WAV", subtype="PCM_16")
+    # MP4 needs a seekable output, so encode to a temp file
+    with tempfile.NamedTemporaryFile(suffix=f".{codec}") as out:
+        subprocess.run(
+            [FFMPEG_BIN, "-nostdin", "-loglevel", "error", "-y", "-i", "pipe:0", *codec_args, out.name],
+            input=wav.getvalue(), check=True, timeout=FFMPEG_TIMEOUT_S * 3,
+        )
+        return out.read()
+
+
+def encode(samples, sample_rate, codec):
+    """Upload bytes for a clip in wav / m4a / webm, or None if no encoder is available."""
+    if codec == "wav":
+        buffer = io.BytesIO()
+        sf.write(buffer, samples, sample_rate, format="WAV", subtype="PCM_16")
+        return buffer.getvalue()
+    for encoder in (_encode_pyav, _encode_ffmpeg):
+        try:
+            return encoder(samples, sample_rate, codec)
+        except Exception:
+            continue
+    return None
+
+
+def build_clips(kinds, lengths, codecs):
+    """{(kind, seconds): samples} at 16 kHz and {(kind, seconds, codec): upload bytes} at 44.1 kHz."""
+    import librosa
+
+    samples, uploads, skipped = {}, {}, set()
+    for seed, kind in enumerate(kinds):
+        for seconds in lengths:
+            y = synthesize(kind, seconds, seed=seed)
+            samples[(kind, seconds)] = y
+            upload = librosa.resample(y, orig_sr=SAMPLE_RATE, target_sr=UPLOAD_SAMPLE_RATE)
+            for codec in codecs:
+                if codec in skipped:
+                    continue
+                data = encode(upload, UPLOAD_SAMPLE_RATE, codec)
+                if data is None:
+                    print(f"⚠️ No encoder for {codec} (install PyAV or ffmpeg); skipping {codec} clips", file=sys.stderr)
+                    skipped.add(codec)
+                    continue
+                uploads[(kind, seconds, codec)] = data
+    return samples, uploads
+
+
+# --- MEASUREMENT ---
+def summarize(latencies_ms, peak_bytes):
+    values = np.asarray(latencies_ms)
+    stats = {f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    stats.update({
+        "mean_ms": round(float(values.mean()), 2),
+        "n": len(values),
+        "peak_traced_mb": round(peak_bytes / (1024 * 1024), 2),
+    })
+    return stats
+
+
+def measure(fn, iterations, warmup):
+    """Latency over `iterations` calls, then peak traced memory of one extra call (tracing skews timing)."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(latencies, peak)
+
+
+def bench_helpers(app, samples, iterations, warmup):
+    from audio_clip import AudioClip
+
+    # Each call gets a fresh clip so lazily cached features / WAV bytes are recomputed
+    helpers = {
+        "predict_file": lambda y: app.predict_file(AudioClip(y)),
+        "analyze_amplitude": lambda y: app.analyze_amplitude(AudioClip(y)),
+        "analyze_voicing_noise": lambda y: app.analyze_voicing_noise(AudioClip(y)),
+        "detect_breath": lambda y: app.detect_breath(AudioClip(y)),
+        "detect_nasal_phoneme_acoustic": lambda y: app.detect_nasal_phoneme_acoustic(AudioClip(y)),
+        "convert_audio_to_wav_buffer": lambda y: app.convert_audio_to_wav_buffer(AudioClip(y)),
+    }
+    results = {}
+    for name, helper in helpers.items():
+        results[name] = {}
+        for (kind, seconds), y in samples.items():
+            case = f"{kind}/{seconds:g}s"
+            results[name][case] = measure(lambda: helper(y), iterations, warmup)
+            print(f"⏱️ {name} {case}: p50 {results[name][case]['p50_ms']} ms, p95 {results[name][case]['p95_ms']} ms", file=sys.stderr)
+    return results
+
+
+def bench_endpoints(app, endpoints, uploads, iterations, warmup, stt_latency_ms):
+    import stt_client
+
+    client = app.app.test_client()
+    results = {}
+    for name in endpoints:
+        route, field, form, transcript = ENDPOINTS[name]
+        stt_client.set_transport(stt_client.FakeSpeechTransport(transcript=transcript, latency_ms=stt_latency_ms))
+        results[name] = {}
+        for (kind, seconds, codec), data in uploads.items():
+            case = f"{kind}/{seconds:g}s/{codec}"
+            statuses = set()
+
+            def post():
+                payload = dict(form)
+                payload[field] = (io.BytesIO(data), f"clip.{codec}")
+                response = client.post(route, data=payload, content_type="multipart/form-data")
+                statuses.add(response.status_code)
+
+            results[name][case] = measure(post, iterations, warmup)
+            results[name][case]["statuses"] = sorted(statuses)
+            print(f"⏱️ {route} {case}: p50 {results[name][case]['p50_ms']} ms, p95 {results[name][case]['p95_ms']} ms", file=sys.stderr)
+    return results
+
+
+# --- REPORT ---
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, max_regression):
+    """Print p50/p95 changes against a baseline report; returns the cases over max_regression (%)."""
+    regressions = []
+    for section in ("helpers", "endpoints"):
+        for name, cases in report.get(section, {}).items():
+            for case, stats in cases.items():
+                before = baseline.get(section, {}).get(name, {}).get(case)
+                if not before:
+                    continue
+                change = {
+                    key: 100.0 * (stats[key] - before[key]) / before[key] if before[key] else 0.0
+                    for key in ("p50_ms", "p95_ms")
+                }
+                print(f"   {section}.{name} {case}: p50 {change['p50_ms']:+.1f}%, p95 {change['p95_ms']:+.1f}%", file=sys.stderr)
+                if max_regression is not None and change["p95_ms"] > max_regression:
+                    regressions.append(f"{section}.{name} {case}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark analyzer helpers and endpoints on synthetic audio.")
+    parser.add_argument("--only", choices=("helpers", "endpoints"), help="Run one section only")
+    parser.add_argument("--kinds", default=",".join(DEFAULT_KINDS), help="Clip kinds (default: all)")
+    parser.add_argument("--lengths", default=",".join(f"{s:g}" for s in DEFAULT_LENGTHS), help="Clip lengths in seconds")
+    parser.add_argument("--codecs", default=",".join(DEFAULT_CODECS), help="Upload codecs for endpoint runs")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Endpoints to run (default: all)")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed calls per case")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls per case")
+    parser.add_argument("--stt-latency-ms", type=float, default=0.0, help="Simulated STT round trip")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache on (repeats become hits)")
+    parser.add_argument("--output", help="Write the JSON report to this path (default: stdout)")
+    parser.add_argument("--compare", help="Baseline report to compare p50/p95 against")
+    parser.add_argument("--max-regression", type=float, help="Exit non-zero when a case's p95 grows by more (%%)")
+    args = parser.parse_args(argv)
+
+    kinds = [k for k in args.kinds.split(",") if k]
+    lengths = [float(s) for s in args.lengths.split(",") if s]
+    codecs = [c for c in args.codecs.split(",") if c]
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = [e for e in endpoints if e not in ENDPOINTS] + [c for c in codecs if c not in DEFAULT_CODECS]
+    if unknown:
+        print(f"❌ Unknown endpoint or codec: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    # The app reads these at import time
+    os.environ["STT_TRANSPORT"] = "fake"
+    os.environ["STARTUP_MODE"] = "blocking"
+    if not args.cache:
+        os.environ["RESULT_CACHE_ENABLED"] = "0"
+
+    # Progress and the app's own logging go to stderr; stdout carries only the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args, kinds, lengths, codecs, endpoints)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"📊 Compared with {args.compare} ({baseline.get('meta', {}).get('commit')})", file=sys.stderr)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"❌ p95 regressed more than {args.max_regression:g}%: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def run(args, kinds, lengths, codecs, endpoints):
+    """Build the clips, time every case and return the report."""
+    import app
+
+    samples, uploads = build_clips(kinds, lengths, codecs if args.only != "helpers" else [])
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "stt_latency_ms": args.stt_latency_ms,
+            "result_cache": args.cache,
+            "microbatch": app.MICROBATCH_ENABLED,
+            "kinds": kinds,
+            "lengths": lengths,
+            "codecs": sorted({codec for _, _, codec in uploads}),
+        },
+    }
+    if args.only != "endpoints":
+        report["helpers"] = bench_helpers(app, samples, args.iterations, args.warmup)
+    if args.only != "helpers":
+        report["endpoints"] = bench_endpoints(app, endpoints, uploads, args.iterations, args.warmup, args.stt_latency_ms)
+
+    # ru_maxrss is kB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["meta"]["peak_rss_mb"] = round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Fit and calibrate early-exit heads for the WavLM classifier.
+
+For every clip, runs the encoder once and keeps the mean-pooled hidden state
+after each requested layer plus the fine-tuned head's class probabilities.
+A linear head per layer is distilled from those probabilities, then
+temperature-scaled so its confidence can be compared to EARLY_EXIT_THRESHOLD.
+Layers whose confident predictions disagree with the full model too often
+(on the held-out split) are dropped.
+
+Usage (from the server folder):
+    python calibrate_early_exit.py --clips ./recordings
+    python calibrate_early_exit.py --clips ./recordings --layers 4,6,8 --threshold 0.9 --json exit.json
+    python calibrate_early_exit.py --synthetic            # no recordings at hand
+
+Writes <model>/early_exit_heads.pt; serve with EARLY_EXIT_MODE=confidence
+(or EARLY_EXIT_MODE=static EARLY_EXIT_LAYERS=K).
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from audio_clip import load_clip
+from early_exit import EARLY_EXIT_HEADS_FILE, EARLY_EXIT_THRESHOLD, ExitHead, encoder_layers, final_head_logits, masked_mean, save_heads
+from model_loader import load_wavlm
+from voicing_agreement import AUDIO_EXTENSIONS, synthetic_clips
+
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH") or os.path.join(os.path.dirname(__file__), "wavlm_model")
+MAX_SAMPLES = 16000 * 3  # Same 3 s context as predict_batch
+TEMPERATURES = np.linspace(0.5, 5.0, 46)
+
+
+def collect_features(feature_extractor, model, clips, layers):
+    """Pooled hidden states per layer ({layer: [N, hidden]}) and teacher probs [N, labels]."""
+    pooled = {layer: [] for layer in layers}
+    teacher = []
+    for samples in clips.values():
+        inputs = feature_extractor(
+            samples,
+            sampling_rate=16000,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=MAX_SAMPLES,
+            return_attention_mask=True,
+        )
+        with torch.no_grad():
+            for layer_number, hidden_states, frame_mask in encoder_layers(
+                model, inputs["input_values"], inputs.get("attention_mask")
+            ):
+                if layer_number in pooled:
+                    pooled[layer_number].append(masked_mean(hidden_states, frame_mask))
+            teacher.append(torch.softmax(final_head_logits(model, hidden_states, frame_mask), dim=-1))
+    return {layer: torch.cat(rows) for layer, rows in pooled.items()}, torch.cat(teacher)
+
+
+def fit_head(features, targets, epochs=300, lr=1e-2, weight_decay=1e-3):
+    """Distil a linear head from the full model's soft labels."""
+    head = ExitHead(features.shape[1], targets.shape[1])
+    # Standardize through the weights so the head stays a single Linear layer
+    mean, std = features.mean(dim=0), features.std(dim=0).clamp_min(1e-6)
+    x = (features - mean) / std
+
+    linear = torch.nn.Linear(features.shape[1], targets.shape[1])
+    optimizer = torch.optim.Adam(linear.parameters(), lr=lr, weight_decay=weight_decay)
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = -(targets * torch.log_softmax(linear(x), dim=-1)).sum(dim=-1).mean()
+        loss.backward()
+        optimizer.step()
+
+    with torch.no_grad():
+        head.linear.weight.copy_(linear.weight / std)
+        head.linear.bias.copy_(linear.bias - (linear.weight * (mean / std)).sum(dim=1))
+    return head.eval()
+
+
+def fit_temperature(head, features, targets):
+    """Temperature minimizing NLL of the full model's labels."""
+    labels = targets.argmax(dim=-1)
+    with torch.no_grad():
+        logits = head.linear(features)
+        losses = [float(torch.nn.functional.cross_entropy(logits / t, labels)) for t in TEMPERATURES]
+    head.temperature.fill_(float(TEMPERATURES[int(np.argmin(losses))]))
+    return head
+
+
+def evaluate(head, features, targets, threshold):
+    with torch.no_grad():
+        probs = torch.softmax(head(features), dim=-1)
+    agrees = probs.argmax(dim=-1) == targets.argmax(dim=-1)
+    confident = probs.max(dim=-1).values >= threshold
+    exits = int(confident.sum())
+    return {
+        "agreement": round(float(agrees.float().mean()), 4),
+        "exit_rate": round(exits / len(features), 4),
+        "exit_agreement": round(float(agrees[confident].float().mean()), 4) if exits else None,
+        "temperature": round(float(head.temperature), 2),
+    }
+
+
+def split(n, holdout, seed=0):
+    order = np.random.default_rng(seed).permutation(n)
+    n_eval = int(round(n * holdout)) if n > 1 else 0
+    return torch.as_tensor(order[n_eval:]), torch.as_tensor(order[:n_eval] if n_eval else order)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit early-exit heads for the WavLM classifier.")
+    parser.add_argument("--clips", help="Directory of audio clips")
+    parser.add_argument("--synthetic", action="store_true", help="Include synthetic clips")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Model folder (default: MODEL_PATH or ./wavlm_model)")
+    parser.add_argument("--layers", default="4,6,8,10", help="Comma-separated layers to fit heads on (1-based)")
+    parser.add_argument("--threshold", type=float, default=EARLY_EXIT_THRESHOLD,
+                        help="Exit confidence to report against (default EARLY_EXIT_THRESHOLD)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of clips held out for the report")
+    parser.add_argument("--min-exit-agreement", type=float, default=0.98,
+                        help="Drop layers whose confident exits agree less than this with the full model")
+    parser.add_argument("--json", help="Write the report to this path")
+    parser.add_argument("--output", help=f"Heads file (default: <model>/{EARLY_EXIT_HEADS_FILE})")
+    args = parser.parse_args(argv)
+
+    torch.manual_seed(0)
+
+    clips = synthetic_clips() if args.synthetic else {}
+    if args.clips:
+        for name in sorted(os.listdir(args.clips)):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                clips[name] = load_clip(os.path.join(args.clips, name)).samples
+    if not clips:
+        print("❌ No clips: pass --clips DIR and/or --synthetic")
+        return 2
+
+    feature_extractor, model = load_wavlm(args.model, quantize="")
+    num_layers = model.config.num_hidden_layers
+    layers = sorted({int(x) for x in args.layers.split(",") if x.strip()})
+    if any(layer < 1 or layer >= num_layers for layer in layers):
+        print(f"❌ --layers must be between 1 and {num_layers - 1}")
+        return 2
+
+    print(f"📥 Collecting layer features for {len(clips)} clips (layers {layers})")
+    features, teacher = collect_features(feature_extractor, model, clips, layers)
+    train_idx, eval_idx = split(len(teacher), args.holdout)
+    if len(clips) < 50:
+        print(f"⚠️ Only {len(clips)} clips; heads will be noisy. A few hundred real attempts is a better basis.")
+
+    heads, report = {}, {}
+    for layer in layers:
+        head = fit_head(features[layer][train_idx], teacher[train_idx])
+        fit_temperature(head, features[layer][train_idx], teacher[train_idx])
+        row = evaluate(head, features[layer][eval_idx], teacher[eval_idx], args.threshold)
+        row["kept"] = row["exit_agreement"] is None or row["exit_agreement"] >= args.min_exit_agreement
+        report[layer] = row
+        if row["kept"]:
+            heads[layer] = head
+        print(f"  layer {layer:>2}: agreement {row['agreement']:.3f}  exit rate {row['exit_rate']:.3f}  "
+              f"exit agreement {row['exit_agreement']}  T={row['temperature']}{'' if row['kept'] else '  ❗ dropped'}")
+
+    summary = {"clips": len(clips), "eval_clips": len(eval_idx), "threshold": args.threshold, "layers": report}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if not heads:
+        print("❌ No layer met --min-exit-agreement; nothing written")
+        return 1
+
+    output_path = args.output or os.path.join(args.model, EARLY_EXIT_HEADS_FILE)
+    save_heads(output_path, heads, summary)
+    print(f"✅ Wrote {output_path} (heads at layers {sorted(heads)})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
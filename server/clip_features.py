@@ -0,0 +1,126 @@
+from functools import cached_property
+
+import numpy as np
+
+import admission
+import metrics
+from voicing import estimate_voicing
+
+# ============================================================================
+# StamFree Backend - Shared Frame Features
+# ============================================================================
+# analyze_amplitude, detect_breath and analyze_voicing_noise all frame the same
+# clip. ClipFeatures computes each frame-level feature lazily, once per clip,
+# on one 2048/512 frame grid, and the helpers below turn boolean frame masks
+# into segments with NumPy instead of per-frame Python loops.
+
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+TRIM_TOP_DB = 30
+DEFAULT_VOICING_RANGE = (80.0, 400.0)
+ENERGY_VOICED_RMS = 0.01  # Quieter frames are never "voiced" for energy_voiced_mask
+ENERGY_VOICED_MAX_ZCR = 0.15  # Hums and vowels sit well below this; breath noise well above
+
+
+def find_runs(mask):
+    """
+    All runs of True in a boolean frame mask.
+    Returns: (starts, ends) int arrays; run k covers frames [starts[k], ends[k]).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if mask.size == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+class ClipFeatures:
+    """Lazily computed frame-level features for one AudioClip."""
+
+    def __init__(self, samples, sample_rate, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH):
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self._voicing = {}
+
+    @property
+    def frame_duration(self):
+        """Seconds per frame hop."""
+        return self.hop_length / float(self.sample_rate)
+
+    @cached_property
+    def stft_magnitude(self):
+        import librosa  # Heavy import, deferred to first use (warmed up at startup)
+
+        return np.abs(librosa.stft(self.samples, n_fft=self.frame_length, hop_length=self.hop_length))
+
+    @cached_property
+    def rms(self):
+        import librosa
+
+        return librosa.feature.rms(
+            y=self.samples, frame_length=self.frame_length, hop_length=self.hop_length
+        )[0]
+
+    @cached_property
+    def zcr(self):
+        import librosa
+
+        return librosa.feature.zero_crossing_rate(
+            y=self.samples, frame_length=self.frame_length, hop_length=self.hop_length
+        )[0]
+
+    @cached_property
+    def trimmed_bounds(self):
+        """
+        Non-silent frame range [start, end), equivalent to librosa.effects.trim(top_db=30)
+        but derived from the shared RMS instead of a second framing pass.
+        """
+        if self.rms.size == 0 or not np.any(self.rms > 0):
+            return 0, 0
+        import librosa
+
+        db = librosa.power_to_db(self.rms ** 2, ref=np.max, top_db=None)
+        non_silent = np.flatnonzero(db > -TRIM_TOP_DB)
+        return int(non_silent[0]), int(non_silent[-1]) + 1
+
+    def voicing(self, fmin=DEFAULT_VOICING_RANGE[0], fmax=DEFAULT_VOICING_RANGE[1]):
+        """VoicingResult for a pitch range, computed once per range."""
+        key = (float(fmin), float(fmax))
+        if key not in self._voicing:
+            with admission.using(admission.cpu), metrics.timed("voicing"):
+                self._voicing[key] = estimate_voicing(self.samples, self.sample_rate, fmin=fmin, fmax=fmax)
+        return self._voicing[key]
+
+    @property
+    def voiced_mask(self):
+        return self.voicing().voiced_mask
+
+    @cached_property
+    def energy_voiced_mask(self):
+        """
+        Frames that look voiced from RMS and ZCR alone: loud (within 20 dB of
+        the peak) and tonal (low zero-crossing rate). No pitch tracking, so
+        it's the cheap stand-in for voicing() when a request runs out of budget.
+        """
+        if self.rms.size == 0:
+            return np.zeros(0, dtype=bool)
+        loud = self.rms > max(ENERGY_VOICED_RMS, 0.1 * float(np.max(self.rms)))
+        return loud & (self.zcr < ENERGY_VOICED_MAX_ZCR)
+
+    @property
+    def energy_voiced_ratio(self):
+        """Share of frames in energy_voiced_mask (comparable to VoicingResult.pitched_ratio)."""
+        mask = self.energy_voiced_mask
+        return float(np.mean(mask)) if mask.size else 0.0
+
+    def segments(self, mask, offset=0):
+        """Runs of True in `mask` as [[start_sec, end_sec], ...] (frame `offset` added)."""
+        starts, ends = find_runs(mask)
+        clip_end = len(self.samples) / float(self.sample_rate)
+        return [
+            [round((offset + s) * self.frame_duration, 2), round(min(clip_end, (offset + e) * self.frame_duration), 2)]
+            for s, e in zip(starts.tolist(), ends.tolist())
+        ]
@@ -0,0 +1,236 @@
+import os
+import threading
+from collections import Counter
+
+import torch
+
+# ============================================================================
+# StamFree Backend - Early-Exit WavLM Inference
+# ============================================================================
+# WavLM runs all 12 transformer layers for every clip, but most snake and
+# balloon clips are clearly fluent or clearly not. Small linear heads on
+# intermediate layers (fit with calibrate_early_exit.py against the existing
+# head) let the forward pass stop as soon as a layer is confident enough:
+#   EARLY_EXIT_MODE=confidence  stop at the first head whose (temperature-
+#                               scaled) confidence >= EARLY_EXIT_THRESHOLD
+#   EARLY_EXIT_MODE=static      always run the first EARLY_EXIT_LAYERS layers
+# Clips that never pass the threshold run every layer and get the original
+# head's output, so hard clips score exactly as before. The decision is per
+# clip: in a batch, finished clips drop out and the rest keep going.
+
+EARLY_EXIT_MODE = os.environ.get("EARLY_EXIT_MODE", "off").strip().lower()  # off | confidence | static
+EARLY_EXIT_MODES = ("off", "confidence", "static")
+EARLY_EXIT_THRESHOLD = float(os.environ.get("EARLY_EXIT_THRESHOLD", "0.9"))
+EARLY_EXIT_LAYERS = int(os.environ.get("EARLY_EXIT_LAYERS", "6"))
+EARLY_EXIT_HEADS_FILE = "early_exit_heads.pt"
+
+
+class ExitHead(torch.nn.Module):
+    """Linear classifier on mean-pooled hidden states, with a calibrated temperature."""
+
+    def __init__(self, hidden_size, num_labels, temperature=1.0):
+        super().__init__()
+        self.linear = torch.nn.Linear(hidden_size, num_labels)
+        self.register_buffer("temperature", torch.tensor(float(temperature)))
+
+    def forward(self, pooled):
+        return self.linear(pooled) / self.temperature
+
+
+def masked_mean(hidden_states, frame_mask):
+    """Mean over valid frames (same pooling as WavLMForSequenceClassification)."""
+    if frame_mask is None:
+        return hidden_states.mean(dim=1)
+    mask = frame_mask.unsqueeze(-1).to(hidden_states.dtype)
+    return (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+
+
+def encoder_inputs(model, input_values, attention_mask=None):
+    """Hidden states entering the first transformer layer, plus the frame mask (None without attention_mask)."""
+    wavlm = model.wavlm
+    encoder = wavlm.encoder
+
+    extract_features = wavlm.feature_extractor(input_values).transpose(1, 2)
+    frame_mask = None
+    if attention_mask is not None:
+        frame_mask = wavlm._get_feature_vector_attention_mask(
+            extract_features.shape[1], attention_mask, add_adapter=False
+        )
+
+    hidden_states, _ = wavlm.feature_projection(extract_features)
+    if frame_mask is not None:
+        hidden_states = hidden_states.masked_fill(~frame_mask.unsqueeze(-1), 0.0)
+
+    hidden_states = hidden_states + encoder.pos_conv_embed(hidden_states)
+    if not getattr(model.config, "do_stable_layer_norm", False):
+        hidden_states = encoder.layer_norm(hidden_states)
+    return encoder.dropout(hidden_states), frame_mask
+
+
+def encoder_layer(model, index, hidden_states, frame_mask, position_bias=None):
+    """Transformer layer `index` (0-based); returns (hidden_states, position_bias for the next layer)."""
+    encoder = model.wavlm.encoder
+    outputs = encoder.layers[index](hidden_states, attention_mask=frame_mask, position_bias=position_bias, index=index)
+    hidden_states, position_bias = outputs[:2]
+    if getattr(model.config, "do_stable_layer_norm", False) and index == len(encoder.layers) - 1:
+        hidden_states = encoder.layer_norm(hidden_states)
+    return hidden_states, position_bias
+
+
+def encoder_layers(model, input_values, attention_mask=None):
+    """
+    Layer-by-layer WavLMForSequenceClassification encoder.
+    Yields (layer_number, hidden_states, frame_mask) after each transformer
+    layer, 1-based; the last yield is the model's final hidden state.
+    """
+    hidden_states, frame_mask = encoder_inputs(model, input_values, attention_mask)
+    position_bias = None
+    for i in range(len(model.wavlm.encoder.layers)):
+        hidden_states, position_bias = encoder_layer(model, i, hidden_states, frame_mask, position_bias)
+        yield i + 1, hidden_states, frame_mask
+
+
+def final_head_logits(model, hidden_states, frame_mask):
+    """The fine-tuned projector + pooling + classifier on the last hidden state."""
+    return model.classifier(masked_mean(model.projector(hidden_states), frame_mask))
+
+
+class EarlyExitWavLM:
+    """Runs the classifier layer by layer and stops once an exit head is confident."""
+
+    def __init__(self, model, heads, mode=EARLY_EXIT_MODE, threshold=EARLY_EXIT_THRESHOLD,
+                 static_layers=EARLY_EXIT_LAYERS):
+        self.model = model
+        self.heads = heads  # {layer_number: ExitHead}
+        self.mode = mode
+        self.threshold = threshold
+        self.num_layers = model.config.num_hidden_layers
+        self.static_layers = min(static_layers, self.num_layers)
+        if mode == "static" and self.static_layers < self.num_layers and self.static_layers not in heads:
+            raise ValueError(
+                f"❌ No calibrated exit head for layer {self.static_layers}. "
+                f"Available: {sorted(heads)}. Run calibrate_early_exit.py --layers {self.static_layers}"
+            )
+        self._lock = threading.Lock()
+        self._exits = Counter()
+
+    @torch.no_grad()
+    def __call__(self, input_values, attention_mask=None):
+        """
+        Returns (probs tensor [batch, labels], exit layer number per clip).
+        Each clip stops at its own first confident head, and only the clips
+        still running go through the next layer, so a clip's result does not
+        depend on the rest of the batch.
+        """
+        batch_size = input_values.shape[0]
+        probs = [None] * batch_size
+        exit_layers = [self.num_layers] * batch_size
+        rows = list(range(batch_size))  # Batch positions of the clips still running
+
+        hidden_states, frame_mask = encoder_inputs(self.model, input_values, attention_mask)
+        position_bias = None
+        for index in range(self.num_layers - 1):
+            hidden_states, position_bias = encoder_layer(self.model, index, hidden_states, frame_mask, position_bias)
+            layer_number = index + 1
+
+            head = self.heads.get(layer_number)
+            if self.mode == "static":
+                if layer_number == self.static_layers:
+                    return self._exit(head(masked_mean(hidden_states, frame_mask)), layer_number)
+                continue
+            if head is None:
+                continue
+
+            layer_probs = torch.softmax(head(masked_mean(hidden_states, frame_mask)), dim=-1)
+            confident = layer_probs.max(dim=-1).values >= self.threshold
+            if not bool(confident.any()):
+                continue
+            for j in torch.nonzero(confident).flatten().tolist():
+                probs[rows[j]] = layer_probs[j]
+                exit_layers[rows[j]] = layer_number
+            if bool(confident.all()):
+                return self._record(torch.stack(probs), exit_layers)
+
+            # Drop the finished clips from the rest of the forward pass
+            keep = ~confident
+            rows = [row for row, running in zip(rows, keep.tolist()) if running]
+            hidden_states = hidden_states[keep]
+            frame_mask = frame_mask[keep] if frame_mask is not None else None
+            if position_bias is not None:
+                # (batch * heads, frames, frames)
+                position_bias = position_bias.view(len(keep), -1, *position_bias.shape[1:])[keep].flatten(0, 1)
+
+        hidden_states, _ = encoder_layer(self.model, self.num_layers - 1, hidden_states, frame_mask, position_bias)
+        final_probs = torch.softmax(final_head_logits(self.model, hidden_states, frame_mask), dim=-1)
+        for row, row_probs in zip(rows, final_probs):
+            probs[row] = row_probs
+        return self._record(torch.stack(probs), exit_layers)
+
+    def _exit(self, logits, layer_number):
+        probs = torch.softmax(logits, dim=-1)
+        return self._record(probs, [layer_number] * probs.shape[0])
+
+    def _record(self, probs, exit_layers):
+        with self._lock:
+            self._exits.update(exit_layers)
+        return probs, exit_layers
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._exits.values())
+            mean_layer = sum(k * v for k, v in self._exits.items()) / total if total else 0.0
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold if self.mode == "confidence" else None,
+                "static_layers": self.static_layers if self.mode == "static" else None,
+                "head_layers": sorted(self.heads),
+                "clips": total,
+                "exit_layer_histogram": {str(k): v for k, v in sorted(self._exits.items())},
+                "mean_exit_layer": round(mean_layer, 2),
+                "mean_layer_fraction": round(mean_layer / self.num_layers, 3) if total else 0.0,
+            }
+
+
+def save_heads(path, heads, report=None):
+    torch.save(
+        {
+            "layers": {
+                layer: {
+                    "weight": head.linear.weight.detach().cpu(),
+                    "bias": head.linear.bias.detach().cpu(),
+                    "temperature": float(head.temperature),
+                }
+                for layer, head in heads.items()
+            },
+            "report": report or {},
+        },
+        path,
+    )
+
+
+def load_heads(path, device="cpu"):
+    data = torch.load(path, map_location=device)
+    heads = {}
+    for layer, params in data["layers"].items():
+        num_labels, hidden_size = params["weight"].shape
+        head = ExitHead(hidden_size, num_labels, params["temperature"])
+        head.linear.weight.data.copy_(params["weight"])
+        head.linear.bias.data.copy_(params["bias"])
+        heads[int(layer)] = head.to(device).eval()
+    return heads
+
+
+def load_early_exit(model, model_path, device="cpu"):
+    """EarlyExitWavLM for the configured mode, or None when EARLY_EXIT_MODE=off."""
+    if EARLY_EXIT_MODE not in EARLY_EXIT_MODES:
+        raise ValueError(f"Unknown EARLY_EXIT_MODE '{EARLY_EXIT_MODE}' (expected one of {EARLY_EXIT_MODES})")
+    if EARLY_EXIT_MODE == "off":
+        return None
+
+    heads_path = os.path.join(model_path, EARLY_EXIT_HEADS_FILE)
+    if not os.path.exists(heads_path):
+        raise ValueError(
+            f"❌ {EARLY_EXIT_HEADS_FILE} not found in {model_path}. "
+            f"Run: python calibrate_early_exit.py --clips <dir>"
+        )
+    return EarlyExitWavLM(model, load_heads(heads_path, device))
@@ -0,0 +1,101 @@
+"""
+Export the fine-tuned WavLM classifier to ONNX.
+
+Writes <model folder>/model.onnx with dynamic batch and length axes
+(inputs: input_values, attention_mask; output: logits), then checks the
+ONNX Runtime output against eager PyTorch on a padded batch.
+
+Usage (from the server folder):
+    python export_onnx.py                         # ./wavlm_model -> ./wavlm_model/model.onnx
+    python export_onnx.py --model ./wavlm_model --output /tmp/model.onnx --opset 17
+
+Serve it with INFERENCE_BACKEND=onnx (ONNX_MODEL_PATH overrides the location).
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+
+from model_loader import load_wavlm
+
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH") or os.path.join(os.path.dirname(__file__), "wavlm_model")
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Wraps the HF model so the graph has a single tensor output."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values, attention_mask):
+        return self.model(input_values=input_values, attention_mask=attention_mask).logits
+
+
+def export(model_path, output_path, opset=17):
+    _, model = load_wavlm(model_path, quantize="")
+    wrapper = _LogitsOnly(model).eval()
+
+    # Two clips of different length so the exported graph sees real padding
+    input_values = torch.randn(2, 16000 * 3) * 0.1
+    attention_mask = torch.ones(2, 16000 * 3, dtype=torch.long)
+    attention_mask[1, 16000 * 2:] = 0
+    input_values[1, 16000 * 2:] = 0.0
+
+    export_kwargs = dict(
+        input_names=["input_values", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_values": {0: "batch", 1: "samples"},
+            "attention_mask": {0: "batch", 1: "samples"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+    print(f"📦 Exporting {model_path} -> {output_path} (opset {opset})")
+    with torch.no_grad():
+        try:
+            torch.onnx.export(wrapper, (input_values, attention_mask), output_path, dynamo=False, **export_kwargs)
+        except TypeError:
+            # Older torch without the `dynamo` switch
+            torch.onnx.export(wrapper, (input_values, attention_mask), output_path, **export_kwargs)
+        expected = wrapper(input_values, attention_mask).numpy()
+
+    return input_values.numpy(), attention_mask.numpy(), expected
+
+
+def verify(output_path, input_values, attention_mask, expected):
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(output_path, providers=["CPUExecutionProvider"])
+    logits = session.run(["logits"], {"input_values": input_values, "attention_mask": attention_mask})[0]
+    max_diff = float(np.max(np.abs(logits - expected)))
+    same_labels = bool(np.all(np.argmax(logits, axis=-1) == np.argmax(expected, axis=-1)))
+    print(f"🔍 ORT vs PyTorch: max |logit diff| = {max_diff:.2e}, labels match: {same_labels}")
+    return max_diff, same_labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the WavLM classifier to ONNX.")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Model folder (default: MODEL_PATH or ./wavlm_model)")
+    parser.add_argument("--output", help="Output path (default: <model>/model.onnx)")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Max allowed logit difference")
+    args = parser.parse_args(argv)
+
+    output_path = args.output or os.path.join(args.model, "model.onnx")
+    inputs = export(args.model, output_path, args.opset)
+    max_diff, same_labels = verify(output_path, *inputs)
+
+    if not same_labels or max_diff > args.tolerance:
+        print("❌ Exported graph does not match PyTorch")
+        return 1
+    print(f"✅ Wrote {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+"""
+Download the NLTK data g2p_en needs into NLTK_DATA_DIR (default ./nltk_data).
+
+Run once at build time (e.g. in the Docker image); the server only checks
+for the data and never downloads it while serving.
+
+Usage (from the server folder):
+    python fetch_nltk_data.py
+"""
+import sys
+
+import nltk
+
+from phonemes import NLTK_DATA_DIR, NLTK_RESOURCES, missing_nltk_data
+
+
+def main():
+    for package in NLTK_RESOURCES.values():
+        nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
+
+    missing = missing_nltk_data()
+    if missing:
+        print(f"❌ Still missing: {missing}")
+        return 1
+    print(f"✅ NLTK data ready in {NLTK_DATA_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
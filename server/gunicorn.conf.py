@@ -0,0 +1,82 @@
+"""
+Gunicorn settings for serving app.py with one worker per core.
+
+Usage (from the server folder):
+    gunicorn -c gunicorn.conf.py app:app
+    WEB_CONCURRENCY=4 MODEL_SHARE=mmap gunicorn -c gunicorn.conf.py app:app
+    SERVE_MODE=async gunicorn -c gunicorn.conf.py asgi:application
+
+With preload_app (default) the master imports app.py, loads and warms WavLM
+once, then forks: workers share the weight pages copy-on-write. The STT
+client pool (gRPC) is opened in each worker after the fork instead. With
+MODEL_SHARE=mmap the weights are read from a memory-mapped safetensors
+snapshot instead, which shares pages between workers even without preload
+(and across containers on the same host). /health reports each worker's
+unique (USS) and proportional (PSS) memory.
+
+SERVE_MODE=async runs asgi.py on uvicorn workers: STT is awaited instead of
+holding one of GUNICORN_THREADS per request (see asgi.py).
+
+With several workers, each one writes its metrics snapshot to METRICS_DIR
+(default: a folder in the temp dir, emptied at startup) and /metrics on any
+worker reports the sum (see metrics.py).
+"""
+import multiprocessing
+import os
+import tempfile
+
+pythonpath = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+SERVE_MODE = os.environ.get("SERVE_MODE", "sync").strip().lower()  # "sync" (app:app) | "async" (asgi:application)
+if SERVE_MODE == "async":
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+if workers > 1:
+    os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"stamfree-metrics-{os.environ.get('PORT', '5000')}"))
+
+# Intra-op threads per worker. Keep 1 with preload: the master never starts an
+# OpenMP thread team, so forked workers can't inherit a broken one.
+TORCH_THREADS_PER_WORKER = int(os.environ.get("TORCH_THREADS_PER_WORKER", "1"))
+
+if preload_app:
+    # A background startup thread would only run in the master; load before forking
+    os.environ["STARTUP_MODE"] = "blocking"
+    # gRPC channels opened in the master are not fork-safe; workers warm their own (post_worker_init)
+    os.environ["STT_WARMUP"] = "0"
+
+
+def on_starting(server):
+    from metrics import clear_snapshots
+
+    # Snapshots from a previous run would be summed into this one
+    clear_snapshots(os.environ.get("METRICS_DIR", ""))
+
+
+def post_fork(server, worker):
+    if os.environ.get("INFERENCE_BACKEND", "torch").strip().lower() == "onnx":
+        return  # ONNX workers never import torch (ORT_INTRA_OP_THREADS sets their threads)
+    import torch
+
+    torch.set_num_threads(TORCH_THREADS_PER_WORKER)
+
+
+def post_worker_init(worker):
+    from process_memory import process_memory
+
+    if preload_app:
+        from app import warm_stt_client
+
+        warm_stt_client()
+    worker.log.info(f"🧠 Worker {worker.pid} memory: {process_memory()}")
+
+
+def when_ready(server):
+    from process_memory import process_memory
+
+    server.log.info(f"🧠 Master memory: {process_memory()}")
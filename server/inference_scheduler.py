@@ -0,0 +1,157 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import admission
+import metrics
+
+# ============================================================================
+# StamFree Backend - WavLM Micro-Batching Scheduler
+# ============================================================================
+# Concurrent requests each used to run their own batch-size-1 forward pass.
+# The scheduler collects clips for up to `max_wait_ms` (or until
+# `max_batch_size` clips are waiting), groups them by `batch_key` (for WavLM
+# the scored length, since padding would change a clip's scores; see
+# app.predict_batch), runs one batched forward per group, and resolves each
+# caller's future with its own (label, score, all_scores). A batch's stage timings are
+# recorded into the metrics timer of every request it served. Clips are taken
+# in request priority order (see admission.py), so under load a balloon clip
+# is not queued behind a long analyze_audio job's windows. `workers` batcher
+# threads share the queue, so batches still run in parallel on a multi-core
+# worker (one per CPU slot in app.py).
+
+
+def equal_length_batches(segments, batch_size, batch_key=len):
+    """Indices of `segments` in batches of up to batch_size that share one batch_key, in input order."""
+    groups = {}
+    for i, segment in enumerate(segments):
+        groups.setdefault(batch_key(segment), []).append(i)
+    for group in groups.values():
+        for start in range(0, len(group), batch_size):
+            yield group[start:start + batch_size]
+
+
+class InferenceScheduler:
+    """Request-side queue in front of a batched predict function."""
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, batch_key=len, workers=1):
+        # run_batch(list_of_segments) -> list of (label, score, all_scores), same order
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.batch_key = batch_key  # Only segments with equal keys share a batch
+        self.workers = max(1, int(workers))
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._threads = []
+        self._seq = itertools.count()  # FIFO within a priority
+
+        # Stats
+        self._requests = 0
+        self._batches = 0
+        self._batch_sizes = Counter()
+        self._wait_ms_total = 0.0
+
+    # --- PUBLIC API ---
+
+    def submit(self, samples):
+        """Queue one 16 kHz segment; returns a Future resolving to (label, score, all_scores)."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put(
+            (admission.current_priority(), next(self._seq), samples, future, time.perf_counter(), metrics.current_timers())
+        )
+        return future
+
+    def predict(self, samples):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(samples).result()
+
+    def predict_many(self, segments):
+        """Submit many segments at once and return their results in order."""
+        futures = [self.submit(s) for s in segments]
+        return [f.result() for f in futures]
+
+    def stats(self):
+        """Queue depth and batch-size statistics for this process."""
+        with self._lock:
+            batches = self._batches
+            requests = self._requests
+            return {
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "requests": requests,
+                "batches": batches,
+                "avg_batch_size": round(requests / batches, 2) if batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "avg_queue_wait_ms": round(self._wait_ms_total / requests, 2) if requests else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "workers": self.workers,
+            }
+
+    # --- WORKER ---
+
+    def _ensure_worker(self):
+        # Fork-safe: a forked worker inherits neither the thread nor a usable queue
+        pid = os.getpid()
+        if self._pid == pid and self._threads and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid == pid and self._threads and all(t.is_alive() for t in self._threads):
+                return
+            self._queue = queue.PriorityQueue()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"wavlm-batcher-{i}", daemon=True) for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = pid
+
+    def _collect(self):
+        """Block for the first item, then gather more until the deadline or batch is full."""
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    items.append(self._queue.get_nowait())
+                else:
+                    items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+
+            # No padding, so a clip's result does not depend on its batch-mates; items arrive in priority order
+            buckets = {}
+            for item in items:
+                buckets.setdefault(self.batch_key(item[2]), []).append(item)
+
+            for bucket in buckets.values():
+                timers = {timer for *_, item_timers in bucket for timer in item_timers}
+                try:
+                    with metrics.attributed_to(timers), admission.priority(bucket[0][0]):
+                        results = self.run_batch([samples for _, _, samples, *_ in bucket])
+                except Exception as e:
+                    for _, _, _, future, *_ in bucket:
+                        future.set_exception(e)
+                    continue
+                for (_, _, _, future, *_), result in zip(bucket, results):
+                    future.set_result(result)
+
+                with self._lock:
+                    self._batches += 1
+                    self._requests += len(bucket)
+                    self._batch_sizes[len(bucket)] += 1
+                    self._wait_ms_total += sum((started - queued) * 1000.0 for *_, queued, _ in bucket)
@@ -0,0 +1,115 @@
+import contextvars
+import os
+import time
+
+# ============================================================================
+# StamFree Backend - Per-Request Latency Budget
+# ============================================================================
+# Kids' games need an answer within about two seconds, even when Google STT
+# is slow. Each request gets a budget: the client's X-Latency-Budget-Ms
+# header or its endpoint's default. Each stage may use a share of whatever
+# is left when it starts (timeout_for), capped by the stage's fixed
+# deadline. A stage that misses its share gets a cheaper local signal
+# instead, chosen by the endpoint: for example the RMS/ZCR voicing ratio in
+# place of pitch tracking, or a WavLM-only verdict in place of STT. The
+# response then lists the degraded stages (X-Degraded-Stages, plus a field
+# in the game's body). Requests without a budget keep the fixed deadlines
+# but still report stages that missed them.
+
+LATENCY_BUDGET_HEADER = "X-Latency-Budget-Ms"
+DEGRADED_HEADER = "X-Degraded-Stages"
+LATENCY_BUDGET_MS = float(os.environ.get("LATENCY_BUDGET_MS", "2000"))  # Default for the games
+BUDGET_MIN_MS = 250
+BUDGET_MAX_MS = 30000
+
+# Endpoints that get a budget without asking for one (others only with the header).
+# Not turtle: its word check needs the transcript, so by default it waits for STT_TIMEOUT_S.
+ENDPOINT_BUDGET_MS = {
+    "analyze_snake": LATENCY_BUDGET_MS,
+    "analyze_tapping": LATENCY_BUDGET_MS,
+}
+
+# Share of the remaining budget a stage may use. Stages run concurrently, so
+# shares don't add up to 1; what is left over pays for the fallback and scoring.
+STAGE_SHARES = {
+    "stt": 0.75,
+    "wavlm": 0.8,
+    "voicing": 0.6,  # Pitch tracking
+    "amplitude": 0.6,
+    "nasal": 0.9,  # Second pitch pass, only after STT came back empty
+}
+DEFAULT_SHARE = 0.75
+
+
+class LatencyBudget:
+    """Deadline for one request (None: unlimited), plus the stages that fell back to a cheaper signal."""
+
+    def __init__(self, total_ms=None):
+        self.total_s = total_ms / 1000.0 if total_ms is not None else None
+        self.started = time.perf_counter()
+        self.degraded = {}  # stage -> what replaced it
+
+    def remaining(self):
+        if self.total_s is None:
+            return None
+        return max(0.0, self.total_s - (time.perf_counter() - self.started))
+
+    def timeout_for(self, stage, timeout=None):
+        """The stage's share of the remaining budget, capped by its own timeout (None: no limit)."""
+        if self.total_s is None:
+            return timeout
+        share = STAGE_SHARES.get(stage, DEFAULT_SHARE) * self.remaining()
+        return share if timeout is None else min(timeout, share)
+
+
+# --- REQUEST CONTEXT ---
+# None outside a job request (rescore.py, warmup): fixed deadlines, nothing reported
+_active = contextvars.ContextVar("stamfree_latency_budget", default=None)
+
+
+def _requested_ms(headers, endpoint):
+    """Budget (ms) from the header, else the endpoint default, else None."""
+    value = headers.get(LATENCY_BUDGET_HEADER, "")
+    if value:
+        try:
+            return min(BUDGET_MAX_MS, max(BUDGET_MIN_MS, float(value)))
+        except ValueError:
+            pass  # Malformed header: fall through to the endpoint default
+    return ENDPOINT_BUDGET_MS.get(endpoint)
+
+
+def start_request(headers, endpoint):
+    """Set the budget for this request; returns (LatencyBudget, token for finish_request)."""
+    budget = LatencyBudget(_requested_ms(headers, endpoint))
+    return budget, _active.set(budget)
+
+
+def finish_request(token):
+    _active.reset(token)
+
+
+def decided():
+    return _active.get() is not None
+
+
+def current():
+    """The current request's LatencyBudget, or None."""
+    return _active.get()
+
+
+def timeout_for(stage, timeout=None):
+    """Deadline for a stage: its share of the current budget, or `timeout` when there is none."""
+    budget = current()
+    return timeout if budget is None else budget.timeout_for(stage, timeout)
+
+
+def degrade(report, stage, fallback):
+    """
+    Record that `stage` was answered by `fallback` (a short name for the
+    cheaper signal): in the job's own `report` dict (its response body) and
+    on the request (X-Degraded-Stages, which covers every clip of a batch).
+    """
+    report[stage] = fallback
+    budget = current()
+    if budget is not None:
+        budget.degraded[stage] = fallback
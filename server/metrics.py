@@ -0,0 +1,265 @@
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ============================================================================
+# StamFree Backend - Stage Metrics
+# ============================================================================
+# Responses only carried an end-to-end elapsed_ms, so nothing said which stage
+# drives p95 on a game. Code paths time themselves with `timed("decode")`;
+# every observation lands in a per-(endpoint, stage) histogram (Prometheus
+# text on /metrics) and in the current request's timer, which becomes the
+# Server-Timing response header.
+#
+# Counters (stamfree_*_total) count events that have no duration worth a
+# histogram, e.g. uploads a decoder had to copy into a seekable file.
+#
+# Stages: upload (form parsing / spooling), decode (probe + container decode,
+# includes resample), resample, wavlm_features, wavlm_forward, voicing (pitch
+# tracking), stt (recognizer round trip), g2p and scoring (game rules after
+# the last stage). Cache hits record nothing.
+#
+# The request timer travels in a ContextVar: stage_runner copies the context
+# into pool threads, and the WavLM scheduler records a shared forward pass
+# into every request in the batch. Work outside a request (startup warmup)
+# is labelled endpoint="background".
+#
+# Pre-forked workers each hold their own counts. With METRICS_DIR set, every
+# process writes a snapshot there and /metrics sums all of them, so a scrape
+# that lands on any worker sees the whole server.
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_S = float(os.environ.get("METRICS_FLUSH_S", "1"))
+BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BACKGROUND = "background"
+
+HISTOGRAMS = {
+    "stamfree_stage_duration_seconds": ("Time spent in one analysis stage.", ("endpoint", "stage")),
+    "stamfree_request_duration_seconds": ("End-to-end request latency.", ("endpoint", "status")),
+}
+
+COUNTERS = {
+    "stamfree_decode_spool_total": (
+        "Uploads copied into a seekable file for a decoder (moov-at-end MP4, audioread).", ("decoder", "kind"),
+    ),
+}
+
+
+class RequestTimer:
+    """Stage totals (ms) for one request, summed when a stage runs more than once."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or BACKGROUND
+        self.started = time.perf_counter()
+        self.stages_ms = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages_ms[stage] = self.stages_ms.get(stage, 0.0) + seconds * 1000.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value: stages in the order they first ran, then total."""
+        with self._lock:
+            parts = [f"{stage};dur={ms:.1f}" for stage, ms in self.stages_ms.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000.0:.1f}")
+        return ", ".join(parts)
+
+
+_timers = contextvars.ContextVar("stamfree_request_timers", default=())
+
+
+def start_request(endpoint):
+    """Start timing a request in the current context; returns (timer, token for finish_request)."""
+    timer = RequestTimer(endpoint)
+    return timer, _timers.set((timer,))
+
+
+def finish_request(token):
+    _timers.reset(token)
+
+
+def current():
+    """The request timer for this context, or None."""
+    timers = _timers.get()
+    return timers[0] if len(timers) == 1 else None
+
+
+def current_timers():
+    return _timers.get()
+
+
+@contextmanager
+def attributed_to(timers):
+    """Record observations in this block into every given timer (one forward pass serving several requests)."""
+    token = _timers.set(tuple(timers))
+    try:
+        yield
+    finally:
+        _timers.reset(token)
+
+
+# --- HISTOGRAMS AND COUNTERS ---
+class _Registry:
+    """
+    Counts for this process: {(metric, labels): series}, where a histogram's
+    series is [bucket counts..., +Inf, sum] and a counter's is [value].
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._pid = os.getpid()
+        self._flushed = 0.0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Forked worker: counts so far belong to the parent's snapshot
+            self._series, self._pid, self._flushed = {}, os.getpid(), 0.0
+
+    def observe(self, metric, labels, seconds):
+        with self._lock:
+            self._check_fork()
+            series = self._series.get((metric, labels))
+            if series is None:
+                series = self._series[(metric, labels)] = [0] * (len(BUCKETS_S) + 1) + [0.0]
+            for i, bound in enumerate(BUCKETS_S):
+                if seconds <= bound:
+                    series[i] += 1
+            series[len(BUCKETS_S)] += 1
+            series[-1] += seconds
+            due = METRICS_DIR and time.monotonic() - self._flushed >= METRICS_FLUSH_S
+        if due:
+            self.flush()
+
+    def increment(self, metric, labels, amount=1):
+        with self._lock:
+            self._check_fork()
+            series = self._series.setdefault((metric, labels), [0])
+            series[0] += amount
+            due = METRICS_DIR and time.monotonic() - self._flushed >= METRICS_FLUSH_S
+        if due:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return {}
+            return {key: list(series) for key, series in self._series.items()}
+
+    def flush(self):
+        """Write this process's snapshot to METRICS_DIR (temp file + rename, so readers never see half a file)."""
+        if not METRICS_DIR:
+            return
+        self._flushed = time.monotonic()
+        rows = [[metric, list(labels), series] for (metric, labels), series in self.snapshot().items()]
+        path = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(rows, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"⚠️ Could not write metrics snapshot: {e}")
+
+    def merged(self):
+        """This process's live counts plus every other process's last snapshot."""
+        merged = self.snapshot()
+        if not METRICS_DIR:
+            return merged
+        own = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, series in rows:
+                key = (metric, tuple(labels))
+                if key in merged:
+                    merged[key] = [a + b for a, b in zip(merged[key], series)]
+                else:
+                    merged[key] = series
+        return merged
+
+
+registry = _Registry()
+
+
+def observe(stage, seconds):
+    """Record one stage duration for the current request(s), or as background work."""
+    timers = _timers.get()
+    if not timers:
+        registry.observe("stamfree_stage_duration_seconds", (BACKGROUND, stage), seconds)
+        return
+    for timer in timers:
+        timer.record(stage, seconds)
+        registry.observe("stamfree_stage_duration_seconds", (timer.endpoint, stage), seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Time a block as one stage: `with timed("decode"): ...`"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+
+def count(metric, *labels):
+    """Add one to a counter from COUNTERS: `count("stamfree_decode_spool_total", "ffmpeg", "memfd")`"""
+    registry.increment(metric, labels)
+
+
+def observe_request(timer, status):
+    registry.observe("stamfree_request_duration_seconds", (timer.endpoint, str(status)), timer.elapsed())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render():
+    """All histograms and counters in the Prometheus text exposition format (0.0.4)."""
+    series = registry.merged()
+    lines = []
+    for metric, (help_text, label_names) in HISTOGRAMS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, labels), counts in sorted(series.items()):
+            if name != metric:
+                continue
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(label_names, labels))
+            for bound, count in zip(BUCKETS_S, counts):
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound:g}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {counts[len(BUCKETS_S)]}')
+            lines.append(f"{metric}_sum{{{label_text}}} {counts[-1]:.6f}")
+            lines.append(f"{metric}_count{{{label_text}}} {counts[len(BUCKETS_S)]}")
+    for metric, (help_text, label_names) in COUNTERS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for (name, labels), counts in sorted(series.items()):
+            if name != metric:
+                continue
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(label_names, labels))
+            lines.append(f"{metric}{{{label_text}}} {counts[0]}")
+    return "\n".join(lines) + "\n"
+
+
+def clear_snapshots(directory=METRICS_DIR):
+    """Remove snapshots left by a previous server run (gunicorn on_starting)."""
+    for path in glob.glob(os.path.join(directory, "metrics-*.json*")) if directory else []:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# ============================================================================
+# StamFree Backend - WavLM Loading
+# ============================================================================
+# Shared by the server and the offline tools so every caller loads (and,
+# optionally, quantizes) the classifier the same way. transformers
+# and torch are imported inside the loaders so importing this module stays
+# cheap, and an ONNX Runtime worker never loads torch at all.
+
+# "" keeps fp32; "int8" applies dynamic int8 quantization (CPU only)
+MODEL_QUANTIZE = os.environ.get("MODEL_QUANTIZE", "").strip().lower()
+QUANTIZE_MODES = ("", "int8")
+
+# "torch" runs the eager model; "onnx" runs <MODEL_PATH>/model.onnx (see export_onnx.py) on ONNX Runtime
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch").strip().lower()
+INFERENCE_BACKENDS = ("torch", "onnx")
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH")
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", "1"))
+
+# "" loads the weights into each process with from_pretrained; "mmap" serves them
+# from a memory-mapped safetensors snapshot of the state dict, so every worker on
+# the machine reads the same page-cache pages instead of holding its own copy
+MODEL_SHARE = os.environ.get("MODEL_SHARE", "").strip().lower()
+SHARE_MODES = ("", "mmap")
+SHARED_WEIGHTS_FILE = "model.shared.safetensors"
+
+# safetensors dtype -> torch dtype attribute name
+_SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8",
+    "U8": "uint8", "BOOL": "bool",
+}
+
+
+# WavLM attention passes these weights straight to F.multi_head_attention_forward,
+# which needs plain tensors, so they stay fp32
+ATTENTION_PROJECTIONS = ("q_proj", "k_proj", "v_proj", "out_proj")
+
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamic int8 quantization of the classifier's nn.Linear layers: every
+    transformer feed-forward layer, the relative-position gate, the projector
+    and the classifier head. Weights are stored as int8; activations are
+    quantized on the fly.
+    """
+    import torch
+
+    linear_names = {
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.rsplit(".", 1)[-1] not in ATTENTION_PROJECTIONS
+    }
+    return torch.ao.quantization.quantize_dynamic(model, linear_names, dtype=torch.qint8)
+
+
+def model_fingerprint(model_path):
+    """
+    Short hash identifying the model files in a folder (config contents plus
+    weight file names, sizes and mtimes) for cache keys and /health.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    with open(os.path.join(model_path, "config.json"), "rb") as f:
+        h.update(f.read())
+    for name in sorted(os.listdir(model_path)):
+        if name.endswith((".bin", ".safetensors", ".onnx", ".pt")) and name != SHARED_WEIGHTS_FILE:
+            stat = os.stat(os.path.join(model_path, name))
+            h.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    return h.hexdigest()
+
+
+def _read_safetensors_header(path):
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        return 8 + header_len, json.loads(f.read(header_len))
+
+
+def mmap_safetensors(path):
+    """
+    Tensors backed directly by a private (copy-on-write) mmap of a safetensors
+    file: no copy is made, so processes mapping the same file share its pages.
+    """
+    import torch
+
+    data_start, header = _read_safetensors_header(path)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        count = (end - start) // dtype.itemsize
+        if count:
+            tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + start)
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+
+def _load_mmap_shared(model_path):
+    """
+    Classifier whose weights live in <model_path>/model.shared.safetensors.
+    The snapshot is (re)written from from_pretrained when missing or stale, with
+    exactly the model's state_dict keys, then mapped into a weightless model.
+    """
+    import torch
+    from safetensors.torch import save_file
+    from transformers import AutoConfig, AutoModelForAudioClassification
+
+    path = os.path.join(model_path, SHARED_WEIGHTS_FILE)
+    fingerprint = model_fingerprint(model_path)
+    current = None
+    if os.path.exists(path):
+        current = _read_safetensors_header(path)[1].get("__metadata__", {}).get("fingerprint")
+
+    if current != fingerprint:
+        print(f"📦 Writing memory-mappable weights to {path}")
+        model = AutoModelForAudioClassification.from_pretrained(model_path)
+        state = {k: v.detach().cpu().contiguous() for k, v in model.state_dict().items()}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        save_file(state, tmp_path, metadata={"fingerprint": fingerprint})
+        os.replace(tmp_path, path)  # Atomic: concurrent workers never see a partial file
+        del model, state
+
+    config = AutoConfig.from_pretrained(model_path)
+    with torch.device("meta"):
+        model = AutoModelForAudioClassification.from_config(config)
+    model.load_state_dict(mmap_safetensors(path), strict=True, assign=True)
+
+    leftover = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if leftover:
+        raise ValueError(f"❌ {SHARED_WEIGHTS_FILE} is missing tensors: {leftover[:5]}")
+    return model
+
+
+def load_wavlm(model_path, device="cpu", quantize=None, share=None):
+    """
+    Load the feature extractor and classifier from a local folder.
+    Returns: (feature_extractor, model) with the model in eval mode on `device`.
+    """
+    quantize = MODEL_QUANTIZE if quantize is None else quantize
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown MODEL_QUANTIZE '{quantize}' (expected one of {QUANTIZE_MODES})")
+    share = MODEL_SHARE if share is None else share
+    if share not in SHARE_MODES:
+        raise ValueError(f"Unknown MODEL_SHARE '{share}' (expected one of {SHARE_MODES})")
+
+    from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
+
+    feature_extractor = AutoFeatureExtractor.from_pretrained(model_path)
+    if share == "mmap" and device == "cpu":
+        model = _load_mmap_shared(model_path)
+        if quantize == "int8":
+            print("⚠️ MODEL_SHARE=mmap with int8: quantized layers are private copies per process")
+    else:
+        if share == "mmap":
+            print(f"⚠️ MODEL_SHARE=mmap is CPU-only; loading a private copy on {device}")
+        model = AutoModelForAudioClassification.from_pretrained(model_path)
+        model.to(device)
+    model.eval()  # Set to inference mode
+
+    if quantize == "int8":
+        if device != "cpu":
+            print(f"⚠️ int8 dynamic quantization is CPU-only; keeping fp32 on {device}")
+        else:
+            model = quantize_dynamic_int8(model)
+
+    return feature_extractor, model
+
+
+class OnnxFeatureExtractor:
+    """
+    numpy version of the Wav2Vec2FeatureExtractor call the server makes
+    (list of 1-D float arrays, pad to longest, optional truncation). Used by the
+    ONNX backend because transformers imports torch whenever it is installed.
+    """
+
+    def __init__(self, model_path):
+        with open(os.path.join(model_path, "preprocessor_config.json")) as f:
+            config = json.load(f)
+        self.sampling_rate = config.get("sampling_rate", 16000)
+        self.do_normalize = config.get("do_normalize", True)
+        self.padding_value = config.get("padding_value", 0.0)
+
+    def __call__(self, raw_speech, sampling_rate=None, return_tensors="np", padding=True,
+                 truncation=False, max_length=None, return_attention_mask=True):
+        if sampling_rate is not None and sampling_rate != self.sampling_rate:
+            raise ValueError(f"Expected {self.sampling_rate} Hz audio, got {sampling_rate} Hz")
+        if return_tensors != "np":
+            raise ValueError("OnnxFeatureExtractor only returns numpy arrays")
+
+        clips = [np.asarray(x, dtype=np.float32).reshape(-1) for x in raw_speech]
+        if truncation and max_length:
+            clips = [x[:max_length] for x in clips]
+        width = max(len(x) for x in clips)  # Always pads to the longest clip
+
+        input_values = np.full((len(clips), width), self.padding_value, dtype=np.float32)
+        attention_mask = np.zeros((len(clips), width), dtype=np.int32)
+        for row, x in enumerate(clips):
+            if self.do_normalize:
+                x = (x - x.mean()) / np.sqrt(x.var() + 1e-7)
+            input_values[row, :len(x)] = x
+            attention_mask[row, :len(x)] = 1
+
+        inputs = {"input_values": input_values}
+        if return_attention_mask:
+            inputs["attention_mask"] = attention_mask
+        return inputs
+
+
+class OnnxConfig:
+    """The label maps of the model's config.json (all the server reads from the HF config)."""
+
+    def __init__(self, model_path):
+        with open(os.path.join(model_path, "config.json")) as f:
+            config = json.load(f)
+        self.id2label = {int(k): v for k, v in config.get("id2label", {}).items()}
+        self.label2id = {k: int(v) for k, v in config.get("label2id", {}).items()}
+
+
+class OnnxClassifier:
+    """ONNX Runtime (CPU) session for the exported classifier, with the config's labels."""
+
+    def __init__(self, onnx_path, config, intra_op_threads=ORT_INTRA_OP_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.config = config
+        self.onnx_path = onnx_path
+
+    def logits(self, input_values, attention_mask):
+        """Run the graph on numpy inputs; returns (batch, num_labels) logits."""
+        return self.session.run(
+            ["logits"],
+            {
+                "input_values": np.asarray(input_values, dtype=np.float32),
+                "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+            },
+        )[0]
+
+
+def load_onnx_classifier(model_path, onnx_path=None):
+    """
+    Load the feature extractor, label config and ONNX Runtime session, without
+    transformers or torch.
+    Returns: (OnnxFeatureExtractor, OnnxClassifier)
+    """
+    onnx_path = onnx_path or ONNX_MODEL_PATH or os.path.join(model_path, "model.onnx")
+    if not os.path.exists(onnx_path):
+        raise ValueError(f"❌ ONNX graph not found at {onnx_path}. Run: python export_onnx.py --model {model_path}")
+
+    return OnnxFeatureExtractor(model_path), OnnxClassifier(onnx_path, OnnxConfig(model_path))
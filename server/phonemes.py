@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+
+import metrics
+
+# ============================================================================
+# StamFree Backend - Phoneme Service
+# ============================================================================
+# g2p_en runs POS tagging on every call (and a small network for words it
+# does not know), and each game used to call it per transcript word and then
+# strip stress digits and map to kid-friendly phonemes inline. This module
+# does that once per word:
+#   - plain dictionary words are read straight from g2p_en's CMUdict
+#     (homographs and unknown words still go through g2p_en)
+#   - results are memoized in an LRU (PHONEME_CACHE_SIZE)
+#   - words in the game content (game_content.json) are precomputed at
+#     startup and never evicted
+#   - snake targets ("E", "SH") map to the same kid-friendly symbols as the
+#     transcript words (target_sound)
+# so a phoneme check is a set lookup.
+
+PHONEME_CACHE_SIZE = int(os.environ.get("PHONEME_CACHE_SIZE", "8192"))
+GAME_CONTENT_PATH = os.environ.get("GAME_CONTENT_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "game_content.json"
+)
+PLAIN_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# NLTK data g2p_en needs, fetched once at build time (fetch_nltk_data.py).
+# g2p_en calls nltk.download on import when these are missing, so they are
+# checked first and the server never downloads at runtime.
+NLTK_DATA_DIR = os.environ.get("NLTK_DATA_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "nltk_data"
+)
+NLTK_RESOURCES = {
+    "taggers/averaged_perceptron_tagger_eng": "averaged_perceptron_tagger_eng",
+    "taggers/averaged_perceptron_tagger.zip": "averaged_perceptron_tagger",
+    "corpora/cmudict.zip": "cmudict",
+}
+
+# --- KID FRIENDLY PHONEMES ---
+PHONEME_MAP = {
+    "AA": "a",
+    "AE": "a",
+    "AH": "u",
+    "AO": "aw",
+    "AW": "ow",
+    "AY": "i",
+    "B": "b",
+    "CH": "ch",
+    "D": "d",
+    "DH": "th",
+    "EH": "e",
+    "ER": "er",
+    "EY": "a",
+    "F": "f",
+    "G": "g",
+    "HH": "h",
+    "IH": "i",
+    "IY": "ee",
+    "JH": "j",
+    "K": "k",
+    "L": "l",
+    "M": "m",
+    "N": "n",
+    "NG": "ng",
+    "OW": "o",
+    "OY": "oy",
+    "P": "p",
+    "R": "r",
+    "S": "s",
+    "SH": "sh",
+    "T": "t",
+    "TH": "th",
+    "UH": "u",
+    "UW": "oo",
+    "V": "v",
+    "W": "w",
+    "Y": "y",
+    "Z": "z",
+    "ZH": "zh",
+}
+
+# Snake pool symbols that are not ARPAbet (per the seed's IPA: ɑ, i, u, h)
+SNAKE_ARPABET = {
+    "A": "AA",
+    "E": "IY",
+    "O": "UW",
+    "H": "HH",
+}
+
+
+_g2p = None
+_g2p_lock = threading.Lock()
+
+# Precomputed ARPAbet (stress stripped) for every word in the game content
+_content_words = {}
+
+
+def missing_nltk_data():
+    """NLTK packages g2p_en needs that are not installed (also searches NLTK_DATA_DIR)."""
+    import nltk
+
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    missing = []
+    for resource, package in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(package)
+    return missing
+
+
+def get_g2p():
+    """Shared g2p_en instance, created on first use."""
+    global _g2p
+    if _g2p is None:
+        with _g2p_lock:
+            if _g2p is None:
+                missing = missing_nltk_data()
+                if missing:
+                    raise RuntimeError(f"❌ Missing NLTK data {missing}. Run: python fetch_nltk_data.py")
+                from g2p_en import G2p
+                _g2p = G2p()
+    return _g2p
+
+
+def strip_stress(arpabet):
+    """'AH0' -> 'AH'"""
+    return "".join(c for c in arpabet if not c.isdigit())
+
+
+def to_kid_phoneme(arpabet):
+    """Stress-free ARPAbet -> kid-friendly phoneme ('SH' -> 'sh', 'IY' -> 'ee')."""
+    return PHONEME_MAP.get(arpabet, arpabet.lower())
+
+
+@lru_cache(maxsize=PHONEME_CACHE_SIZE)
+def _lookup(word):
+    g2p = get_g2p()
+    key = word.lower()
+    cmu = getattr(g2p, "cmu", {})
+    # Same pronunciation g2p_en would pick, without the POS tagger
+    if PLAIN_WORD.fullmatch(key) and key in cmu and key not in getattr(g2p, "homograph2features", {}):
+        raw = cmu[key][0]
+    else:
+        with metrics.timed("g2p"):
+            raw = g2p(word)
+    return tuple(strip_stress(p) for p in raw if p not in (" ", "'"))
+
+
+def word_phonemes(word):
+    """Stress-free ARPAbet phonemes for one word, e.g. 'sun' -> ('S', 'AH', 'N')."""
+    phonemes = _content_words.get(word.lower())
+    return phonemes if phonemes is not None else _lookup(word)
+
+
+@lru_cache(maxsize=PHONEME_CACHE_SIZE)
+def word_sounds(word):
+    """Set of kid-friendly phonemes in a word, e.g. 'sun' -> {'s', 'u', 'n'}."""
+    return frozenset(to_kid_phoneme(p) for p in word_phonemes(word))
+
+
+def first_sound(word):
+    """Kid-friendly phoneme the word starts with, or None."""
+    phonemes = word_phonemes(word)
+    return to_kid_phoneme(phonemes[0]) if phonemes else None
+
+
+def target_sound(target_phoneme):
+    """Kid-friendly phoneme a snake target asks for: pool symbol or item id ('E' / 'ee' -> 'ee', 'SH' -> 'sh')."""
+    arpabet = target_phoneme.strip().upper()
+    return to_kid_phoneme(SNAKE_ARPABET.get(arpabet, arpabet))
+
+
+def precompute_game_content(path=GAME_CONTENT_PATH):
+    """Build the phoneme table for all game content. Returns the number of distinct words."""
+    if not os.path.exists(path):
+        print(f"⚠️ Game content not found at {path}; phonemes will be looked up on demand")
+        return 0
+
+    with open(path, encoding="utf-8") as f:
+        content = json.load(f)
+
+    for game in ("turtle", "tapping"):
+        for text in content.get(game, {}).values():
+            for word in re.findall(r"[A-Za-z']+", text or ""):
+                key = word.lower()
+                if key not in _content_words:
+                    _content_words[key] = _lookup(key)
+
+    return len(_content_words)
@@ -0,0 +1,48 @@
+import os
+import resource
+
+# ============================================================================
+# StamFree Backend - Per-Process Memory
+# ============================================================================
+# RSS counts pages shared with other workers (pre-fork copy-on-write pages,
+# memory-mapped weights) in full, so it overstates what each worker costs.
+# USS (private pages) is what adding one more worker adds; PSS splits shared
+# pages evenly between the processes mapping them.
+
+SMAPS_ROLLUP = "/proc/self/smaps_rollup"
+
+
+def _read_smaps_rollup(path=SMAPS_ROLLUP):
+    """Fields of smaps_rollup in kB, e.g. {"Rss": 1234, "Pss": 800, ...}."""
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def process_memory():
+    """
+    Memory of this process in MB.
+    Linux: rss / pss / uss / shared from smaps_rollup; elsewhere only peak RSS.
+    """
+    try:
+        kb = _read_smaps_rollup()
+    except OSError:
+        # ru_maxrss is kB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        scale = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+        return {"pid": os.getpid(), "peakRssMb": round(peak / scale, 1)}
+
+    def mb(*names):
+        return round(sum(kb.get(name, 0) for name in names) / 1024.0, 1)
+
+    return {
+        "pid": os.getpid(),
+        "rssMb": mb("Rss"),
+        "pssMb": mb("Pss"),
+        "ussMb": mb("Private_Clean", "Private_Dirty"),
+        "sharedMb": mb("Shared_Clean", "Shared_Dirty"),
+    }
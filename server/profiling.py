@@ -0,0 +1,235 @@
+import contextvars
+import cProfile
+import glob
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+# ============================================================================
+# StamFree Backend - On-Demand Request Profiling
+# ============================================================================
+# When one clip is slow in production (e.g. a long m4a sending pyin down a
+# slow path) the metrics say which stage, not which function. A request is
+# profiled with cProfile when it carries `X-Profile: <PROFILE_SECRET>` or is
+# picked by PROFILE_SAMPLE_RATE. Every thread that works on it is profiled
+# (the request thread, plus stage / CPU pool work through stage_runner) and
+# the merged stats are written to PROFILE_DIR as <request id>.prof (load with
+# `python -m pstats` or snakeviz), with a .json summary of the top functions.
+# The response names the profile in X-Profile-Id; GET /profiles lists them.
+#
+# Python 3.12+ runs cProfile on sys.monitoring, which allows one active
+# profiler per interpreter: a thread that can't enable its own (another
+# request or thread holds it) runs its work unprofiled instead of failing.
+
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "stamfree-profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "100"))  # Newest profiles kept on disk
+PROFILE_TOP_N = 15
+PROFILE_HEADER = "X-Profile"
+REQUEST_ID_HEADER = "X-Request-Id"
+REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+PROFILE_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class RequestProfile:
+    """cProfile runs from every thread that worked on one request, merged on save()."""
+
+    def __init__(self, request_id, endpoint, reason):
+        self.id = request_id
+        self.endpoint = endpoint
+        self.reason = reason  # "header" | "sampled"
+        self.started = time.perf_counter()
+        self.created = time.time()
+        self.saved = None
+        self._profiles = []
+        self._thread_profile = None
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            if self.saved is None:  # Stages still running after the response are left out
+                self._profiles.append(profile)
+
+    def enable_thread(self):
+        """Profile the calling thread until save() (Flask: the request thread)."""
+        profiler = _enabled_profiler()
+        if profiler is None:
+            print(f"⚠️ Another profiler is active; {self.endpoint} request thread runs unprofiled")
+        self._thread_profile = profiler
+
+    def save(self, status):
+        """Write <id>.prof and <id>.json to PROFILE_DIR; returns the summary (once)."""
+        if self._thread_profile is not None:
+            self._thread_profile.disable()
+            self.add(self._thread_profile)
+            self._thread_profile = None
+        with self._lock:
+            if self.saved is not None:
+                return self.saved
+            profiles = self._profiles
+            self.saved = {}
+
+        summary = {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "status": status,
+            "reason": self.reason,
+            "created": round(self.created, 3),
+            "elapsedMs": round((time.perf_counter() - self.started) * 1000.0, 1),
+            "threads": len(profiles),
+        }
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stats = pstats.Stats(*profiles) if profiles else None
+            if stats is not None:
+                stats.dump_stats(os.path.join(PROFILE_DIR, f"{self.id}.prof"))
+                summary["top"] = _top_functions(stats)
+            with open(os.path.join(PROFILE_DIR, f"{self.id}.json"), "w") as f:
+                json.dump(summary, f)
+            _prune()
+            print(f"🔬 Profiled {self.endpoint} ({summary['elapsedMs']} ms) -> {self.id}.prof")
+        except (OSError, TypeError) as e:
+            print(f"⚠️ Could not save profile {self.id}: {e}")
+        self.saved = summary
+        return summary
+
+
+def _top_functions(stats, limit=PROFILE_TOP_N):
+    """Functions with the most self time: [{function, calls, selfMs, cumulativeMs}]."""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "selfMs": round(self_time * 1000.0, 2),
+            "cumulativeMs": round(cumulative * 1000.0, 2),
+        }
+        for (filename, line, name), (_, calls, self_time, cumulative, _) in rows
+    ]
+
+
+def _summaries():
+    """Saved summary paths, newest first."""
+    dated = []
+    for path in glob.glob(os.path.join(PROFILE_DIR, "*.json")):
+        try:
+            dated.append((os.path.getmtime(path), path))
+        except OSError:
+            continue  # Pruned by another worker
+    return [path for _, path in sorted(dated, reverse=True)]
+
+
+def _prune():
+    for path in _summaries()[PROFILE_KEEP:]:
+        for stale in (path, path[:-len(".json")] + ".prof"):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+# --- REQUEST CONTEXT ---
+# None: not decided yet; False: this request is not profiled; else its RequestProfile
+_active = contextvars.ContextVar("stamfree_request_profile", default=None)
+
+
+def _has_secret(headers):
+    return bool(PROFILE_SECRET) and hmac.compare_digest(
+        headers.get(PROFILE_HEADER, "").encode("utf-8"), PROFILE_SECRET.encode("utf-8")
+    )
+
+
+def _requested(headers):
+    """Why this request should be profiled ("header" / "sampled"), or None."""
+    if _has_secret(headers):
+        return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def start_request(headers, endpoint):
+    """Decide once per request whether to profile it; returns (RequestProfile or None, token for finish_request)."""
+    reason = _requested(headers)
+    if reason is None:
+        return None, _active.set(False)
+    request_id = headers.get(REQUEST_ID_HEADER, "")
+    if not REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex[:16]
+    request_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{request_id}"
+    profile = RequestProfile(request_id, endpoint, reason)
+    return profile, _active.set(profile)
+
+
+def finish_request(token):
+    _active.reset(token)
+
+
+def decided():
+    return _active.get() is not None
+
+
+def active():
+    """The current request's RequestProfile, or None."""
+    return _active.get() or None
+
+
+def _enabled_profiler():
+    """A running cProfile.Profile, or None when another profiling tool is active (Python 3.12+)."""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def call(fn, *args, **kwargs):
+    """fn(*args, **kwargs), profiled on this thread when the current request is being profiled."""
+    profile = _active.get()
+    if not profile:
+        return fn(*args, **kwargs)
+    profiler = _enabled_profiler()
+    if profiler is None:
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profile.add(profiler)
+
+
+# --- LISTING ---
+def authorized(headers, remote_addr):
+    """Profiles are readable with the secret, or from localhost when no secret is set."""
+    if PROFILE_SECRET:
+        return _has_secret(headers)
+    return remote_addr in ("127.0.0.1", "::1")
+
+
+def recent_profiles(limit=50):
+    """Newest saved profile summaries first."""
+    profiles = []
+    for path in _summaries()[:limit]:
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id):
+    """Path of a saved .prof file, or None for an unknown / malformed id."""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
@@ -0,0 +1,128 @@
+"""
+int8 vs fp32 WavLM parity report.
+
+Loads the classifier twice (fp32 and dynamic int8), scores every clip in a
+directory with both, and reports label agreement, per-class score drift,
+latency and weight size.
+
+Usage (from the server folder):
+    python quantize_parity.py --clips ./recordings
+    python quantize_parity.py --clips ./recordings --model ./wavlm_model --json parity.json
+    python quantize_parity.py --synthetic            # no recordings at hand
+
+Exits non-zero when label agreement falls below --min-agreement.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+from audio_clip import load_clip
+from model_loader import load_wavlm
+from voicing_agreement import AUDIO_EXTENSIONS, synthetic_clips
+
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH") or os.path.join(os.path.dirname(__file__), "wavlm_model")
+MAX_SAMPLES = 16000 * 3  # Same 3 s context as predict_batch
+
+
+def weight_megabytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return round(buffer.tell() / (1024 * 1024), 1)
+
+
+def score(feature_extractor, model, samples):
+    """Class probabilities for one clip (same preprocessing as predict_batch)."""
+    inputs = feature_extractor(
+        samples,
+        sampling_rate=16000,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+        max_length=MAX_SAMPLES,
+        return_attention_mask=True,
+    )
+    with torch.no_grad():
+        logits = model(**inputs).logits
+    return torch.nn.functional.softmax(logits, dim=-1)[0].numpy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare fp32 and int8 WavLM predictions.")
+    parser.add_argument("--clips", help="Directory of audio clips")
+    parser.add_argument("--synthetic", action="store_true", help="Include synthetic clips")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Model folder (default: MODEL_PATH or ./wavlm_model)")
+    parser.add_argument("--json", help="Write the full report to this path")
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="Minimum label agreement (default 0.95)")
+    args = parser.parse_args(argv)
+
+    torch.set_num_threads(1)
+
+    clips = synthetic_clips() if args.synthetic else {}
+    if args.clips:
+        for name in sorted(os.listdir(args.clips)):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                clips[name] = load_clip(os.path.join(args.clips, name)).samples
+    if not clips:
+        print("❌ No clips: pass --clips DIR and/or --synthetic")
+        return 2
+
+    print(f"📥 Loading fp32 and int8 models from {args.model}")
+    fe, fp32 = load_wavlm(args.model, quantize="")
+    _, int8 = load_wavlm(args.model, quantize="int8")
+    id2label = fp32.config.id2label
+
+    rows = []
+    timings = {"fp32": [], "int8": []}
+    for name, samples in clips.items():
+        probs = {}
+        for mode, model in (("fp32", fp32), ("int8", int8)):
+            t0 = time.perf_counter()
+            probs[mode] = score(fe, model, samples)
+            timings[mode].append((time.perf_counter() - t0) * 1000.0)
+        drift = np.abs(probs["fp32"] - probs["int8"])
+        row = {
+            "clip": name,
+            "fp32_label": id2label[int(np.argmax(probs["fp32"]))],
+            "int8_label": id2label[int(np.argmax(probs["int8"]))],
+            "fp32_score": round(float(np.max(probs["fp32"])), 4),
+            "int8_score": round(float(np.max(probs["int8"])), 4),
+            "max_drift": round(float(np.max(drift)), 4),
+        }
+        row["agrees"] = row["fp32_label"] == row["int8_label"]
+        rows.append(row)
+        print(f"{name:<32}{row['fp32_label']:>14}{row['int8_label']:>14}  drift {row['max_drift']:.4f}"
+              f"{'' if row['agrees'] else '  ❗'}")
+
+    agreement = float(np.mean([r["agrees"] for r in rows]))
+    summary = {
+        "clips": len(rows),
+        "label_agreement": round(agreement, 4),
+        "mean_max_drift": round(float(np.mean([r["max_drift"] for r in rows])), 4),
+        "worst_drift": round(float(np.max([r["max_drift"] for r in rows])), 4),
+        "fp32_ms_p50": round(float(np.median(timings["fp32"])), 1),
+        "int8_ms_p50": round(float(np.median(timings["int8"])), 1),
+        "fp32_weights_mb": weight_megabytes(fp32),
+        "int8_weights_mb": weight_megabytes(int8),
+    }
+    print(f"\n📊 {json.dumps(summary)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+
+    if agreement < args.min_agreement:
+        print(f"❌ Label agreement {agreement:.3f} below {args.min_agreement}")
+        return 1
+    print("✅ int8 matches fp32")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
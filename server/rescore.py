@@ -0,0 +1,350 @@
+"""
+Re-score an archive of recordings offline with the endpoint analyzers.
+
+Clips are sharded across worker processes; each worker runs chunks of clips
+through the /analyze/batch job (parallel decode, one batched WavLM pass,
+concurrent STT), so every result has the same shape as the HTTP response.
+The model is loaded once in the parent and shared with the forked workers.
+
+Input is a directory (every clip scored as --game) or a manifest:
+  JSONL: {"path": "a.m4a", "game": "snake", "targetPhoneme": "m", "tier": 2, "id": "..."}
+  CSV:   path,game,targetPhoneme,targetText,tier,...
+Relative paths are resolved against the manifest's folder.
+
+Output is JSONL (one row per clip, appended) or Parquet (a directory of part
+files; read it with pandas.read_parquet(dir)). The output is the checkpoint:
+with --resume, clips already in it are skipped.
+
+Usage (from the server folder):
+    python rescore.py --clips ./recordings --game analyze_audio --output scores.jsonl
+    python rescore.py --manifest sessions.jsonl --output scores.parquet --workers 8
+    python rescore.py --manifest sessions.jsonl --output scores.jsonl --resume
+    python rescore.py --manifest sessions.csv --output retuned.jsonl --env SPEECH_PROB_MIN=0.4 --env STT_TRANSPORT=fake
+"""
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_FLUSH_EVERY = 1000  # Parquet rows per part file
+AUDIO_EXTENSIONS = (".wav", ".m4a", ".mp3", ".webm", ".flac", ".ogg")
+RESERVED_FIELDS = ("path", "game", "id")
+
+
+# --- INPUT ---
+def clips_from_dir(root, game, params):
+    """One task per audio file under root; the id is the path relative to root."""
+    tasks = []
+    for folder, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                path = os.path.join(folder, name)
+                tasks.append({"id": os.path.relpath(path, root), "path": path, "game": game, **params})
+    return sorted(tasks, key=lambda task: task["id"])
+
+
+def clips_from_manifest(manifest, game, params):
+    """Tasks from a JSONL or CSV manifest (CSV values are strings; empty cells are dropped)."""
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding="utf-8", newline="") as f:
+        if manifest.lower().endswith(".csv"):
+            rows = [{k: v for k, v in row.items() if v not in ("", None)} for row in csv.DictReader(f)]
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    tasks = []
+    for n, row in enumerate(rows):
+        if "path" not in row:
+            raise ValueError(f"❌ Manifest row {n + 1} has no path")
+        path = row["path"] if os.path.isabs(row["path"]) else os.path.join(base, row["path"])
+        task = {**params, **row, "path": path, "game": row.get("game") or game}
+        task["id"] = str(row.get("id", row["path"]))
+        tasks.append(task)
+    return tasks
+
+
+def _parse_pairs(pairs, flag):
+    parsed = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition("=")
+        if not sep or not key:
+            raise ValueError(f"❌ {flag} expects KEY=VALUE, got {pair!r}")
+        parsed[key] = value
+    return parsed
+
+
+# --- OUTPUT ---
+class JsonlWriter:
+    """Appends one JSON row per clip; completed ids are read back for --resume."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def completed_ids(self):
+        if not os.path.exists(self.path):
+            return set()
+        done, good_bytes = set(), 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["id"])
+                except (ValueError, KeyError):
+                    break  # A row cut off by an interrupted run; it is dropped below
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+        return done
+
+    def write(self, rows):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ParquetWriter:
+    """
+    Buffers rows and writes them as part files in the output directory, each
+    written to a temp name then renamed, so a part is either complete or absent.
+    The nested endpoint response is kept as a JSON string column.
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow), or use a .jsonl output")
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self._rows = []
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".parquet"))
+
+    def completed_ids(self):
+        import pyarrow.parquet as pq
+
+        done = set()
+        for part in self._parts():
+            done.update(pq.read_table(part, columns=["id"]).column("id").to_pylist())
+        return done
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {
+            "id": [row["id"] for row in self._rows],
+            "path": [row["path"] for row in self._rows],
+            "game": [row["game"] for row in self._rows],
+            "status": pa.array([row["status"] for row in self._rows], type=pa.int32()),
+            "error": [row.get("error") for row in self._rows],
+            "result": [json.dumps(row["result"], ensure_ascii=False) if row.get("result") is not None else None
+                       for row in self._rows],
+        }
+        os.makedirs(self.path, exist_ok=True)
+        name = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        pq.write_table(pa.table(columns), tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, name))
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def open_writer(path, flush_every):
+    if path.lower().endswith(".jsonl"):
+        return JsonlWriter(path)
+    if path.lower().endswith(".parquet"):
+        return ParquetWriter(path, flush_every)
+    raise SystemExit("❌ --output must end in .jsonl or .parquet")
+
+
+# --- WORKERS ---
+_app = None
+
+
+def _init_worker(torch_threads):
+    """Forked workers inherit the loaded app; spawned ones import (and load) it here."""
+    global _app
+    import torch
+
+    torch.set_num_threads(torch_threads)
+    if _app is None:
+        import app
+
+        _app = app
+    _app.warm_stt_client()
+
+
+def score_chunk(tasks):
+    """Run one chunk of clips through the batch job; one output row per task."""
+    from werkzeug.datastructures import FileStorage, ImmutableMultiDict, MultiDict
+
+    from stage_runner import run_job
+
+    t0 = time.perf_counter()
+    # Every opened clip is closed when the chunk is done (archives can be larger than the fd limit)
+    with contextlib.ExitStack() as streams:
+        rows, items, uploads = [], [], MultiDict()
+        for n, task in enumerate(tasks):
+            field = f"clip{n}"
+            try:
+                stream = streams.enter_context(open(task["path"], "rb"))
+            except OSError as e:
+                rows.append({"id": task["id"], "path": task["path"], "game": task["game"], "status": 404, "error": str(e)})
+                continue
+            uploads.add(field, FileStorage(stream=stream, filename=os.path.basename(task["path"]), name=field))
+            items.append({**{k: v for k, v in task.items() if k not in RESERVED_FIELDS}, "id": task["id"],
+                          "game": task["game"], "file": field})
+
+        if items:
+            paths = {task["id"]: task["path"] for task in tasks}
+            form = ImmutableMultiDict({"items": json.dumps(items)})
+            rv = run_job(_app.analyze_batch(form, uploads))
+            body, status = _app._split_view_result(rv)
+            if status != 200:
+                # The whole chunk was rejected (e.g. more items than BATCH_MAX_CLIPS)
+                rows.extend({"id": item["id"], "path": paths[item["id"]], "game": item["game"], "status": status,
+                             "error": body.get("error")} for item in items)
+            else:
+                for result in body["results"]:
+                    row = {"id": result["id"], "path": paths[result["id"]], "game": result["game"],
+                           "status": result["status"], "result": result["body"]}
+                    if result["status"] >= 400:
+                        row["error"] = result["body"].get("error")
+                    rows.append(row)
+
+    elapsed_ms = round((time.perf_counter() - t0) * 1000.0 / max(1, len(tasks)), 1)
+    for row in rows:
+        row["elapsed_ms"] = elapsed_ms  # Chunk wall time per clip
+    return rows
+
+
+def _chunks(tasks, size):
+    for start in range(0, len(tasks), size):
+        yield tasks[start:start + size]
+
+
+def _eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score recordings offline with the endpoint analyzers.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clips", help="Directory of clips (scored recursively)")
+    source.add_argument("--manifest", help="JSONL or CSV manifest with a path column")
+    parser.add_argument("--output", required=True, help="scores.jsonl or scores.parquet (directory of parts)")
+    parser.add_argument("--game", default="analyze_audio",
+                        help="Game for directory clips and manifest rows without one (default analyze_audio)")
+    parser.add_argument("--param", action="append", metavar="KEY=VALUE",
+                        help="Form field for every clip, e.g. --param tier=2 (manifest columns win)")
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE",
+                        help="Environment override applied before the app loads, e.g. --env SPEECH_PROB_MIN=0.4")
+    parser.add_argument("--model", help="Model folder (sets MODEL_PATH)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: cores)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Clips per batch job")
+    parser.add_argument("--flush-every", type=int, default=DEFAULT_FLUSH_EVERY, help="Rows per Parquet part file")
+    parser.add_argument("--torch-threads", type=int, default=1, help="Intra-op threads per worker")
+    parser.add_argument("--resume", action="store_true", help="Skip clips already in --output")
+    parser.add_argument("--limit", type=int, help="Only score the first N pending clips")
+    args = parser.parse_args(argv)
+
+    try:
+        params = _parse_pairs(args.param, "--param")
+        env = _parse_pairs(args.env, "--env")
+        if args.clips:
+            tasks = clips_from_dir(args.clips, args.game, params)
+        else:
+            tasks = clips_from_manifest(args.manifest, args.game, params)
+    except (OSError, ValueError) as e:
+        print(e if str(e).startswith("❌") else f"❌ {e}")
+        return 2
+
+    ids = [task["id"] for task in tasks]
+    if len(set(ids)) != len(ids):
+        print("❌ Clip ids are not unique; add an id column to the manifest")
+        return 2
+
+    writer = open_writer(args.output, args.flush_every)
+    if os.path.exists(args.output) and not args.resume:
+        print(f"❌ {args.output} exists; pass --resume to continue it or choose another --output")
+        return 2
+    done = writer.completed_ids() if args.resume else set()
+    pending = [task for task in tasks if task["id"] not in done]
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    print(f"📋 {len(tasks)} clips, {len(done)} already scored, {len(pending)} to go")
+    if not pending:
+        return 0
+
+    # Load the model once in this process; forked workers share its pages
+    os.environ.update(env)
+    if args.model:
+        os.environ["MODEL_PATH"] = args.model
+    os.environ["STARTUP_MODE"] = "blocking"
+    os.environ["STT_WARMUP"] = "0"  # gRPC channels must not cross the fork; workers warm their own
+    os.environ.setdefault("MICROBATCH_ENABLED", "0")  # One job per worker: batching happens inside the chunk
+    use_fork = "fork" in multiprocessing.get_all_start_methods()
+    if use_fork:
+        global _app
+        import app
+
+        _app = app
+
+    # Chunks no larger than the batch endpoint accepts
+    chunk_size = max(1, min(args.chunk_size, int(os.environ.get("BATCH_MAX_CLIPS", "32"))))
+    chunks = list(_chunks(pending, chunk_size))
+    workers = max(1, min(args.workers, len(chunks)))
+    context = multiprocessing.get_context("fork" if use_fork else "spawn")
+
+    t0 = time.time()
+    scored, statuses = 0, {}
+    try:
+        with context.Pool(workers, initializer=_init_worker, initargs=(args.torch_threads,)) as pool:
+            print(f"🚀 Scoring with {workers} worker(s), {len(chunks)} chunk(s) of up to {chunk_size} clips")
+            for rows in pool.imap_unordered(score_chunk, chunks):
+                writer.write(rows)
+                scored += len(rows)
+                for row in rows:
+                    statuses[row["status"]] = statuses.get(row["status"], 0) + 1
+                rate = scored / max(1e-6, time.time() - t0)
+                print(f"📈 {scored}/{len(pending)} clips ({rate:.1f} clips/s, ETA {_eta((len(pending) - scored) / rate)})")
+    except KeyboardInterrupt:
+        print("⏹️ Interrupted; rerun with --resume to continue")
+        return 130
+    finally:
+        writer.close()
+
+    elapsed = time.time() - t0
+    print(f"✅ Scored {scored} clips in {elapsed:.1f}s → {args.output} (status counts: {statuses})")
+    return 0 if statuses.get(500, 0) == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
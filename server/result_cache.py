@@ -0,0 +1,156 @@
+import asyncio
+import copy
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from audio_clip import as_clip
+
+# ============================================================================
+# StamFree Backend - Content-Addressed Result Cache
+# ============================================================================
+# The app retries uploads on timeout (uploadAudioWithTimeout), so the same
+# recording can arrive several times, often while the first attempt is still
+# running. Results of WavLM, Google STT and the DSP analyzers are cached
+# under a hash of the decoded audio plus the model version / parameters:
+#   - bounded LRU (RESULT_CACHE_MAX_ENTRIES) with TTL expiry (RESULT_CACHE_TTL_S)
+#   - single-flight: concurrent callers with the same key wait for the one
+#     computation in progress instead of starting their own
+# Failures are never cached; every waiter sees the exception.
+# The cache is per process.
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", "600"))
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache with single-flight computation."""
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL_S, enabled=RESULT_CACHE_ENABLED):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+        # Stats
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    def _claim(self, key):
+        """("hit", value), ("leader", future) or ("follower", future) for a cache lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return "hit", entry[1]
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                self._misses += 1
+                return "leader", future
+            self._coalesced += 1
+            return "follower", future
+
+    def _store(self, key, future, value):
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        future.set_result(value)
+
+    def _fail(self, key, future, error):
+        with self._lock:
+            del self._in_flight[key]
+        future.set_exception(error)
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached value for `key`, or compute() it once.
+        Callers get their own copy, so mutating a result never touches the cache.
+        """
+        if not self.enabled:
+            return compute()
+
+        role, found = self._claim(key)
+        if role == "hit":
+            return copy.deepcopy(found)
+        if role == "follower":
+            return copy.deepcopy(found.result())
+
+        try:
+            value = compute()
+        except BaseException as e:
+            self._fail(key, found, e)
+            raise
+        self._store(key, found, value)
+        return copy.deepcopy(value)
+
+    async def get_or_compute_async(self, key, compute):
+        """get_or_compute() for a coroutine function; waiting on another caller doesn't block the event loop."""
+        if not self.enabled:
+            return await compute()
+
+        role, found = self._claim(key)
+        if role == "hit":
+            return copy.deepcopy(found)
+        if role == "follower":
+            return copy.deepcopy(await asyncio.wrap_future(found))
+
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._fail(key, found, e)
+            raise
+        self._store(key, found, value)
+        return copy.deepcopy(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "in_flight": len(self._in_flight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "hit_rate": round((self._hits + self._coalesced) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def cached_by_audio(cache, namespace, version=""):
+    """
+    Decorator for analyzers taking (audio_input, *params): results are keyed by
+    (namespace, version, audio hash, params). The wrapped function receives
+    the AudioClip, so a filepath is still decoded only once.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(audio_input, *args, **kwargs):
+            clip = as_clip(audio_input)
+            key = (namespace, version, clip.digest, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_compute(key, lambda: fn(clip, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,326 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+import profiling
+
+# ============================================================================
+# StamFree Backend - Concurrent Analyzer Stages
+# ============================================================================
+# Independent analyzers (WavLM, amplitude, pyin voicing, Google STT) used to
+# run one after another. run_stages() fans them out on a shared thread pool:
+# STT waits on the network, torch and numpy release the GIL for the heavy
+# math, so end-to-end latency becomes the slowest stage instead of the sum.
+#
+# An endpoint's work is a "job": a generator that yields {name: Stage} dicts
+# and is sent the StageResults back. run_job() drives it on the calling
+# thread (Flask); run_job_async() drives the same job on an event loop
+# (asgi.py): the code between yields runs on a bounded CPU pool and stages
+# with an async_fn (Google STT) are awaited without holding a thread.
+# Work handed to a pool runs in a copy of the caller's context, so stage
+# timings reach the request's metrics timer (see metrics.py) and a profiled
+# request is profiled on every thread it uses (see profiling.py).
+
+STAGE_WORKERS = int(os.environ.get("STAGE_WORKERS", "8"))
+ASYNC_CPU_WORKERS = int(os.environ.get("ASYNC_CPU_WORKERS", str(os.cpu_count() or 4)))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # Fork-safe: each worker process builds its own pool on first use
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+                _pool_pid = pid
+    return _pool
+
+
+def _in_context(pool, fn, *args, **kwargs):
+    """pool.submit() with the caller's contextvars (request metrics timer and profile)."""
+    return pool.submit(contextvars.copy_context().run, profiling.call, fn, *args, **kwargs)
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn in the background on the shared stage pool; returns a Future."""
+    return _in_context(_get_pool(), fn, *args, **kwargs)
+
+
+class Stage:
+    """One independent analyzer: fn() plus the value to use if it misses its deadline."""
+
+    def __init__(self, fn, timeout=None, fallback=None, async_fn=None):
+        self.fn = fn
+        self.timeout = timeout
+        self.fallback = fallback
+        self.async_fn = async_fn  # Coroutine function used instead of fn under run_stages_async
+
+
+class StageResults:
+    """Results, per-stage wall time (ms) and the names of stages that timed out."""
+
+    def __init__(self):
+        self.values = {}
+        self.timings_ms = {}
+        self.timed_out = []
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+
+def _timed(results, name, fn):
+    started = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        results.timings_ms[name] = round((time.perf_counter() - started) * 1000.0, 1)
+
+
+async def _timed_async(results, name, async_fn):
+    started = time.perf_counter()
+    try:
+        return await async_fn()
+    finally:
+        results.timings_ms[name] = round((time.perf_counter() - started) * 1000.0, 1)
+
+
+def run_stages(stages):
+    """
+    Run a dict of {name: Stage} concurrently.
+    Each stage is awaited up to its own timeout (seconds, measured from the
+    fan-out); a late stage keeps running in the background but the request
+    moves on with its fallback value. Exceptions propagate to the caller.
+    """
+    pool = _get_pool()
+    results = StageResults()
+    t0 = time.perf_counter()
+
+    futures = {name: _in_context(pool, _timed, results, name, stage.fn) for name, stage in stages.items()}
+
+    for name, future in futures.items():
+        stage = stages[name]
+        remaining = None
+        if stage.timeout is not None:
+            remaining = max(0.0, stage.timeout - (time.perf_counter() - t0))
+        try:
+            results.values[name] = future.result(timeout=remaining)
+        except FutureTimeout:
+            print(f"⏱️ Stage '{name}' exceeded {stage.timeout}s, using fallback")
+            results.values[name] = stage.fallback
+            results.timed_out.append(name)
+            results.timings_ms.setdefault(name, round((time.perf_counter() - t0) * 1000.0, 1))
+
+    return results
+
+
+async def run_stages_async(stages):
+    """run_stages() for the event loop: same deadlines, fallbacks and timings."""
+    pool = _get_pool()
+    results = StageResults()
+    t0 = time.perf_counter()
+
+    tasks = {}
+    for name, stage in stages.items():
+        if stage.async_fn is not None:
+            tasks[name] = asyncio.ensure_future(_timed_async(results, name, stage.async_fn))
+        else:
+            tasks[name] = asyncio.wrap_future(_in_context(pool, _timed, results, name, stage.fn))
+
+    for name, task in tasks.items():
+        stage = stages[name]
+        remaining = None
+        if stage.timeout is not None:
+            remaining = max(0.0, stage.timeout - (time.perf_counter() - t0))
+        try:
+            # shield: a late stage keeps running (and fills the result cache)
+            results.values[name] = await asyncio.wait_for(asyncio.shield(task), remaining)
+        except asyncio.TimeoutError:
+            print(f"⏱️ Stage '{name}' exceeded {stage.timeout}s, using fallback")
+            results.values[name] = stage.fallback
+            results.timed_out.append(name)
+            results.timings_ms.setdefault(name, round((time.perf_counter() - t0) * 1000.0, 1))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # Don't log it as unretrieved
+
+    return results
+
+
+# --- JOBS ---
+def _step(send, value):
+    """Advance a job: (True, result) once it returns, else (False, next stage dict)."""
+    t0 = time.perf_counter()
+    try:
+        return False, send(value)
+    except StopIteration as done:
+        if isinstance(value, StageResults):
+            # The step after the last stages applies the game rules
+            metrics.observe("scoring", time.perf_counter() - t0)
+        return True, done.value
+
+
+def run_job(job):
+    """
+    Drive a job on this thread. A job is the return value of an endpoint
+    function: either the result itself or a generator yielding stage dicts.
+    Stage errors are thrown into the generator, so its own except blocks apply.
+    """
+    if not inspect.isgenerator(job):
+        return job
+    send, value = job.send, None
+    while True:
+        finished, stages = _step(send, value)
+        if finished:
+            return stages
+        try:
+            send, value = job.send, run_stages(stages)
+        except Exception as e:
+            send, value = job.throw, e
+
+
+_cpu_pool = None
+_cpu_pool_pid = None
+
+
+def _get_cpu_pool():
+    global _cpu_pool, _cpu_pool_pid
+    pid = os.getpid()
+    if _cpu_pool is None or _cpu_pool_pid != pid:
+        with _pool_lock:
+            if _cpu_pool is None or _cpu_pool_pid != pid:
+                _cpu_pool = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="cpu")
+                _cpu_pool_pid = pid
+    return _cpu_pool
+
+
+async def run_cpu(fn, *args):
+    """Run fn(*args) on the bounded CPU pool without blocking the event loop."""
+    return await asyncio.wrap_future(_in_context(_get_cpu_pool(), fn, *args))
+
+
+async def run_job_async(job_fn, *args):
+    """
+    Drive job_fn(*args) on the event loop: every step between yields runs on
+    the CPU pool, and each yielded stage dict goes through run_stages_async.
+    """
+    job = await run_cpu(job_fn, *args)
+    if not inspect.isgenerator(job):
+        return job
+    send, value = job.send, None
+    while True:
+        finished, stages = await run_cpu(_step, send, value)
+        if finished:
+            return stages
+        try:
+            send, value = job.send, await run_stages_async(stages)
+        except Exception as e:
+            send, value = job.throw, e
+
+
+class _Failed:
+    """A stage's exception, held so it reaches only the job that yielded the stage."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _isolated(stage):
+    """The stage with exceptions returned as _Failed instead of raised."""
+    def fn():
+        try:
+            return stage.fn()
+        except Exception as e:
+            return _Failed(e)
+
+    async def async_fn():
+        try:
+            return await stage.async_fn()
+        except Exception as e:
+            return _Failed(e)
+
+    return Stage(fn, stage.timeout, stage.fallback, async_fn=async_fn if stage.async_fn is not None else None)
+
+
+def _start(job_factory):
+    """First step of a job: (job, finished, stages_or_result); an uncaught error is the result."""
+    try:
+        job = job_factory()
+        if not inspect.isgenerator(job):
+            return None, True, job
+        return (job, *_step(job.send, None))
+    except Exception as e:
+        return None, True, _Failed(e)
+
+
+def _advance(send, value):
+    try:
+        return _step(send, value)
+    except Exception as e:
+        return True, _Failed(e)
+
+
+def drive_jobs(job_factories):
+    """
+    Sub-job driver for a job that runs many jobs together (batch endpoint):
+        results = yield from drive_jobs([lambda: job(form, files), ...])
+    Job steps run concurrently as stages, and each round's stages from every
+    job are merged into one fan-out. A job that raises gets a _Failed result
+    (see failed_error) instead of failing the others.
+    """
+    results = [None] * len(job_factories)
+    jobs = {}
+    pending = {}  # index -> stage dict yielded by that job
+
+    started = yield {str(i): Stage(functools.partial(_start, factory)) for i, factory in enumerate(job_factories)}
+    for i in range(len(job_factories)):
+        job, finished, value = started[str(i)]
+        if finished:
+            results[i] = value
+        else:
+            jobs[i], pending[i] = job, value
+
+    while pending:
+        merged = yield {
+            f"{i}:{name}": _isolated(stage) for i, stages in pending.items() for name, stage in stages.items()
+        }
+
+        steps = {}
+        for i, stages in pending.items():
+            job_results = StageResults()
+            for name in stages:
+                key = f"{i}:{name}"
+                job_results.values[name] = merged.values[key]
+                if key in merged.timings_ms:
+                    job_results.timings_ms[name] = merged.timings_ms[key]
+                if key in merged.timed_out:
+                    job_results.timed_out.append(name)
+            failure = next((v for v in job_results.values.values() if isinstance(v, _Failed)), None)
+            if failure is not None:
+                steps[str(i)] = Stage(functools.partial(_advance, jobs[i].throw, failure.error))
+            else:
+                steps[str(i)] = Stage(functools.partial(_advance, jobs[i].send, job_results))
+
+        advanced = yield steps
+        pending = {}
+        for key, (finished, value) in advanced.values.items():
+            i = int(key)
+            if finished:
+                results[i] = value
+            else:
+                pending[i] = value
+
+    return results
+
+
+def failed_error(result):
+    """The exception if a drive_jobs result is a failure, else None."""
+    return result.error if isinstance(result, _Failed) else None
@@ -0,0 +1,76 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# ============================================================================
+# StamFree Backend - Startup Phases and Readiness
+# ============================================================================
+# Loading G2P, WavLM and the first inference used to happen on the import
+# thread, and the first real request paid the remaining JIT / first-call
+# costs. The tracker times each startup phase and gates readiness:
+#   /health/live   the process is up (fails only if startup itself failed)
+#   /health/ready  every phase, including warmup, has finished
+
+
+class StartupTracker:
+    """Phase timings and ready/failed state for one server process."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases_ms = {}
+        self.current = None
+        self.error = None
+        self.ready_at = None
+        self._ready = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed_ms):
+        with self._lock:
+            self.phases_ms[name] = round(elapsed_ms, 1)
+
+    @contextmanager
+    def phase(self, name):
+        """Time a startup phase: `with startup.phase("model"): ...`"""
+        self.current = name
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - t0) * 1000.0)
+
+    def mark_ready(self):
+        self.ready_at = time.time()
+        self._ready = True
+        self.current = None
+        self._done.set()
+        print(f"🚀 Ready in {time.time() - self.started:.1f}s ({self.phases_ms})")
+
+    def fail(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+        self._done.set()
+        print(f"❌ Startup failed during '{self.current}': {error}")
+
+    @property
+    def ready(self):
+        return self._ready
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def wait(self, timeout=None):
+        """Block until startup finished (or failed); returns True when ready."""
+        self._done.wait(timeout)
+        return self._ready
+
+    def status(self):
+        with self._lock:
+            phases = dict(self.phases_ms)
+        return {
+            "ready": self._ready,
+            "phase": self.current,
+            "phasesMs": phases,
+            "startupSec": round((self.ready_at or time.time()) - self.started, 2),
+            "error": self.error,
+        }
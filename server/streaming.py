@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from audio_clip import SAMPLE_RATE, AudioClip
+from clip_features import find_runs
+from voicing import yin_voiced_frames
+
+# ============================================================================
+# StamFree Backend - Streaming Analysis Sessions
+# ============================================================================
+# The app used to record the whole clip, upload it, then decode, run STT and
+# run WavLM. A streaming session receives 16 kHz PCM16 chunks while the child
+# is still speaking and keeps everything that can be done early up to date:
+#   - running RMS / voicing / sustained-run state (snake continuity rule)
+#   - Google streaming recognition fed chunk by chunk
+#   - the WavLM window, scored as soon as it fills
+# so that finishing only has to wait for the last STT result.
+
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+SUSTAIN_RMS = 0.02  # Same threshold as analyze_amplitude
+VOICING_RANGE = (80.0, 400.0)  # Same range as analyze_voicing_noise
+WINDOW_SAMPLES = 3 * SAMPLE_RATE  # predict_file only scores the first 3 s
+
+STREAM_MAX_SECONDS = float(os.environ.get("STREAM_MAX_SECONDS", "30"))
+STREAM_SESSION_TTL_S = float(os.environ.get("STREAM_SESSION_TTL_S", "120"))
+STREAM_MAX_SESSIONS = int(os.environ.get("STREAM_MAX_SESSIONS", "64"))
+
+
+class StreamingSession:
+    """Running analysis state for one streamed attempt."""
+
+    def __init__(self, params, stt_stream, submit_window):
+        # submit_window(samples) -> Future of predict_file-style (label, score)
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.created = self.last_seen = time.time()
+        self._lock = threading.Lock()
+        self._stt = stt_stream
+        self._submit_window = submit_window
+        self._window_future = None
+
+        self._buffer = np.zeros(int(STREAM_MAX_SECONDS * SAMPLE_RATE), dtype=np.float32)
+        self._n = 0
+        self._odd_byte = b""
+
+        # Frame-level running state (non-centered frames as audio arrives)
+        self._next_frame = 0
+        self._frames = 0
+        self._voiced_frames = 0
+        self._current_run = 0
+        self._max_run = 0
+        self._last_rms = 0.0
+
+    @property
+    def samples(self):
+        return self._buffer[:self._n]
+
+    def feed(self, pcm_bytes):
+        """Append a PCM16 little-endian chunk and update the running state."""
+        with self._lock:
+            self.last_seen = time.time()
+            data = self._odd_byte + pcm_bytes
+            if len(data) % 2:
+                data, self._odd_byte = data[:-1], data[-1:]
+            else:
+                self._odd_byte = b""
+
+            chunk = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+            room = len(self._buffer) - self._n
+            if len(chunk) > room:
+                raise ValueError(f"Stream exceeds {STREAM_MAX_SECONDS:.0f}s limit")
+            self._buffer[self._n:self._n + len(chunk)] = chunk
+            self._n += len(chunk)
+            if self._stt is not None and data:
+                self._stt.feed(data)
+
+            self._update_frames()
+
+            # Score the WavLM window as soon as it is full
+            if self._window_future is None and self._n >= WINDOW_SAMPLES:
+                self._window_future = self._submit_window(self._buffer[:WINDOW_SAMPLES].copy())
+
+            return self.state()
+
+    def _update_frames(self):
+        available = self._n - self._next_frame
+        if available < FRAME_LENGTH:
+            return
+        n_new = 1 + (available - FRAME_LENGTH) // HOP_LENGTH
+        tail = self._buffer[self._next_frame:self._n]
+        frames = np.lib.stride_tricks.as_strided(
+            tail, shape=(n_new, FRAME_LENGTH), strides=(tail.strides[0] * HOP_LENGTH, tail.strides[0])
+        )
+        self._next_frame += n_new * HOP_LENGTH
+
+        rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+        voiced = yin_voiced_frames(frames, SAMPLE_RATE, *VOICING_RANGE)
+        self._frames += n_new
+        self._voiced_frames += int(np.sum(voiced))
+        self._last_rms = float(rms[-1])
+
+        # Sustained runs, carrying the open run across chunks
+        starts, ends = find_runs(rms > SUSTAIN_RMS)
+        if len(starts) == 0:
+            self._current_run = 0
+            return
+        lengths = ends - starts
+        if starts[0] == 0:
+            lengths[0] += self._current_run
+        self._max_run = max(self._max_run, int(np.max(lengths)))
+        self._current_run = int(lengths[-1]) if ends[-1] == n_new else 0
+
+    def state(self):
+        frame_duration = HOP_LENGTH / float(SAMPLE_RATE)
+        return {
+            "receivedSec": round(self._n / float(SAMPLE_RATE), 2),
+            "sustainedSec": round(self._max_run * frame_duration, 2),
+            "currentRunSec": round(self._current_run * frame_duration, 2),
+            "voicedRatio": round(self._voiced_frames / self._frames, 3) if self._frames else 0.0,
+            "rms": round(self._last_rms, 4),
+            "windowScored": self._window_future is not None,
+        }
+
+    def finish(self, stt_timeout=None, wavlm_timeout=None):
+        """
+        Close the stream and collect the early results.
+        Returns: (clip, wavlm_result, transcript); a result is None if it failed or timed out.
+        """
+        with self._lock:
+            clip = AudioClip(self.samples.copy())
+            if self._window_future is None and self._n > 0:
+                self._window_future = self._submit_window(clip.samples[:WINDOW_SAMPLES])
+
+        transcript = None
+        if self._stt is not None:
+            try:
+                transcript = self._stt.finish(timeout=stt_timeout)
+            except Exception as e:
+                print(f"⚠️ Streaming STT failed: {e}")
+
+        wavlm_result = None
+        if self._window_future is not None:
+            try:
+                wavlm_result = self._window_future.result(timeout=wavlm_timeout)
+            except Exception as e:
+                print(f"⚠️ Streaming WavLM failed: {e}")
+
+        return clip, wavlm_result, transcript
+
+    def close(self):
+        """Abandon the session: abort its STT stream and drop its audio (expiry, 413)."""
+        with self._lock:
+            stt, self._stt = self._stt, None
+            if self._window_future is not None:
+                self._window_future.cancel()
+            self._buffer = np.zeros(0, dtype=np.float32)
+            self._n = 0
+        if stt is not None:
+            try:
+                stt.abort()
+            except Exception as e:
+                print(f"⚠️ Could not abort streaming STT: {e}")
+
+
+class SessionRegistry:
+    """In-process session table with idle expiry (streaming needs sticky routing)."""
+
+    def __init__(self, ttl=STREAM_SESSION_TTL_S, max_sessions=STREAM_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        """Drop idle sessions (caller holds the lock); returns them for close()."""
+        now = time.time()
+        expired = [sid for sid, s in self._sessions.items() if now - s.last_seen > self.ttl]
+        return [self._sessions.pop(sid) for sid in expired]
+
+    @staticmethod
+    def _close(sessions):
+        for session in sessions:
+            session.close()
+
+    def add(self, session):
+        with self._lock:
+            expired = self._expire()
+            added = len(self._sessions) < self.max_sessions
+            if added:
+                self._sessions[session.id] = session
+        self._close(expired)
+        return added
+
+    def get(self, sid):
+        with self._lock:
+            expired = self._expire()
+            session = self._sessions.get(sid)
+        self._close(expired)
+        return session
+
+    def pop(self, sid):
+        with self._lock:
+            return self._sessions.pop(sid, None)
+
+    def discard(self, sid):
+        """Remove and close a session that will not be finished."""
+        session = self.pop(sid)
+        if session is not None:
+            session.close()
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,319 @@
+import asyncio
+import io
+import itertools
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+# ============================================================================
+# StamFree Backend - Speech-to-Text Transport
+# ============================================================================
+# get_google_transcript used to build a new speech.SpeechClient() per call
+# (credentials, gRPC channel and TLS handshake on the hot path). The Google
+# transport keeps a small per-process pool of clients that are created lazily
+# after the worker forks, with an RPC timeout and retries on transient errors.
+# STT_TRANSPORT=fake swaps in a local recognizer for tests and benchmarks.
+# recognize_async() is the same call on the asyncio gRPC client (asgi.py).
+
+STT_TRANSPORT = os.environ.get("STT_TRANSPORT", "google")  # "google" | "fake"
+STT_POOL_SIZE = int(os.environ.get("STT_POOL_SIZE", "2"))
+STT_RPC_TIMEOUT_S = float(os.environ.get("STT_RPC_TIMEOUT_S", "6"))
+STT_MAX_RETRIES = int(os.environ.get("STT_MAX_RETRIES", "2"))
+STT_RETRY_BACKOFF_S = float(os.environ.get("STT_RETRY_BACKOFF_S", "0.2"))
+STT_LANGUAGE = os.environ.get("STT_LANGUAGE", "en-US")
+STREAM_REQUEST_BYTES = 16000  # Keep each streaming request well under the API's per-message limit
+
+
+def _parse_results(results):
+    """Google recognition results -> (full_text, words) with word-level timestamps."""
+    words = []
+    full_text = ""
+    for result in results:
+        full_text += result.alternatives[0].transcript + " "
+        for w in result.alternatives[0].words:
+            words.append(
+                {
+                    "word": w.word,
+                    "start": w.start_time.total_seconds(),
+                    "end": w.end_time.total_seconds(),
+                    "confidence": w.confidence,
+                }
+            )
+    return full_text.strip(), words
+
+
+def pcm16_to_wav(pcm_bytes, sample_rate=16000):
+    """Wrap raw 16-bit little-endian mono PCM in a WAV container."""
+    wav_buffer = io.BytesIO()
+    sf.write(wav_buffer, np.frombuffer(pcm_bytes, dtype="<i2"), sample_rate, format="WAV", subtype="PCM_16")
+    return wav_buffer.getvalue()
+
+
+class GoogleSpeechTransport:
+    """Pooled Google Cloud Speech clients, one pool per process."""
+
+    def __init__(self, pool_size=STT_POOL_SIZE, timeout=STT_RPC_TIMEOUT_S,
+                 max_retries=STT_MAX_RETRIES, backoff=STT_RETRY_BACKOFF_S, language=STT_LANGUAGE):
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.language = language
+        self._lock = threading.Lock()
+        self._clients = []
+        self._pid = None
+        self._next = itertools.count()
+        self._async_clients = []
+        self._async_loop = None
+
+    def reset(self):
+        """Drop clients (gRPC channels must not cross a fork)."""
+        with self._lock:
+            self._clients = []
+            self._pid = None
+            self._async_clients = []
+            self._async_loop = None
+
+    def _client(self):
+        pid = os.getpid()
+        if self._pid != pid or not self._clients:
+            with self._lock:
+                if self._pid != pid or not self._clients:
+                    from google.cloud import speech
+                    self._clients = [speech.SpeechClient() for _ in range(self.pool_size)]
+                    self._pid = pid
+        return self._clients[next(self._next) % len(self._clients)]
+
+    def _async_client(self):
+        # grpc.aio channels belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop or not self._async_clients:
+            from google.cloud import speech
+            self._async_clients = [speech.SpeechAsyncClient() for _ in range(self.pool_size)]
+            self._async_loop = loop
+        return self._async_clients[next(self._next) % len(self._async_clients)]
+
+    def warm(self):
+        """Import the Google client library and open the pool (startup warmup)."""
+        self._client()
+
+    def _transient_errors(self):
+        from google.api_core import exceptions as gexc
+        return (gexc.ServiceUnavailable, gexc.InternalServerError, gexc.DeadlineExceeded)
+
+    def recognize(self, wav_bytes, sample_rate=16000):
+        """Returns (full_text, words) with word-level timestamps."""
+        from google.cloud import speech
+
+        audio_file = speech.RecognitionAudio(content=wav_bytes)
+        config = self._recognition_config(sample_rate)
+
+        transient = self._transient_errors()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._client().recognize(config=config, audio=audio_file, timeout=self.timeout)
+                break
+            except transient as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"⚠️ STT transient error ({type(e).__name__}), retry {attempt + 1}/{self.max_retries}")
+                time.sleep(self.backoff * (2 ** attempt))
+
+        return _parse_results(response.results)
+
+    async def recognize_async(self, wav_bytes, sample_rate=16000):
+        """recognize() without holding a thread while the RPC is in flight."""
+        from google.cloud import speech
+
+        audio_file = speech.RecognitionAudio(content=wav_bytes)
+        config = self._recognition_config(sample_rate)
+
+        transient = self._transient_errors()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._async_client().recognize(config=config, audio=audio_file, timeout=self.timeout)
+                break
+            except transient as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"⚠️ STT transient error ({type(e).__name__}), retry {attempt + 1}/{self.max_retries}")
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+        return _parse_results(response.results)
+
+    def _recognition_config(self, sample_rate):
+        from google.cloud import speech
+        return speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=sample_rate,
+            language_code=self.language,
+            enable_word_time_offsets=True,
+            enable_word_confidence=True,
+        )
+
+    def stream(self, sample_rate=16000):
+        """Start a streaming recognition fed with raw PCM16 chunks."""
+        return GoogleStreamingRecognition(self._client(), self._recognition_config(sample_rate))
+
+
+class GoogleStreamingRecognition:
+    """
+    One streaming_recognize call running on a background thread.
+    feed() queues PCM16 bytes as they arrive; finish() closes the request
+    stream and returns the final (full_text, words); abort() ends an
+    abandoned stream without waiting for its results.
+    """
+
+    def __init__(self, client, recognition_config):
+        from google.cloud import speech
+
+        self._speech = speech
+        self._client = client
+        self._config = speech.StreamingRecognitionConfig(config=recognition_config, interim_results=False)
+        self._chunks = queue.Queue()
+        self._results = []
+        self._error = None
+        self._responses = None
+        self._aborted = False
+        self._thread = threading.Thread(target=self._run, name="stt-stream", daemon=True)
+        self._thread.start()
+
+    def _requests(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return
+            yield self._speech.StreamingRecognizeRequest(audio_content=chunk)
+
+    def _run(self):
+        try:
+            self._responses = self._client.streaming_recognize(config=self._config, requests=self._requests())
+            if self._aborted:
+                self._responses.cancel()  # abort() ran before the call existed
+            for response in self._responses:
+                self._results.extend(r for r in response.results if r.is_final)
+        except Exception as e:
+            if not self._aborted:
+                self._error = e
+
+    def feed(self, pcm_bytes):
+        for start in range(0, len(pcm_bytes), STREAM_REQUEST_BYTES):
+            self._chunks.put(pcm_bytes[start:start + STREAM_REQUEST_BYTES])
+
+    def finish(self, timeout=None):
+        self._chunks.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError("streaming recognition did not finish in time")
+        if self._error is not None:
+            raise self._error
+        return _parse_results(self._results)
+
+    def abort(self):
+        """End the request stream and cancel the RPC (expired or rejected session)."""
+        self._aborted = True
+        self._chunks.put(None)
+        if self._responses is not None:
+            self._responses.cancel()
+
+
+class FakeSpeechTransport:
+    """
+    Local stand-in recognizer for tests and benchmarks.
+    Returns a fixed transcript (or recognizer(wav_bytes) -> text) with words
+    spread evenly over the clip, after an optional simulated latency.
+    """
+
+    def __init__(self, transcript="", latency_ms=0.0, confidence=0.9, recognizer=None):
+        self.transcript = transcript
+        self.latency_ms = latency_ms
+        self.confidence = confidence
+        self.recognizer = recognizer
+
+    def warm(self):
+        pass
+
+    def recognize(self, wav_bytes, sample_rate=16000):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return self._words(wav_bytes)
+
+    async def recognize_async(self, wav_bytes, sample_rate=16000):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        return self._words(wav_bytes)
+
+    def _words(self, wav_bytes):
+        text = self.recognizer(wav_bytes) if self.recognizer else self.transcript
+        tokens = text.split()
+        if not tokens:
+            return "", []
+
+        duration = sf.info(io.BytesIO(wav_bytes)).duration
+        step = duration / len(tokens)
+        words = [
+            {
+                "word": token,
+                "start": round(i * step, 3),
+                "end": round((i + 1) * step, 3),
+                "confidence": self.confidence,
+            }
+            for i, token in enumerate(tokens)
+        ]
+        return " ".join(tokens), words
+
+    def stream(self, sample_rate=16000):
+        return FakeStreamingRecognition(self, sample_rate)
+
+
+class FakeStreamingRecognition:
+    """Buffers streamed PCM16 and recognizes it in one go on finish()."""
+
+    def __init__(self, transport, sample_rate):
+        self._transport = transport
+        self._sample_rate = sample_rate
+        self._pcm = bytearray()
+
+    def feed(self, pcm_bytes):
+        self._pcm.extend(pcm_bytes)
+
+    def finish(self, timeout=None):
+        return self._transport.recognize(pcm16_to_wav(bytes(self._pcm), self._sample_rate), self._sample_rate)
+
+    def abort(self):
+        self._pcm = bytearray()
+
+
+def _default_transport():
+    if STT_TRANSPORT == "fake":
+        return FakeSpeechTransport(
+            transcript=os.environ.get("STT_FAKE_TRANSCRIPT", ""),
+            latency_ms=float(os.environ.get("STT_FAKE_LATENCY_MS", "0")),
+        )
+    return GoogleSpeechTransport()
+
+
+_transport = _default_transport()
+
+
+def get_transport():
+    return _transport
+
+
+def set_transport(transport):
+    """Swap the process-wide transport (tests, benchmarks)."""
+    global _transport
+    _transport = transport
+
+
+def _reset_after_fork():
+    if hasattr(_transport, "reset"):
+        _transport.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
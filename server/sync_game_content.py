@@ -0,0 +1,66 @@
+"""
+Regenerate game_content.json from the Firestore seed script.
+
+The server precomputes phonemes for every snake target, turtle sentence and
+tapping word at startup (see phonemes.py). The content itself lives in
+scripts/seed-all-content.ts; this copies the fields the server needs.
+
+Usage (from the server folder):
+    python sync_game_content.py
+    python sync_game_content.py --seed ../scripts/seed-all-content.ts --output game_content.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SEED = os.path.join(HERE, "..", "scripts", "seed-all-content.ts")
+DEFAULT_OUTPUT = os.path.join(HERE, "game_content.json")
+
+ITEM_RE = re.compile(r"\{\s*id:\s*'([^']+)'(.*?)\}", re.S)
+FIELD_RE = r"{}:\s*'([^']*)'"
+
+
+def _pool(source, name):
+    """Source text of `const <name>... = [ ... ];`."""
+    match = re.search(rf"const {name}\b[^=]*=\s*\[(.*?)\n\];", source, re.S)
+    if not match:
+        raise ValueError(f"❌ {name} not found in seed script")
+    return match.group(1)
+
+
+def _field(body, field):
+    match = re.search(FIELD_RE.format(field), body)
+    return match.group(1) if match else None
+
+
+def parse_seed(source):
+    snake = {}
+    for item_id, body in ITEM_RE.findall(_pool(source, "snakePool")):
+        snake[item_id] = _field(body, "phoneme")
+
+    turtle = {item_id: _field(body, "text") for item_id, body in ITEM_RE.findall(_pool(source, "turtlePool"))}
+    tapping = {item_id: _field(body, "text") for item_id, body in ITEM_RE.findall(_pool(source, "tappingPool"))}
+    return {"snake": snake, "turtle": turtle, "tapping": tapping}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy game content from the seed script for the server.")
+    parser.add_argument("--seed", default=DEFAULT_SEED)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+
+    with open(args.seed, encoding="utf-8") as f:
+        content = parse_seed(f.read())
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(content, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"✅ Wrote {args.output} ({', '.join(f'{k}: {len(v)}' for k, v in content.items())})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Tests import the server modules the way app.py does (flat, from the server folder)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STT_TRANSPORT", "fake")
+
+MODEL_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wavlm_model")
+
+
+@pytest.fixture(scope="session")
+def tiny_wavlm():
+    """(feature_extractor, model): random small WavLM with the checkpoint's architecture (group-norm conv encoder)."""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    with open(os.path.join(MODEL_CONFIG, "config.json")) as f:
+        config = json.load(f)
+    config.update(
+        hidden_size=32, num_hidden_layers=3, num_attention_heads=2, intermediate_size=64,
+        conv_dim=[32] * len(config["conv_dim"]), classifier_proj_size=16, num_conv_pos_embeddings=16,
+    )
+    torch.manual_seed(0)
+    model = transformers.WavLMForSequenceClassification(transformers.WavLMConfig(**config)).eval()
+    return transformers.AutoFeatureExtractor.from_pretrained(MODEL_CONFIG), model
+
+
+def wavlm_inputs(feature_extractor, batch):
+    """Same preprocessing as app._batch_probs."""
+    return feature_extractor(
+        batch, sampling_rate=16000, return_tensors="pt", padding=True,
+        truncation=True, max_length=16000 * 3, return_attention_mask=True,
+    )
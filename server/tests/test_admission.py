@@ -0,0 +1,89 @@
+"""Usage (from the server folder): python -m pytest tests/test_admission.py"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import admission
+
+
+def test_priority_order():
+    gate = admission.Gate("t", 1)
+    gate.acquire()
+    order = []
+
+    def waiter(priority):
+        gate.acquire(priority)
+        order.append(priority)
+        gate.release()
+
+    threads = []
+    for priority in (2, 0, 1):
+        threads.append(threading.Thread(target=waiter, args=(priority,)))
+        threads[-1].start()
+        time.sleep(0.05)  # Queue in this order
+    gate.release()
+    for thread in threads:
+        thread.join(2)
+    assert order == [0, 1, 2]
+
+
+def test_full_queue_rejects_at_once():
+    gate = admission.Gate("t", 1, max_queue=0)
+    gate.acquire()
+    with pytest.raises(admission.Overloaded) as error:
+        gate.acquire()
+    assert error.value.reason == "queue_full"
+    assert error.value.retry_after >= 1
+
+
+def test_wait_timeout_leaves_queue():
+    gate = admission.Gate("t", 1, max_queue=1, max_wait=0.05)
+    gate.acquire()
+    with pytest.raises(admission.Overloaded) as error:
+        gate.acquire()
+    assert error.value.reason == "wait_timeout"
+    gate.release()
+    assert gate.stats()["inUse"] == 0
+    assert gate.stats()["queued"] == 0
+
+
+def test_cancelled_async_waiter_does_not_leak_slot():
+    gate = admission.Gate("t", 1, max_queue=4, max_wait=5)
+
+    async def main():
+        await gate.acquire_async()
+        queued = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        gate.release()
+
+    asyncio.run(main())
+    stats = gate.stats()
+    assert stats["inUse"] == 0 and stats["queued"] == 0
+    assert gate.acquire() >= 0  # Slot still available
+
+
+def test_cancelled_after_grant_returns_slot():
+    gate = admission.Gate("t", 1, max_queue=4, max_wait=5)
+
+    async def main():
+        await gate.acquire_async()
+        queued = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        gate.release()  # Hands the slot to the queued waiter...
+        queued.cancel()  # ...which is cancelled before it resumes
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+    asyncio.run(main())
+    assert gate.stats()["inUse"] == 0
+
+
+def test_admitted_sets_priority():
+    with admission.admitted("analyze_balloon"):
+        assert admission.current_priority() == admission.ENDPOINT_PRIORITY["analyze_balloon"]
+    assert admission.current_priority() == admission.DEFAULT_PRIORITY
@@ -0,0 +1,71 @@
+"""Usage (from the server folder): python -m pytest tests/test_audio_decoders.py"""
+import io
+import os
+import stat
+import sys
+import types
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import audio_decoders
+import metrics
+from audio_decoders import SPOOL_METRIC, ClipInfo
+
+# Stand-in for the ffmpeg CLI: seeks the -i file like a moov-at-end MP4 needs,
+# and answers with its size as one f32le sample
+FAKE_FFMPEG = f"""#!{sys.executable}
+import struct, sys
+with open(sys.argv[sys.argv.index("-i") + 1], "rb") as f:
+    f.seek(0, 2)
+    sys.stdout.buffer.write(struct.pack("<f", f.tell()))
+"""
+
+
+def spooled(decoder, kind):
+    return metrics.registry.snapshot().get((SPOOL_METRIC, (decoder, kind)), [0])[0]
+
+
+@pytest.fixture
+def no_temp_files(monkeypatch):
+    if not hasattr(os, "memfd_create"):
+        pytest.skip("memfd needs Linux")
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("decoder wrote a temp file")
+
+    monkeypatch.setattr(audio_decoders, "tempfile", types.SimpleNamespace(NamedTemporaryFile=refuse))
+
+
+def test_ffmpeg_seeks_a_memfd_for_moov_at_end(tmp_path, monkeypatch, no_temp_files):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(audio_decoders, "FFMPEG_BIN", str(ffmpeg))
+
+    before = spooled("ffmpeg", "memfd")
+    upload = io.BytesIO(b"\0" * 1234)
+    audio = audio_decoders._decode_ffmpeg(upload, ClipInfo(container="mp4", streamable=False), "fast")
+
+    assert audio.tolist() == [1234.0]
+    assert spooled("ffmpeg", "memfd") == before + 1
+
+
+def test_librosa_reads_a_memfd(no_temp_files):
+    pytest.importorskip("librosa")
+    samples = np.sin(np.linspace(0, 100, 16000)).astype(np.float32)
+    upload = io.BytesIO()
+    sf.write(upload, samples, 16000, format="WAV", subtype="FLOAT")
+    upload.seek(0)
+
+    before = spooled("librosa", "memfd")
+    audio = audio_decoders._decode_librosa(upload, ClipInfo(container="wav"), "high")
+
+    np.testing.assert_allclose(audio, samples, atol=1e-6)
+    assert spooled("librosa", "memfd") == before + 1
+
+
+def test_counter_rendered():
+    metrics.count(SPOOL_METRIC, "ffmpeg", "tempfile")
+    assert f'{SPOOL_METRIC}{{decoder="ffmpeg",kind="tempfile"}}' in metrics.render()
@@ -0,0 +1,82 @@
+"""Usage (from the server folder): python -m pytest tests/test_batching.py"""
+import numpy as np
+import pytest
+
+from conftest import wavlm_inputs
+from inference_scheduler import InferenceScheduler, equal_length_batches
+
+PARITY_TOLERANCE = 1e-5  # Max absolute difference per class probability
+
+
+def test_equal_length_batches():
+    segments = [np.zeros(n) for n in (10, 20, 10, 20, 10, 30)]
+    batches = list(equal_length_batches(segments, 2))
+    assert batches == [[0, 2], [4], [1, 3], [5]]
+
+
+def test_scheduler_batches_only_equal_lengths():
+    batches = []
+
+    def run_batch(segments):
+        batches.append([len(s) for s in segments])
+        return [(len(s), 1.0, {}) for s in segments]
+
+    scheduler = InferenceScheduler(run_batch, max_batch_size=8, max_wait_ms=50)
+    lengths = [100, 200, 100, 200, 300]
+    results = scheduler.predict_many([np.zeros(n) for n in lengths])
+    assert [label for label, *_ in results] == lengths
+    assert all(len(set(batch)) == 1 for batch in batches)
+
+
+@pytest.fixture
+def wavlm_probs(tiny_wavlm):
+    import torch
+
+    feature_extractor, model = tiny_wavlm
+    assert model.config.feat_extract_norm == "group"
+
+    def probs(batch):
+        with torch.no_grad():
+            return torch.nn.functional.softmax(model(**wavlm_inputs(feature_extractor, batch)).logits, dim=-1).numpy()
+
+    return probs
+
+
+def test_batched_matches_unbatched(wavlm_probs):
+    rng = np.random.default_rng(0)
+    segments = [rng.normal(0, 0.1, n).astype(np.float32) for n in (16000, 24000, 16000, 24000, 16000)]
+
+    alone = np.stack([wavlm_probs([s])[0] for s in segments])
+    batched = np.zeros_like(alone)
+    for batch_idx in equal_length_batches(segments, 8):
+        batched[batch_idx] = wavlm_probs([segments[i] for i in batch_idx])
+
+    np.testing.assert_allclose(batched, alone, rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_scheduler_result_does_not_depend_on_batch_mates():
+    # A run_batch that leaks batch-mates into each result: the mean length of the batch
+    def run_batch(segments):
+        mean = sum(len(s) for s in segments) / len(segments)
+        return [("label", mean, {}) for _ in segments]
+
+    scheduler = InferenceScheduler(run_batch, max_batch_size=8, max_wait_ms=50)
+    clip = np.zeros(100)
+    alone = scheduler.predict(clip)
+    with_mates = scheduler.predict_many([clip, np.zeros(300), np.zeros(50)])[0]
+    assert with_mates == alone  # Safe to cache under the clip's own digest
+
+
+def test_scheduler_workers_run_batches_in_parallel():
+    import threading
+
+    both_running = threading.Barrier(2, timeout=5)
+
+    def run_batch(segments):
+        both_running.wait()  # Fails unless two batches are in flight at once
+        return [(len(s), 1.0, {}) for s in segments]
+
+    scheduler = InferenceScheduler(run_batch, max_batch_size=1, max_wait_ms=0, workers=2)
+    results = scheduler.predict_many([np.zeros(100), np.zeros(200)])
+    assert [label for label, *_ in results] == [100, 200]
+    assert scheduler.stats()["workers"] == 2
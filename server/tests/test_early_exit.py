@@ -0,0 +1,54 @@
+"""Usage (from the server folder): python -m pytest tests/test_early_exit.py"""
+import numpy as np
+import pytest
+
+from conftest import wavlm_inputs
+
+torch = pytest.importorskip("torch")
+
+from early_exit import EarlyExitWavLM, ExitHead, encoder_layers, masked_mean  # noqa: E402
+
+PARITY_TOLERANCE = 1e-5
+
+
+@pytest.fixture
+def clips():
+    rng = np.random.default_rng(3)
+    return [rng.normal(0, 0.1, 16000).astype(np.float32) * scale for scale in (0.2, 1.0, 3.0, 0.5, 2.0, 1.5)]
+
+
+def _heads(model):
+    torch.manual_seed(1)
+    return {
+        layer: ExitHead(model.config.hidden_size, model.config.num_labels, temperature=0.05).eval()
+        for layer in (1, 2)
+    }
+
+
+def test_exit_is_decided_per_clip(tiny_wavlm, clips):
+    feature_extractor, model = tiny_wavlm
+    heads = _heads(model)
+
+    # Threshold between the clips' layer-1 confidences, so some exit there and some do not
+    with torch.no_grad():
+        confidences = []
+        for clip in clips:
+            inputs = wavlm_inputs(feature_extractor, [clip])
+            _, hidden_states, frame_mask = next(encoder_layers(model, inputs["input_values"], inputs["attention_mask"]))
+            confidences.append(float(torch.softmax(heads[1](masked_mean(hidden_states, frame_mask)), dim=-1).max()))
+    threshold = float(np.median(confidences))
+    early_exit = EarlyExitWavLM(model, heads, mode="confidence", threshold=threshold)
+
+    alone = []
+    for clip in clips:
+        inputs = wavlm_inputs(feature_extractor, [clip])
+        probs, layers = early_exit(inputs["input_values"], inputs["attention_mask"])
+        alone.append((probs[0].numpy(), layers[0]))
+
+    inputs = wavlm_inputs(feature_extractor, clips)
+    probs, layers = early_exit(inputs["input_values"], inputs["attention_mask"])
+
+    assert len({layer for _, layer in alone}) > 1  # A mixed batch
+    assert layers == [layer for _, layer in alone]
+    np.testing.assert_allclose(probs.numpy(), np.stack([p for p, _ in alone]), rtol=0, atol=PARITY_TOLERANCE)
+    assert sum(early_exit.stats()["exit_layer_histogram"].values()) == 2 * len(clips)
@@ -0,0 +1,25 @@
+"""Usage (from the server folder): python -m pytest tests/test_latency_budget.py"""
+import latency_budget
+
+
+def _budget(headers, endpoint):
+    budget, token = latency_budget.start_request(headers, endpoint)
+    latency_budget.finish_request(token)
+    return budget
+
+
+def test_turtle_keeps_stage_timeout_without_header():
+    budget = _budget({}, "analyze_turtle")
+    assert budget.total_s is None
+    assert budget.timeout_for("stt", 8.0) == 8.0
+
+
+def test_header_budget_caps_stage_timeout():
+    budget = _budget({latency_budget.LATENCY_BUDGET_HEADER: "1000"}, "analyze_turtle")
+    assert 0 < budget.timeout_for("stt", 8.0) <= 0.75
+    assert budget.timeout_for("stt", 0.1) == 0.1
+
+
+def test_malformed_header_uses_endpoint_default():
+    budget = _budget({latency_budget.LATENCY_BUDGET_HEADER: "soon"}, "analyze_snake")
+    assert budget.total_s == latency_budget.LATENCY_BUDGET_MS / 1000.0
@@ -0,0 +1,51 @@
+"""Usage (from the server folder): python -m pytest tests/test_model_loader.py"""
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import MODEL_CONFIG
+from model_loader import OnnxConfig, OnnxFeatureExtractor
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("do_normalize", [False, True])
+def test_onnx_feature_extractor_matches_transformers(tmp_path, do_normalize):
+    transformers = pytest.importorskip("transformers")
+    with open(os.path.join(MODEL_CONFIG, "preprocessor_config.json")) as f:
+        config = json.load(f)
+    config["do_normalize"] = do_normalize
+    (tmp_path / "preprocessor_config.json").write_text(json.dumps(config))
+
+    rng = np.random.default_rng(0)
+    batch = [rng.normal(size=n).astype(np.float32) for n in (8000, 16000 * 4, 12000)]
+    kwargs = dict(sampling_rate=16000, return_tensors="np", padding=True, truncation=True,
+                  max_length=16000 * 3, return_attention_mask=True)
+
+    expected = transformers.Wav2Vec2FeatureExtractor.from_pretrained(str(tmp_path))(batch, **kwargs)
+    got = OnnxFeatureExtractor(str(tmp_path))(batch, **kwargs)
+
+    np.testing.assert_allclose(got["input_values"], expected["input_values"], atol=1e-5)
+    np.testing.assert_array_equal(got["attention_mask"], expected["attention_mask"])
+
+
+def test_onnx_config_labels():
+    with open(os.path.join(MODEL_CONFIG, "config.json")) as f:
+        labels = json.load(f)["id2label"]
+    assert OnnxConfig(MODEL_CONFIG).id2label == {int(k): v for k, v in labels.items()}
+
+
+def test_onnx_loading_does_not_import_torch(tmp_path):
+    # Only the loader path matters here: the ONNX Runtime session is stubbed out
+    script = (
+        "import sys, model_loader\n"
+        "model_loader.OnnxClassifier.__init__ = lambda self, path, config: setattr(self, 'config', config)\n"
+        f"model_loader.load_onnx_classifier({MODEL_CONFIG!r}, onnx_path={str(tmp_path / 'model.onnx')!r})\n"
+        "assert 'torch' not in sys.modules, 'torch was imported'\n"
+    )
+    (tmp_path / "model.onnx").write_bytes(b"")
+    subprocess.run([sys.executable, "-c", script], cwd=SERVER_DIR, check=True)
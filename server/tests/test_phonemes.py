@@ -0,0 +1,22 @@
+"""Usage (from the server folder): python -m pytest tests/test_phonemes.py"""
+import json
+
+import phonemes
+
+
+def test_target_sound_uses_kid_symbols():
+    assert phonemes.target_sound("E") == "ee"
+    assert phonemes.target_sound("ee") == "ee"
+    assert phonemes.target_sound("O") == "oo"
+    assert phonemes.target_sound(" sh ") == "sh"
+    assert phonemes.target_sound("H") == "h"
+    assert phonemes.target_sound("M") == "m"
+
+
+def test_every_snake_target_is_a_transcript_sound():
+    with open(phonemes.GAME_CONTENT_PATH, encoding="utf-8") as f:
+        snake = json.load(f)["snake"]
+    kid_sounds = set(phonemes.PHONEME_MAP.values())
+    for item_id, symbol in snake.items():
+        assert phonemes.target_sound(symbol) in kid_sounds, symbol
+        assert phonemes.target_sound(symbol) == phonemes.target_sound(item_id), item_id
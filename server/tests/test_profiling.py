@@ -0,0 +1,76 @@
+"""Usage (from the server folder): python -m pytest tests/test_profiling.py"""
+import cProfile
+import json
+import threading
+
+import pytest
+
+import profiling
+from stage_runner import Stage, run_job
+
+SECRET = "test-secret"
+
+
+class OneProfilerAtATime(cProfile.Profile):
+    """cProfile as on Python 3.12+: a second enable() anywhere in the process raises."""
+
+    _lock = threading.Lock()
+    _running = 0
+
+    def enable(self, *args, **kwargs):
+        with OneProfilerAtATime._lock:
+            if OneProfilerAtATime._running:
+                raise ValueError("Another profiling tool is already active")
+            OneProfilerAtATime._running += 1
+        self.running = True
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        if getattr(self, "running", False):  # pstats disables again when reading the stats
+            self.running = False
+            with OneProfilerAtATime._lock:
+                OneProfilerAtATime._running -= 1
+
+
+def multi_stage_job(n):
+    """Two rounds of concurrent stages, like an endpoint job."""
+    first = yield {"square": Stage(lambda: n * n), "double": Stage(lambda: n * 2)}
+    second = yield {"sum": Stage(lambda: first["square"] + first["double"])}
+    return second["sum"]
+
+
+@pytest.fixture
+def profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_SECRET", SECRET)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    def run(job):
+        profile, token = profiling.start_request({profiling.PROFILE_HEADER: SECRET}, "test")
+        try:
+            profile.enable_thread()
+            result = run_job(job)
+        finally:
+            profiling.finish_request(token)
+        return result, profile.save(200)
+
+    return run
+
+
+def test_profiles_a_multi_stage_job(profiled, tmp_path):
+    result, summary = profiled(multi_stage_job(3))
+
+    assert result == 15
+    assert summary["threads"] == 4  # Request thread plus one per stage
+    with open(tmp_path / f"{summary['id']}.json") as f:
+        assert json.load(f)["top"]
+
+
+def test_second_profiler_runs_unprofiled(profiled, monkeypatch):
+    monkeypatch.setattr(cProfile, "Profile", OneProfilerAtATime)
+
+    result, summary = profiled(multi_stage_job(3))
+
+    assert result == 15
+    assert summary["threads"] == 1  # Stage threads could not enable their own profiler
+    assert OneProfilerAtATime._running == 0
@@ -0,0 +1,47 @@
+"""Usage (from the server folder): python -m pytest tests/test_rescore.py"""
+import rescore
+
+
+class FakeApp:
+    """analyze_batch stand-in that keeps the uploads it was given."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.uploads = []
+
+    def analyze_batch(self, form, files):
+        self.uploads = list(files.values())
+        if self.fail:
+            raise RuntimeError("batch failed")
+        return {"results": []}
+
+    @staticmethod
+    def _split_view_result(rv):
+        return rv, 200
+
+
+def _tasks(tmp_path, n):
+    tasks = []
+    for i in range(n):
+        path = tmp_path / f"c{i}.wav"
+        path.write_bytes(b"RIFF")
+        tasks.append({"id": str(i), "path": str(path), "game": "balloon"})
+    return tasks
+
+
+def test_score_chunk_closes_clip_files(tmp_path, monkeypatch):
+    fake = FakeApp()
+    monkeypatch.setattr(rescore, "_app", fake)
+    rescore.score_chunk(_tasks(tmp_path, 3))
+    assert len(fake.uploads) == 3
+    assert all(upload.stream.closed for upload in fake.uploads)
+
+
+def test_score_chunk_closes_clip_files_on_error(tmp_path, monkeypatch):
+    fake = FakeApp(fail=True)
+    monkeypatch.setattr(rescore, "_app", fake)
+    try:
+        rescore.score_chunk(_tasks(tmp_path, 2))
+    except RuntimeError:
+        pass
+    assert fake.uploads and all(upload.stream.closed for upload in fake.uploads)
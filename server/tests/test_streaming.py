@@ -0,0 +1,87 @@
+"""Usage (from the server folder): python -m pytest tests/test_streaming.py"""
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from streaming import SessionRegistry, StreamingSession
+from stt_client import FakeSpeechTransport
+
+
+class RecordingStream:
+    """Streaming recognizer stand-in that remembers being aborted."""
+
+    def __init__(self):
+        self.fed = 0
+        self.aborted = False
+
+    def feed(self, pcm_bytes):
+        self.fed += len(pcm_bytes)
+
+    def finish(self, timeout=None):
+        return "", []
+
+    def abort(self):
+        self.aborted = True
+
+
+def _session(stream):
+    return StreamingSession({"targetPhoneme": "m", "tier": 1}, stream, lambda samples: Future())
+
+
+def _pcm(seconds):
+    return (np.zeros(int(seconds * 16000)) + 0.1 * 32767).astype("<i2").tobytes()
+
+
+def test_expired_session_is_closed():
+    registry = SessionRegistry(ttl=60)
+    stream = RecordingStream()
+    session = _session(stream)
+    assert registry.add(session)
+    session.feed(_pcm(0.5))
+
+    session.last_seen -= 120
+    assert registry.get(session.id) is None
+    assert stream.aborted
+    assert len(session.samples) == 0  # PCM buffer released
+    assert len(registry) == 0
+
+
+def test_active_session_is_kept():
+    registry = SessionRegistry(ttl=60)
+    stream = RecordingStream()
+    session = _session(stream)
+    registry.add(session)
+    assert registry.get(session.id) is session
+    assert not stream.aborted
+
+
+def test_discard_closes_session():
+    registry = SessionRegistry()
+    stream = RecordingStream()
+    session = _session(stream)
+    registry.add(session)
+    registry.discard(session.id)
+    assert stream.aborted
+    assert registry.get(session.id) is None
+
+
+def test_close_cancels_pending_window():
+    window = Future()
+    session = StreamingSession({}, RecordingStream(), lambda samples: window)
+    session.feed(_pcm(3.1))  # Fills the WavLM window
+    session.close()
+    assert window.cancelled()
+
+
+def test_too_long_stream_raises():
+    session = _session(RecordingStream())
+    with pytest.raises(ValueError):
+        session.feed(_pcm(31))
+
+
+def test_close_with_fake_transport_stream():
+    session = _session(FakeSpeechTransport(transcript="mmm").stream())
+    session.feed(_pcm(0.5))
+    session.close()
+    assert len(session.samples) == 0
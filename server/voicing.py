@@ -0,0 +1,104 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# ============================================================================
+# StamFree Backend - Voicing Detection
+# ============================================================================
+# Voicing is only ever used as a ratio threshold (PITCHED_RATIO_MIN, the >50%
+# nasal hum check), so the hot path does not need pyin's probabilistic
+# Viterbi decoding. The default "yin" backend is a vectorized YIN
+# (cumulative-mean-normalized difference) voiced/unvoiced detector; "pyin"
+# keeps librosa.pyin as the reference mode.
+
+VOICING_BACKEND = os.environ.get("VOICING_BACKEND", "yin")  # "yin" | "pyin"
+VOICING_BACKENDS = ("yin", "pyin")
+
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+YIN_THRESHOLD = float(os.environ.get("YIN_THRESHOLD", "0.15"))
+SILENCE_RMS = 1e-3  # Frames quieter than this are never voiced
+
+VoicingResult = namedtuple("VoicingResult", ["pitched_ratio", "voiced_mask"])
+
+
+def _frame(y, frame_length, hop_length):
+    """Centered, zero-padded frames (same frame grid as librosa.pyin)."""
+    padded = np.pad(y, frame_length // 2, mode="constant")
+    n_frames = 1 + (len(padded) - frame_length) // hop_length
+    strides = (padded.strides[0] * hop_length, padded.strides[0])
+    return np.lib.stride_tricks.as_strided(padded, shape=(n_frames, frame_length), strides=strides)
+
+
+def yin_voiced_frames(frames, sr, fmin, fmax, threshold=YIN_THRESHOLD):
+    """
+    Vectorized YIN voiced/unvoiced decision for a (n_frames, frame_length) array.
+    A frame is voiced when its cumulative-mean-normalized difference dips
+    below `threshold` somewhere in the [sr/fmax, sr/fmin] lag range.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    frame_length = frames.shape[1]
+    win = frame_length // 2
+
+    tau_min = max(1, int(np.floor(sr / fmax)))
+    tau_max = min(frame_length - win - 1, int(np.ceil(sr / fmin)))
+    if tau_max <= tau_min or len(frames) == 0:
+        return np.zeros(len(frames), dtype=bool)
+
+    # Autocorrelation r(tau) = sum_j x[j] * x[j + tau] for j < win, via FFT
+    n_fft = 1 << int(np.ceil(np.log2(frame_length + win)))
+    spec_head = np.fft.rfft(frames[:, :win], n=n_fft, axis=1)
+    spec_full = np.fft.rfft(frames, n=n_fft, axis=1)
+    acf = np.fft.irfft(np.conj(spec_head) * spec_full, n=n_fft, axis=1)[:, :tau_max + 1]
+
+    # Energy e(tau) = sum_j x[j + tau]^2 for j < win
+    power = np.cumsum(np.pad(frames ** 2, ((0, 0), (1, 0))), axis=1)
+    lags = np.arange(tau_max + 1)
+    energy = power[:, lags + win] - power[:, lags]
+
+    # Difference function and its cumulative mean normalization
+    diff = np.maximum(energy[:, :1] + energy - 2.0 * acf, 0.0)
+    cumsum = np.cumsum(diff[:, 1:], axis=1)
+    cmnd = np.ones_like(diff)
+    cmnd[:, 1:] = diff[:, 1:] * lags[1:] / np.maximum(cumsum, np.finfo(float).tiny)
+
+    voiced = np.min(cmnd[:, tau_min:tau_max + 1], axis=1) < threshold
+
+    # Silence gate: zero-energy frames have a degenerate difference function
+    frame_rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return voiced & (frame_rms > SILENCE_RMS)
+
+
+def yin_voiced_mask(y, sr, fmin, fmax, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH,
+                    threshold=YIN_THRESHOLD):
+    """Per-frame YIN voicing over a whole clip (same frame grid as librosa.pyin)."""
+    frames = _frame(np.asarray(y, dtype=np.float64), frame_length, hop_length)
+    return yin_voiced_frames(frames, sr, fmin, fmax, threshold=threshold)
+
+
+def pyin_voiced_mask(y, sr, fmin, fmax, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH):
+    """Reference voicing decision from librosa.pyin (slow, Viterbi-decoded)."""
+    import librosa
+
+    _, voiced_flag, _ = librosa.pyin(
+        y, fmin=fmin, fmax=fmax, sr=sr, frame_length=frame_length, hop_length=hop_length
+    )
+    return np.asarray(voiced_flag, dtype=bool)
+
+
+def estimate_voicing(y, sr, fmin, fmax, backend=None):
+    """
+    Voiced-frame mask and pitched ratio using the selected backend.
+    Returns: VoicingResult(pitched_ratio, voiced_mask)
+    """
+    backend = backend or VOICING_BACKEND
+    if backend == "pyin":
+        mask = pyin_voiced_mask(y, sr, fmin, fmax)
+    elif backend == "yin":
+        mask = yin_voiced_mask(y, sr, fmin, fmax)
+    else:
+        raise ValueError(f"Unknown voicing backend '{backend}' (expected one of {VOICING_BACKENDS})")
+
+    pitched_ratio = float(np.mean(mask)) if len(mask) > 0 else 0.0
+    return VoicingResult(pitched_ratio, mask)
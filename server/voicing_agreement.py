@@ -0,0 +1,142 @@
+"""
+Voicing backend agreement harness.
+
+Compares the fast YIN voicing backend with the librosa.pyin reference on
+synthetic clips (hums, breathy noise, silence, intermittent voicing) and,
+optionally, a directory of recorded clips.
+
+Usage (from the server folder):
+    python voicing_agreement.py
+    python voicing_agreement.py --clips ./recordings --json report.json
+
+Exits non-zero when the decision agreement falls below --min-agreement.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import librosa
+
+from audio_clip import SAMPLE_RATE, load_clip
+from voicing import estimate_voicing
+
+PITCHED_RATIO_MIN = float(os.environ.get("PITCHED_RATIO_MIN", "0.15"))
+NASAL_RATIO_MIN = 0.5
+
+# (name, fmin, fmax, decision threshold) - mirrors the two call sites in app.py
+CHECKS = [
+    ("voicing_noise", 80.0, 400.0, PITCHED_RATIO_MIN),
+    ("nasal", float(librosa.note_to_hz('C2')), float(librosa.note_to_hz('C7')), NASAL_RATIO_MIN),
+]
+
+AUDIO_EXTENSIONS = (".wav", ".m4a", ".mp3", ".webm", ".flac", ".ogg")
+
+
+def _hum(t, f0, rng, vibrato=0.0):
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + vibrato * np.sin(2 * np.pi * 5 * t))) / SAMPLE_RATE
+    y = sum((0.5 / k) * np.sin(k * phase) for k in range(1, 6))
+    return 0.3 * y / np.max(np.abs(y)) + 0.002 * rng.randn(len(t))
+
+
+def synthetic_clips(seconds=2.0, seed=0):
+    """Labelled synthetic clips covering the cases the games care about."""
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    noise = rng.randn(len(t))
+    clips = {
+        "hum_110hz": _hum(t, 110, rng),
+        "hum_220hz": _hum(t, 220, rng),
+        "hum_330hz_vibrato": _hum(t, 330, rng, vibrato=0.03),
+        "hum_220hz_snr10": _hum(t, 220, rng) + 0.03 * noise,
+        "hum_intermittent": _hum(t, 200, rng) * (np.sin(2 * np.pi * 1.0 * t) > 0),
+        "breathy_noise": 0.05 * noise,
+        "white_noise": 0.2 * noise,
+        "hiss_s": 0.1 * librosa.effects.preemphasis(noise, coef=0.97),
+        "silence": np.zeros_like(t),
+    }
+    return {name: y.astype(np.float32) for name, y in clips.items()}
+
+
+def recorded_clips(directory):
+    clips = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(AUDIO_EXTENSIONS):
+            try:
+                clips[name] = load_clip(os.path.join(directory, name)).samples
+            except Exception as e:
+                print(f"⚠️ Skipping {name}: {e}")
+    return clips
+
+
+def compare(y):
+    """Run both backends for every check on one clip."""
+    rows = []
+    for check, fmin, fmax, threshold in CHECKS:
+        row = {"check": check}
+        masks = {}
+        for backend in ("pyin", "yin"):
+            t0 = time.perf_counter()
+            result = estimate_voicing(y, SAMPLE_RATE, fmin=fmin, fmax=fmax, backend=backend)
+            row[f"{backend}_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+            row[f"{backend}_ratio"] = round(result.pitched_ratio, 3)
+            masks[backend] = result.voiced_mask
+        n = min(len(masks["pyin"]), len(masks["yin"]))
+        row["frame_agreement"] = round(float(np.mean(masks["pyin"][:n] == masks["yin"][:n])), 3) if n else 1.0
+        row["decision_agrees"] = (row["pyin_ratio"] >= threshold) == (row["yin_ratio"] >= threshold)
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare YIN and pyin voicing backends.")
+    parser.add_argument("--clips", help="Directory of recorded clips to include")
+    parser.add_argument("--no-synthetic", action="store_true", help="Only use recorded clips")
+    parser.add_argument("--json", help="Write the full report to this path")
+    parser.add_argument("--min-agreement", type=float, default=0.9,
+                        help="Minimum fraction of agreeing threshold decisions (default 0.9)")
+    args = parser.parse_args(argv)
+
+    clips = {} if args.no_synthetic else synthetic_clips()
+    if args.clips:
+        clips.update(recorded_clips(args.clips))
+    if not clips:
+        print("❌ No clips to compare")
+        return 2
+
+    report = []
+    print(f"{'clip':<28}{'check':<15}{'pyin':>7}{'yin':>7}{'frames':>8}{'agree':>7}{'pyin ms':>9}{'yin ms':>8}")
+    for name, y in clips.items():
+        for row in compare(y):
+            row["clip"] = name
+            report.append(row)
+            print(f"{name:<28}{row['check']:<15}{row['pyin_ratio']:>7.3f}{row['yin_ratio']:>7.3f}"
+                  f"{row['frame_agreement']:>8.3f}{str(row['decision_agrees']):>7}"
+                  f"{row['pyin_ms']:>9.1f}{row['yin_ms']:>8.1f}")
+
+    agreement = float(np.mean([row["decision_agrees"] for row in report]))
+    speedup = sum(r["pyin_ms"] for r in report) / max(1e-6, sum(r["yin_ms"] for r in report))
+    summary = {
+        "clips": len(clips),
+        "decision_agreement": round(agreement, 3),
+        "mean_frame_agreement": round(float(np.mean([r["frame_agreement"] for r in report])), 3),
+        "mean_ratio_abs_diff": round(float(np.mean([abs(r["pyin_ratio"] - r["yin_ratio"]) for r in report])), 3),
+        "speedup": round(speedup, 1),
+    }
+    print(f"\n📊 {json.dumps(summary)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "rows": report}, f, indent=2)
+
+    if agreement < args.min_agreement:
+        print(f"❌ Decision agreement {agreement:.3f} below {args.min_agreement}")
+        return 1
+    print("✅ Backends agree")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())